@@ -0,0 +1,83 @@
+# time chinese substring search through the ngram index against a like '%...%' scan on a mixed zh/en corpus
+# usage: python bench/bench_cjk_search.py [documents]  (uses a throwaway sqlite database, no server needed)
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from sqlite_database import SQLiteDatabase
+
+DOCUMENTS = 2000
+CHARS_PER_DOCUMENT = 5000
+REPEAT = 10
+# common characters of course material, so that bigrams repeat the way they do in real text
+HANZI = ('的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种'
+         '面而方后多定行学法所民得经十三之进着等部度家电力里如水化高自二理起小物现实加量都两体制机当使点从业本'
+         '去把性好应开它合还因由其些然前外天政四日那社义事平形相全表间样与关各重新线内数正心反你明看原又么利比'
+         '或但质气第向道命此变条只没结解问意建月公无系军很情者最立代想已通并提直题党程展五果料象员革位入常文总'
+         '次品式活设及管特件长求老头基资边流路级少图山统接知较将组见计别她手角期根论运农指几九区强放决西被干做'
+         '必战先回则任取据处府研')
+WORDS = ['database', 'index', 'query', 'system', 'network', 'protocol', 'algorithm', 'memory', 'process',
+         'thread', 'compiler', 'kernel', 'graph', 'tree', 'hash', 'search', 'cache', 'lecture', 'chapter']
+
+
+def document(rng):
+    parts = []
+    length = 0
+    while length < CHARS_PER_DOCUMENT:
+        if rng.random() < 0.7:
+            part = ''.join(rng.choice(HANZI) for _ in range(rng.randint(4, 30)))
+        else:
+            part = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 8)))
+        parts.append(part)
+        length += len(part)
+    return '，'.join(parts)
+
+
+def measure(func, *args):
+    times = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def scan(database, keyword):
+    # textfiles may be compressed, the chunks hold the same text uncompressed
+    with database.pool.connection() as conn:
+        return conn.execute("select distinct files_file_id from textchunks where content like '%' || ? || '%'",
+                            (keyword,)).fetchall()
+
+
+def main():
+    documents = int(sys.argv[1]) if len(sys.argv) > 1 else DOCUMENTS
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as directory:
+        database = SQLiteDatabase(os.path.join(directory, 'bench.db'))
+        database.add_class('bench', 'bench')
+        class_id = database.get_classes()[0][0]
+        chapter_id = database.add_chapter(class_id, 'bench')
+        texts = [document(rng) for _ in range(documents)]
+        start = time.perf_counter()
+        database.add_files([(f'{idx}.txt', f'/bench/{idx}.txt', 'txt', len(text), chapter_id, class_id, text)
+                            for idx, text in enumerate(texts)])
+        print(f'indexed {documents} documents in {time.perf_counter() - start:.2f}s')
+        # keywords cut out of the corpus, from one character up to a short phrase
+        keywords = ['数', '数据', '统计', '程序设计', 'database', '数据 index']
+        keywords.append(next(part for part in texts[0].split('，') if len(part) >= 6 and ' ' not in part)[:6])
+        print(f'{"keyword":<16} {"hits":>6} {"index (ms)":>12} {"scan (ms)":>12}')
+        for keyword in keywords:
+            hits = len(database.search(keyword))
+            indexed = measure(database.search_files, keyword, 100, 50, 0)
+            scanned = measure(scan, database, keyword) if ' ' not in keyword else float('nan')
+            print(f'{keyword:<16} {hits:>6} {indexed:>12.2f} {scanned:>12.2f}')
+        database.pool.close()
+
+
+if __name__ == '__main__':
+    main()
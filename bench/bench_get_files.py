@@ -0,0 +1,72 @@
+# time CorporaDatabase.get_files for classes with a growing number of chapters
+# usage: python bench/bench_get_files.py  (needs the mysql corpora database from the install steps)
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from mysql_database import MySQLDatabase
+
+CHAPTER_COUNTS = [1, 10, 30, 60, 120]
+FILES_PER_CHAPTER = 5
+REPEAT = 20
+
+
+def get_files_per_chapter(database, class_id):
+    # the old implementation, one query for the chapters and one more for each chapter
+    database.cursor.execute('select chapter_id, chapter_name, total_size from chapters where classes_class_id = %s',
+                            class_id)
+    chapters = {chapter[0]: (chapter[1], chapter[2]) for chapter in database.cursor.fetchall()}
+    files = {}
+    for chapter in chapters.keys():
+        database.cursor.execute('select file_id, file_name, file_address, file_type, file_size from files '
+                                'where chapters_chapter_id = %s '
+                                'and chapters_classes_class_id = %s', (chapter, class_id))
+        files[chapter] = database.cursor.fetchall()
+    return files, chapters
+
+
+def create_class(database, chapter_count):
+    class_name = f'bench-get-files-{chapter_count}'
+    database.add_class(class_name, 'bench')
+    class_id = [cls[0] for cls in database.get_classes() if cls[1] == class_name][-1]
+    for idx in range(chapter_count):
+        database.add_chapter(class_id, f'chapter {idx}')
+    database.cursor.execute('select chapter_id from chapters where classes_class_id = %s', class_id)
+    files = []
+    for (chapter_id,) in database.cursor.fetchall():
+        for idx in range(FILES_PER_CHAPTER):
+            files.append((f'file {idx}.txt', f'/bench/file {idx}.txt', 'txt', '1024', chapter_id, class_id, None))
+    database.add_files(files)
+    return class_id
+
+
+def measure(func, *args):
+    times = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def main():
+    database = MySQLDatabase()
+    print(f'{"chapters":>8} {"per chapter (ms)":>18} {"single query (ms)":>18}')
+    # one borrowed connection for the whole run, database.cursor is the cursor of the pooled connection
+    with database.pool.connection():
+        for chapter_count in CHAPTER_COUNTS:
+            class_id = create_class(database, chapter_count)
+            try:
+                assert get_files_per_chapter(database, class_id)[1] == database.get_files(class_id)[1]
+                old = measure(get_files_per_chapter, database, class_id)
+                new = measure(database.get_files, class_id)
+                print(f'{chapter_count:>8} {old:>18.2f} {new:>18.2f}')
+            finally:
+                database.delete_class(class_id)
+
+
+if __name__ == '__main__':
+    main()
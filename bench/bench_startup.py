@@ -0,0 +1,81 @@
+# how long the app takes from the start of the process to its first frame and to the widgets showing the database,
+# over a number of starts. the app runs offscreen on a throwaway sqlite database with CORPORA_STARTUP_PROFILE set
+# usage: python bench/bench_startup.py [--runs N] [--database path.db] [--importtime]
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+# the app loads its resources relative to src
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+MILESTONES = ['imported', 'window', 'first_frame', 'database', 'populated']
+# modules listed from -X importtime
+TOP_IMPORTS = 15
+
+
+def start(env, importtime=False):
+    # ({milestone: seconds since the process was spawned}, stderr)
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['ui.py']
+    spawned = time.time()
+    process = subprocess.run(command, cwd=SRC, env=env, capture_output=True, text=True, timeout=120)
+    profile = None
+    for line in process.stdout.splitlines():
+        if line.startswith('{'):
+            profile = json.loads(line)
+    if profile is None:
+        raise RuntimeError(f'no profile printed, exit code {process.returncode}:\n{process.stderr[-2000:]}')
+    return {name: at - spawned for name, at in profile.items()}, process.stderr
+
+
+def slowest_imports(stderr):
+    # [(cumulative us, module)] of the modules at the top level of the import tree
+    imports = []
+    for line in stderr.splitlines():
+        match = re.match(r'import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)', line)
+        if match and len(match.group(3)) <= 1:
+            imports.append((int(match.group(2)), match.group(4)))
+    return sorted(imports, reverse=True)[:TOP_IMPORTS]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the start of the app')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--database', help='sqlite database to start on, a new empty one if not given')
+    parser.add_argument('--importtime', action='store_true', help='also list the slowest imports of one start')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(os.environ, QT_QPA_PLATFORM=os.environ.get('QT_QPA_PLATFORM', 'offscreen'),
+                   CORPORA_BACKEND='sqlite', CORPORA_STARTUP_PROFILE='1',
+                   CORPORA_SQLITE_PATH=args.database or os.path.join(directory, 'startup.db'))
+        # the first start creates the database and warms the file cache, it isn't counted
+        start(env)
+        times = defaultdict(list)
+        for _ in range(args.runs):
+            profile, _ = start(env)
+            for name, seconds in profile.items():
+                times[name].append(seconds)
+        if args.importtime:
+            _, stderr = start(env, importtime=True)
+
+    print(f'{"milestone (ms from spawn)":<26} {"p50":>8} {"p90":>8} {"max":>8}')
+    for name in MILESTONES:
+        if name not in times:
+            continue
+        values = sorted(times[name])
+        p50 = values[len(values) // 2] * 1000
+        p90 = values[min(len(values) - 1, int(0.9 * len(values)))] * 1000
+        print(f'{name:<26} {p50:>8.1f} {p90:>8.1f} {values[-1] * 1000:>8.1f}')
+    if args.importtime:
+        print(f'\n{"slowest imports":<40} {"ms":>8}')
+        for micros, module in slowest_imports(stderr):
+            print(f'{module:<40} {micros / 1000:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+# the app end to end on a synthetic corpus: text extraction per file type, ingest, the reads behind the file views,
+# search latency, and the refresh of the widgets rendered offscreen. results are written as json, a run can be
+# compared with the results of another commit
+# usage: python bench/bench_suite.py [--classes N] [--chapters M] [--files K] [--seed S] [--output results.json]
+#                                    [--baseline old.json]  (uses a throwaway sqlite database, no server needed)
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import corpus as synthetic
+from content import get_text
+from database import SearchFilters
+from sqlite_database import SQLiteDatabase
+
+REPEAT = 10
+BATCH_SIZE = 64
+
+
+def summary(times, **extra):
+    # latencies in ms, percentiles by nearest rank
+    times = sorted(times)
+
+    def percentile(q):
+        return round(times[min(len(times) - 1, int(q * len(times)))] * 1000, 3)
+
+    result = {'count': len(times), 'mean_ms': round(sum(times) / len(times) * 1000, 3), 'p50_ms': percentile(0.5),
+              'p90_ms': percentile(0.9), 'p99_ms': percentile(0.99), 'max_ms': round(times[-1] * 1000, 3)}
+    result.update(extra)
+    return result
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def repeat(func, *args):
+    return [timed(func, *args)[0] for _ in range(REPEAT)]
+
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def keywords(rng, texts):
+    # a single hanzi, two and four hanzi cut out of the corpus, an english word and two words that appear together
+    runs = [run for text in texts for run in text.replace('\n', '，').split('，')]
+    hanzi = [run for run in runs if len(run) >= 4 and not run.isascii()]
+    english = [run.split() for run in runs if run.isascii() and len(run.split()) >= 2]
+    first = rng.choice(hanzi)
+    words = rng.choice(english)
+    return [first[0], first[:2], rng.choice(hanzi)[:4], words[0], ' '.join(words[:2])]
+
+
+def bench_extract(files, results):
+    # {path: text}
+    texts = {}
+    times = defaultdict(list)
+    chars = defaultdict(int)
+    sizes = defaultdict(int)
+    for class_name, chapter_name, path, file_type in files:
+        elapsed, texts[path] = timed(get_text, path, file_type)
+        times[file_type].append(elapsed)
+        chars[file_type] += len(texts[path])
+        sizes[file_type] += os.path.getsize(path)
+    for file_type in sorted(times):
+        total = sum(times[file_type])
+        results[f'extract.{file_type}'] = summary(times[file_type], chars_per_s=round(chars[file_type] / total),
+                                                  file_mib_per_s=round(sizes[file_type] / total / 1024 / 1024, 3))
+    return texts
+
+
+def create_chapters(database, files):
+    # {(class_name, chapter_name): (chapter_id, class_id)}
+    chapters = {}
+    for class_name, chapter_name, path, file_type in files:
+        if (class_name, chapter_name) in chapters:
+            continue
+        class_ids = {name: class_id for class_id, name, teacher in database.get_classes()}
+        if class_name not in class_ids:
+            database.add_class(class_name, 'bench')
+            class_ids = {name: class_id for class_id, name, teacher in database.get_classes()}
+        chapters[class_name, chapter_name] = (database.add_chapter(class_ids[class_name], chapter_name),
+                                              class_ids[class_name])
+    return chapters
+
+
+def bench_ingest(database, files, texts, results):
+    # one file at a time, the way add_file and add_textfile are called one after the other
+    chapters = create_chapters(database, files)
+    times = []
+    for class_name, chapter_name, path, file_type in files:
+        chapter_id, class_id = chapters[class_name, chapter_name]
+        start = time.perf_counter()
+        file_id = database.add_file(os.path.basename(path), path, file_type, str(os.path.getsize(path)),
+                                    chapter_id, class_id)
+        database.add_textfile(file_id, texts[path])
+        times.append(time.perf_counter() - start)
+    text_bytes = sum(len(text.encode()) for text in texts.values())
+    results['ingest.add_file'] = summary(times, files_per_s=round(len(times) / sum(times), 1),
+                                         text_mib_per_s=round(text_bytes / sum(times) / 1024 / 1024, 3))
+
+
+def bench_ingest_batch(database, files, texts, results):
+    # in transactions of BATCH_SIZE files, the way the gui and the folder watcher import
+    chapters = create_chapters(database, files)
+    rows = [(os.path.basename(path), path, file_type, str(os.path.getsize(path)),
+             *chapters[class_name, chapter_name], texts[path]) for class_name, chapter_name, path, file_type in files]
+    times = [timed(database.add_files, rows[start:start + BATCH_SIZE])[0] for start in range(0, len(rows), BATCH_SIZE)]
+    results['ingest.add_files'] = summary(times, files_per_s=round(len(rows) / sum(times), 1))
+
+
+def bench_reads(database, rng, texts, results):
+    class_ids = [class_id for class_id, class_name, teacher in database.get_classes()]
+    results['get_files'] = summary([elapsed for class_id in class_ids for elapsed in repeat(database.get_files,
+                                                                                              class_id)])
+    results['get_all_files'] = summary(repeat(database.get_all_files), rows=len(database.get_all_files()))
+    results['get_all_files_page'] = summary(repeat(database.get_all_files_page, 0, 500))
+    search = []
+    search_files = []
+    search_chapter = []
+    hits = {}
+    searched = keywords(rng, list(texts.values()))
+    # a search restricted to one chapter, what the filters of the search page do
+    chapter = SearchFilters(chapter_id=next(iter(database.get_files(class_ids[-1])[1])))
+    for keyword in searched:
+        hits[keyword] = len(database.search(keyword))
+        search += repeat(database.search, keyword)
+        search_files += repeat(database.search_files, keyword, 100, 50, 0)
+        search_chapter += repeat(database.search_files, keyword, 100, 50, 0, None, chapter)
+    results['search'] = summary(search, hits=hits)
+    results['search_files'] = summary(search_files)
+    results['search_files.chapter'] = summary(search_chapter)
+    return searched
+
+
+def bench_widgets(path, keyword, results):
+    # the widgets of the gui against the database just built, rendered without a screen
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    os.environ['CORPORA_BACKEND'] = 'sqlite'
+    os.environ['CORPORA_SQLITE_PATH'] = path
+    from PyQt5.QtCore import QEventLoop
+    from PyQt5.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    import ui
+
+    def settle():
+        # until every read the widget asked for has been delivered and drawn
+        while ui.executor.pending:
+            app.processEvents(QEventLoop.AllEvents | QEventLoop.WaitForMoreEvents)
+        app.processEvents()
+
+    def refresh(widget, func, *args):
+        widget.resize(1100, 700)
+        widget.show()
+        settle()
+        times = []
+        for _ in range(REPEAT):
+            # a cold refresh, what the widget costs when the query cache doesn't have the result
+            if isinstance(ui.database.connect(), ui.CachedDatabase):
+                ui.database.connect().cache.clear()
+            start = time.perf_counter()
+            func(*args)
+            settle()
+            times.append(time.perf_counter() - start)
+        widget.close()
+        return times
+
+    filelist = ui.FilelistWidget(None)
+    class_ids = [class_id for class_id, class_name, teacher in ui.database.get_classes()]
+    results['widget.filelist'] = summary([elapsed for class_id in class_ids
+                                          for elapsed in refresh(filelist, filelist.change_class, class_id)])
+    files = ui.FilesWidget('Files')
+    results['widget.files'] = summary(refresh(files, files.refresh), rows=files.model.rowCount())
+    search = ui.SearchWidget('Search')
+    search.search_bar.setText(keyword)
+    results['widget.search'] = summary(refresh(search, search.search), rows=search.model.rowCount())
+    ui.executor.shutdown()
+
+
+def compare(report, baseline):
+    if report['parameters'] != baseline['parameters']:
+        print(f'warning: the baseline was run with {baseline["parameters"]}', file=sys.stderr)
+    results, baseline = report['results'], baseline['results']
+    print(f'{"benchmark":<24} {"baseline p50 (ms)":>18} {"p50 (ms)":>12} {"ratio":>8}', file=sys.stderr)
+    for name, result in results.items():
+        if name in baseline:
+            old, new = baseline[name]['p50_ms'], result['p50_ms']
+            ratio = new / old if old else float('nan')
+            print(f'{name:<24} {old:>18.3f} {new:>12.3f} {ratio:>8.2f}', file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the app on a synthetic corpus')
+    parser.add_argument('--classes', type=int, default=3)
+    parser.add_argument('--chapters', type=int, default=4, help='chapters per class')
+    parser.add_argument('--files', type=int, default=10, help='files per chapter')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='-', help='file the json results are written to, - for stdout')
+    parser.add_argument('--baseline', help='json results of an earlier run to compare with')
+    parser.add_argument('--no-widgets', action='store_true', help='skip the widgets, e.g. without PyQt5')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        files = synthetic.generate(os.path.join(directory, 'corpus'), args.classes, args.chapters, args.files,
+                                   args.seed)
+        texts = bench_extract(files, results)
+        database = SQLiteDatabase(os.path.join(directory, 'bench.db'))
+        bench_ingest(database, files, texts, results)
+        searched = bench_reads(database, rng, texts, results)
+        database.pool.close()
+        batched = SQLiteDatabase(os.path.join(directory, 'batched.db'))
+        bench_ingest_batch(batched, files, texts, results)
+        batched.pool.close()
+        if not args.no_widgets:
+            # the widgets print what they do, keep it out of the json
+            with contextlib.redirect_stdout(sys.stderr):
+                # two hanzi, the usual length of a chinese search
+                bench_widgets(os.path.join(directory, 'bench.db'), searched[1], results)
+
+    report = {
+        'commit': commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'sqlite': sqlite3.sqlite_version,
+        'parameters': {'classes': args.classes, 'chapters': args.chapters, 'files': args.files, 'seed': args.seed,
+                       'repeat': REPEAT},
+        'results': results,
+    }
+    if args.output == '-':
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    else:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+# database size, insert throughput and search latency with the text of textfiles stored plain and compressed,
+# and after compressing a plain database with compress_texts
+# usage: python bench/bench_text_storage.py [documents]  (uses throwaway sqlite databases, no server needed)
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import textstore
+from bench_cjk_search import document, measure
+from sqlite_database import SQLiteDatabase
+
+DOCUMENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+BATCH_SIZE = 64
+KEYWORDS = ['数据', 'database', '程序设计']
+
+
+def size(database):
+    # the database file after the wal is written back and free pages are dropped
+    with database.pool.connection() as conn:
+        conn.execute('pragma wal_checkpoint(truncate)')
+        conn.execute('vacuum')
+    return os.path.getsize(database.path) / 1024 / 1024
+
+
+def stored_text(database):
+    # bytes of textfiles, the part compression can shrink, textchunks and the indexes stay the same
+    with database.pool.connection() as conn:
+        return conn.execute('select sum(coalesce(length(content_z), length(cast(content as blob)))) '
+                            'from textfiles').fetchone()[0] / 1024 / 1024
+
+
+def build(path, texts, compress):
+    textstore.COMPRESS_TEXT = compress
+    database = SQLiteDatabase(path)
+    database.add_class('bench', 'bench')
+    class_id = database.get_classes()[0][0]
+    chapter_id = database.add_chapter(class_id, 'bench')
+    start = time.perf_counter()
+    for first in range(0, len(texts), BATCH_SIZE):
+        database.add_files([(f'{idx}.txt', f'/bench/{idx}.txt', 'txt', len(text), chapter_id, class_id, text)
+                            for idx, text in enumerate(texts[first:first + BATCH_SIZE], first)])
+    return database, len(texts) / (time.perf_counter() - start)
+
+
+def report(name, database, throughput):
+    search_files = sum(measure(database.search_files, keyword, 100, 50, 0) for keyword in KEYWORDS) / len(KEYWORDS)
+    search = sum(measure(database.search, keyword) for keyword in KEYWORDS) / len(KEYWORDS)
+    print(f'{name:<12} {size(database):>10.1f} {stored_text(database):>10.1f} {throughput:>14.0f} '
+          f'{search_files:>18.2f} {search:>12.2f}')
+
+
+def main():
+    rng = random.Random(0)
+    texts = [document(rng) for _ in range(DOCUMENTS)]
+    # rows per second are inserted files, for migrated the files compress_texts went through
+    print(f'{"storage":<12} {"size (MiB)":>10} {"text (MiB)":>10} {"rows (1/s)":>14} {"search_files (ms)":>18} '
+          f'{"search (ms)":>12}')
+    with tempfile.TemporaryDirectory() as directory:
+        plain, throughput = build(os.path.join(directory, 'plain.db'), texts, False)
+        report('plain', plain, throughput)
+        compressed, throughput = build(os.path.join(directory, 'compressed.db'), texts, True)
+        report('compressed', compressed, throughput)
+        start = time.perf_counter()
+        count = plain.compress_texts()
+        migration = count / (time.perf_counter() - start)
+        report('migrated', plain, migration)
+        plain.pool.close()
+        compressed.pool.close()
+
+
+if __name__ == '__main__':
+    main()
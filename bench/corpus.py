@@ -0,0 +1,163 @@
+# a synthetic corpus on disk: classes / chapters / files of mixed type with mixed zh/en text, the same for the same seed
+# usage: python bench/corpus.py directory [classes] [chapters per class] [files per chapter]
+import os
+import random
+import sys
+
+import docx
+import pptx
+
+from bench_cjk_search import HANZI, WORDS
+
+FILE_TYPES = ['pdf', 'docx', 'pptx', 'txt']
+# characters of text in a file, the actual length is between half and one and a half times this
+CHARS_PER_FILE = 4000
+# how the text of a pdf page and a slide is laid out
+CHARS_PER_LINE = 40
+LINES_PER_PAGE = 50
+LINES_PER_SLIDE = 12
+
+
+def sentence(rng):
+    # a run of hanzi or a few english words, about as often as in the course material the app is used for
+    if rng.random() < 0.7:
+        return ''.join(rng.choice(HANZI) for _ in range(rng.randint(4, 30)))
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 8)))
+
+
+def lines(rng, chars):
+    # [line], text wrapped at CHARS_PER_LINE
+    result = []
+    line = ''
+    while chars > 0:
+        part = sentence(rng) + '，'
+        chars -= len(part)
+        while len(line) + len(part) > CHARS_PER_LINE:
+            cut = CHARS_PER_LINE - len(line)
+            result.append(line + part[:cut])
+            line, part = '', part[cut:]
+        line += part
+    if line:
+        result.append(line)
+    return result
+
+
+def pages_of(items, size):
+    return [items[start:start + size] for start in range(0, len(items), size)] or [[]]
+
+
+def write_pdf(path, pages):
+    """a pdf with one text line per entry of every page. the font is not embedded, its ToUnicode map gives
+    every glyph id the code point of the same number, enough for pdfplumber to extract the text
+    """
+    objects = []
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    def stream(data):
+        return b'<< /Length %d >>\nstream\n' % len(data) + data + b'\nendstream'
+
+    # a range may not cross a change of the first byte, so one range for every first byte
+    ranges = ''.join(f'1 beginbfrange <{high:02X}00> <{high:02X}FF> <{high:02X}00> endbfrange\n' for high in range(256))
+    cmap = ('/CIDInit /ProcSet findresource begin 12 dict begin begincmap /CMapName /Bench def '
+            '1 begincodespacerange <0000> <FFFF> endcodespacerange\n' + ranges +
+            'endcmap CMapName currentdict /CMap defineresource pop end end')
+    to_unicode = add(stream(cmap.encode()))
+    descriptor = add(b'<< /Type /FontDescriptor /FontName /Bench /Flags 4 /FontBBox [0 -120 1000 880] '
+                     b'/ItalicAngle 0 /Ascent 880 /Descent -120 /CapHeight 700 /StemV 80 >>')
+    cid_font = add(b'<< /Type /Font /Subtype /CIDFontType2 /BaseFont /Bench /CIDSystemInfo << /Registry (Adobe) '
+                   b'/Ordering (Identity) /Supplement 0 >> /FontDescriptor %d 0 R /DW 1000 >>' % descriptor)
+    font = add(b'<< /Type /Font /Subtype /Type0 /BaseFont /Bench /Encoding /Identity-H '
+               b'/DescendantFonts [%d 0 R] /ToUnicode %d 0 R >>' % (cid_font, to_unicode))
+    # the page tree comes after the contents and the pages
+    pages_id = len(objects) + 2 * len(pages) + 1
+    kids = []
+    for page in pages:
+        operators = ['BT /F1 12 Tf 14 TL 40 800 Td']
+        operators += ['<' + ''.join(f'{ord(char):04X}' for char in line) + '> Tj T*' for line in page]
+        operators.append('ET')
+        contents = add(stream('\n'.join(operators).encode()))
+        kids.append(add(b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] /Contents %d 0 R '
+                        b'/Resources << /Font << /F1 %d 0 R >> >> >>' % (pages_id, contents, font)))
+    add(b'<< /Type /Pages /Kids [%s] /Count %d >>' % (b' '.join(b'%d 0 R' % kid for kid in kids), len(kids)))
+    catalog = add(b'<< /Type /Catalog /Pages %d 0 R >>' % pages_id)
+    data = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(data))
+        data += b'%d 0 obj\n' % number + body + b'\nendobj\n'
+    xref = len(data)
+    data += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    data += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    data += b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, catalog, xref)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def write_docx(path, text_lines):
+    document = docx.Document()
+    for line in text_lines:
+        document.add_paragraph(line)
+    document.save(path)
+
+
+def write_pptx(path, slides):
+    presentation = pptx.Presentation()
+    layout = presentation.slide_layouts[6]
+    for slide_lines in slides:
+        slide = presentation.slides.add_slide(layout)
+        box = slide.shapes.add_textbox(pptx.util.Inches(0.5), pptx.util.Inches(0.5),
+                                       pptx.util.Inches(9), pptx.util.Inches(6.5))
+        box.text_frame.text = '\n'.join(slide_lines)
+    presentation.save(path)
+
+
+def write_txt(path, text_lines):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(text_lines))
+
+
+def write_file(path, file_type, text_lines):
+    if file_type == 'pdf':
+        write_pdf(path, pages_of(text_lines, LINES_PER_PAGE))
+    elif file_type == 'docx':
+        write_docx(path, text_lines)
+    elif file_type == 'pptx':
+        write_pptx(path, pages_of(text_lines, LINES_PER_SLIDE))
+    else:
+        write_txt(path, text_lines)
+
+
+def generate(directory, classes=3, chapters=4, files=10, seed=0, file_types=None):
+    """write classes x chapters x files files below directory
+    returns [(class_name, chapter_name, path, file_type)] in the order they were written
+    """
+    rng = random.Random(seed)
+    file_types = file_types or FILE_TYPES
+    corpus = []
+    for class_idx in range(classes):
+        class_name = f'class {class_idx}'
+        for chapter_idx in range(chapters):
+            chapter_name = f'chapter {chapter_idx}'
+            folder = os.path.join(directory, f'class{class_idx}', f'chapter{chapter_idx}')
+            os.makedirs(folder, exist_ok=True)
+            for file_idx in range(files):
+                file_type = file_types[rng.randrange(len(file_types))]
+                path = os.path.join(folder, f'file{file_idx}.{file_type}')
+                write_file(path, file_type, lines(rng, rng.randint(CHARS_PER_FILE // 2, CHARS_PER_FILE * 3 // 2)))
+                corpus.append((class_name, chapter_name, path, file_type))
+    return corpus
+
+
+def main():
+    directory = sys.argv[1]
+    counts = [int(arg) for arg in sys.argv[2:5]]
+    corpus = generate(directory, *counts)
+    size = sum(os.path.getsize(path) for *_, path, file_type in corpus)
+    print(f'wrote {len(corpus)} files, {size / 1024 / 1024:.1f} MiB, to {directory}')
+
+
+if __name__ == '__main__':
+    main()
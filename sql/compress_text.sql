@@ -0,0 +1,20 @@
+-- compressed storage of the extracted text (see src/textstore.py), run once after textchunks.sql
+-- then compress the text that is already there with: python src/compress_text.py
+use corpora;
+
+-- content only has to allow null, it keeps the type, character set and collation Corpora.sql gave it
+select concat('alter table textfiles modify content ', column_type,
+              ' character set ', character_set_name, ' collate ', collation_name, ' null')
+into @allow_null
+from information_schema.columns
+where table_schema = 'corpora' and table_name = 'textfiles' and column_name = 'content';
+prepare allow_null from @allow_null;
+execute allow_null;
+deallocate prepare allow_null;
+
+-- zlib compressed text, content is null then. longblob, whatever the type of content
+alter table textfiles
+    add column content_z longblob null;
+
+-- search reads textchunks, the fulltext index Corpora.sql puts on textfiles.content is not used any more
+-- and can be dropped as well: show index from textfiles; alter table textfiles drop index <its name>;
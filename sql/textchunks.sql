@@ -0,0 +1,25 @@
+-- full text index of the text of every file cut into pages or chunks (see src/chunks.py),
+-- run once on the corpora database after Corpora.sql
+-- then fill it for existing files with: python src/build_chunks.py
+use corpora;
+
+create table if not exists textchunks
+(
+    chunk_id      int        not null auto_increment primary key,
+    files_file_id int        not null,
+    chunk         int        not null,
+    -- page of a pdf or slide of a pptx, null for a text without pages
+    page          int        null,
+    -- where the chunk begins in textfiles.content
+    start_offset  int        not null,
+    content       mediumtext not null,
+    -- the cjk part of content, one run per line
+    grams         mediumtext not null,
+    index textchunks_file (files_file_id, chunk),
+    fulltext index textchunks_content (content),
+    fulltext index textchunks_ngram (grams) with parser ngram
+) engine = InnoDB
+  default charset = utf8mb4;
+
+-- the per file ngram index used before textchunks
+drop table if exists textgrams;
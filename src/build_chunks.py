@@ -0,0 +1,7 @@
+# cut the text of files that were added before textchunks existed into chunks, so that search finds them again
+# usage: python src/build_chunks.py  (CORPORA_BACKEND picks the database like the gui does)
+from database import open_database
+
+if __name__ == '__main__':
+    database = open_database()
+    print(database.rebuild_chunks(), 'files indexed')
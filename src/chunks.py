@@ -0,0 +1,31 @@
+# the text of a file is searched in pieces: pages where the extractor marked them, fixed size chunks otherwise,
+# so a hit in a long book says where it is and the index ranks the page instead of the whole book
+
+# put between the pages (or slides) of an extracted text, like pdftotext does
+PAGE_BREAK = '\f'
+# characters per chunk of a text without pages, and the longest a page gets before it is cut as well
+CHUNK_SIZE = 4000
+
+
+def split_chunks(text):
+    """[(chunk, page, start_offset, content)] of a text, pages are numbered from 1 and None for a text without pages,
+    start_offset is where the chunk begins in the text (0-based). a chunk is cut after a line break where there
+    is one in its second half, chunks of only whitespace are left out
+    """
+    chunks = []
+    paged = PAGE_BREAK in text
+    start = 0
+    for page, content in enumerate(text.split(PAGE_BREAK), 1):
+        offset = 0
+        while offset < len(content):
+            end = offset + CHUNK_SIZE
+            if end < len(content):
+                cut = content.rfind('\n', offset + CHUNK_SIZE // 2, end)
+                if cut != -1:
+                    end = cut + 1
+            piece = content[offset:end]
+            if piece.strip():
+                chunks.append((len(chunks), page if paged else None, start + offset, piece))
+            offset = end
+        start += len(content) + len(PAGE_BREAK)
+    return chunks
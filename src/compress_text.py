@@ -0,0 +1,7 @@
+# compress the text of files that were stored before compression was switched on
+# usage: python src/compress_text.py  (CORPORA_BACKEND picks the database like the gui does)
+from database import open_database
+
+if __name__ == '__main__':
+    database = open_database()
+    print(database.compress_texts(), 'files compressed')
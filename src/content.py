@@ -1,51 +1,85 @@
-import docx
-import pdfplumber
-import pptx
+# the libraries that read a file type are imported on first use, pdfplumber (pdfminer, Pillow), python-docx and
+# python-pptx take longer to import than the rest of the app, and a session that only searches needs none of them
+import os
 
+from chunks import PAGE_BREAK
+from metrics import measured
 
-def pdf2text(path):
+# how much of a long document is indexed, 0 means no limit
+# pages of a pdf
+PDF_MAX_PAGES = int(os.environ.get('CORPORA_PDF_MAX_PAGES', 0))
+# characters of extracted text of any type
+TEXT_MAX_CHARS = int(os.environ.get('CORPORA_TEXT_MAX_CHARS', 0))
+
+
+def pdf_page_count(path):
+    import pdfplumber
+    with pdfplumber.open(path) as pdf:
+        pages = len(pdf.pages)
+    return min(pages, PDF_MAX_PAGES) if PDF_MAX_PAGES else pages
+
+
+def pdf_pages(path, start=0, stop=None):
+    """yield the text of the pages [start, stop) one at a time, within the page budget
+    a page without a text layer (a scan or an empty page) gives ''
+    """
+    import pdfplumber
+    if PDF_MAX_PAGES:
+        stop = min(stop, PDF_MAX_PAGES) if stop is not None else PDF_MAX_PAGES
     with pdfplumber.open(path) as pdf:
-        text = ''
-        if len(pdf.pages) > 30:
-            for page in pdf.pages[:30]:
-                text += page.extract_text()
-        else:
-            for page in pdf.pages:
-                text += page.extract_text()
-        return text
+        for page in pdf.pages[start:stop]:
+            text = page.extract_text() or ''
+            # drop the parsed layout of pages already done so memory doesn't grow with the page count
+            page.flush_cache()
+            yield text
+
+
+def limit_text(text):
+    return text[:TEXT_MAX_CHARS] if TEXT_MAX_CHARS else text
+
+
+@measured('extract.pdf')
+def pdf2text(path, start=0, stop=None):
+    pages = []
+    length = 0
+    for text in pdf_pages(path, start, stop):
+        pages.append(text)
+        length += len(text) + len(PAGE_BREAK)
+        if TEXT_MAX_CHARS and length >= TEXT_MAX_CHARS:
+            break
+    return limit_text(PAGE_BREAK.join(pages))
 
 
+@measured('extract.docx')
 def doc2text(path):
+    import docx
     doc = docx.Document(path)
-    text = ''
-    for para in doc.paragraphs:
-        text += para.text
-    return text
+    return ''.join(para.text for para in doc.paragraphs)
 
 
+@measured('extract.txt')
 def txt2text(path):
     with open(path, 'r') as f:
         return f.read()
 
 
+@measured('extract.pptx')
 def ppt2text(path):
+    import pptx
     ppt = pptx.Presentation(path)
-    text = ''
-    for slide in ppt.slides:
-        for shape in slide.shapes:
-            if hasattr(shape, 'text'):
-                text += shape.text
-    return text
+    # every slide is a page
+    return PAGE_BREAK.join(''.join(shape.text for shape in slide.shapes if hasattr(shape, 'text'))
+                           for slide in ppt.slides)
 
 
 def get_text(path, file_type):
     if file_type == 'pdf':
         return pdf2text(path)
     elif file_type == 'docx' or file_type == 'doc':
-        return doc2text(path)
+        return limit_text(doc2text(path))
     elif file_type in ['txt', 'py', 'c', 'cpp', 'java', 'html', 'css', 'js', 'php', 'sql', 'xml', 'json', 'md']:
-        return txt2text(path)
+        return limit_text(txt2text(path))
     elif file_type == 'pptx' or file_type == 'ppt':
-        return ppt2text(path)
+        return limit_text(ppt2text(path))
     else:
         raise Exception('Unsupported file type')
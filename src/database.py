@@ -1,162 +1,228 @@
-# connect to a mysql database
-import pymysql
+# storage backends of the corpora, open_database() picks one
+import os
+import threading
+from collections import namedtuple
+
+# what search_files can be restricted to, None for any. the backends filter in the sql, before hits are ranked
+SearchFilters = namedtuple('SearchFilters', ['class_id', 'chapter_id', 'tag_id', 'file_type'],
+                           defaults=(None, None, None, None))
+
+
+def search_conditions(within, filters, placeholder):
+    # the conditions on files that within and a SearchFilters make and their arguments,
+    # placeholder is the parameter marker of the backend's driver
+    conditions = []
+    args = ()
+    if within is not None:
+        conditions.append('files.file_id in (' + ', '.join([placeholder] * len(within)) + ')')
+        args += tuple(within)
+    if filters is not None:
+        if filters.class_id is not None:
+            conditions.append('files.chapters_classes_class_id = ' + placeholder)
+            args += (filters.class_id,)
+        if filters.chapter_id is not None:
+            conditions.append('files.chapters_chapter_id = ' + placeholder)
+            args += (filters.chapter_id,)
+        if filters.tag_id is not None:
+            conditions.append('files.file_id in (select files_file_id from filetag where tagname_tag_id = ' +
+                              placeholder + ')')
+            args += (filters.tag_id,)
+        if filters.file_type is not None:
+            conditions.append('files.file_type = ' + placeholder)
+            args += (filters.file_type,)
+    return conditions, args
 
 
 class CorporaDatabase:
-    def __init__(self):
-        # connect to localhost
-        self.conn = pymysql.connect(host='localhost',  # 数据库地址
-                                    port=3306,  # 数据库端口
-                                    user='root',  # 数据库用户名
-                                    password='Jyxxsn124',  # 数据库密码
-                                    db='corpora',  # 数据库名称
-                                    charset='utf8mb4'  # 数据库编码
-                                    )
-        self.cursor = self.conn.cursor()
-
-    def __del__(self):
-        self.cursor.close()
-        self.conn.close()
+    """ the interface every storage backend implements, the gui only talks to these methods """
 
     def get_classes(self):
-        self.cursor.execute('select * from classes')
-        return self.cursor.fetchall()
+        # [(class_id, class_name, teacher_name)]
+        raise NotImplementedError
 
     def add_class(self, class_name, teacher_name):
-        try:
-            self.cursor.execute('insert into classes (class_name, teacher_name) values (%s, %s)',
-                                (class_name, teacher_name))
-            self.conn.commit()
-        except pymysql.err.OperationalError as e:
-            raise RuntimeError('class name is null')
+        # raise RuntimeError if the class name is empty
+        raise NotImplementedError
 
     def delete_class(self, class_id):
-        try:
-            self.cursor.execute('start transaction')
-            self.cursor.execute('delete from filetag where files_file_id in '
-                                '(select file_id from files where chapters_classes_class_id = %s)', class_id)
-            self.cursor.execute('delete from textfiles where files_file_id in '
-                                '(select file_id from files where chapters_classes_class_id = %s)', class_id)
-            self.cursor.execute('delete from files where chapters_classes_class_id = %s', class_id)
-            self.cursor.execute('delete from chapters where classes_class_id = %s', class_id)
-            self.cursor.execute('delete from classes where class_id = %s', class_id)
-            self.cursor.execute('commit')
-        except Exception as e:
-            self.cursor.execute('rollback')
-            raise e
+        raise NotImplementedError
 
     def get_files(self, class_id):
-        self.cursor.execute('select chapter_id, chapter_name, total_size from chapters where classes_class_id = %s',
-                            class_id)
-        chapters = self.cursor.fetchall()
-        chapters = {chapter[0]: (chapter[1], chapter[2]) for chapter in chapters}
-        files = {}
-        for chapter in chapters.keys():
-            self.cursor.execute('select file_id, file_name, file_address, file_type, file_size from files '
-                                'where chapters_chapter_id = %s '
-                                'and chapters_classes_class_id = %s', (chapter, class_id))
-            files[chapter] = self.cursor.fetchall()
-        return files, chapters
+        """return (files, chapters) of a class
+        files: {chapter_id: [(file_id, file_name, file_address, file_type, file_size)]}
+        chapters: {chapter_id: (chapter_name, total_size)}
+        """
+        raise NotImplementedError
 
     def add_file(self, file_name, file_address, file_type, file_size, chapter_id, class_id) -> int:
-        self.cursor.execute('insert into files (file_name, file_address, file_type, file_size, chapters_chapter_id,'
-                            ' chapters_classes_class_id) values (%s, %s, %s, %s, %s, %s)',
-                            (file_name, file_address, file_type, file_size, chapter_id, class_id))
-        self.conn.commit()
-        self.update_chapter_total_size(chapter_id, class_id)
-        self.cursor.execute('select @@IDENTITY')
-        return self.cursor.fetchone()[0]
+        raise NotImplementedError
+
+    def add_files(self, files) -> list:
+        """insert many files and their text in one transaction
+        files: [(file_name, file_address, file_type, file_size, chapter_id, class_id, text)],
+        text is None if it could not be extracted
+        return the new file ids in the same order
+        """
+        raise NotImplementedError
+
+    def update_files(self, files):
+        """replace the size and text of files that changed on disk, in one transaction
+        files: [(file_id, file_size, text)], text is None if it could not be extracted
+        """
+        raise NotImplementedError
 
     def delete_file(self, file_id):
-        try:
-            self.cursor.execute('start transaction')
-            # get chapter_id and class_id
-            self.cursor.execute('select chapters_chapter_id, chapters_classes_class_id from files where file_id = %s',
-                                file_id)
-            chapter_id, class_id = self.cursor.fetchone()
-            # update chapter total size
-            self.cursor.execute('delete from filetag where files_file_id = %s', file_id)
-            self.cursor.execute('delete from textfiles where files_file_id = %s', file_id)
-            self.cursor.execute('delete from files where file_id = %s', file_id)
-            self.cursor.execute('call update_total_size(%s, %s)', (chapter_id, class_id))
-            self.cursor.execute('commit')
-        except Exception as e:
-            self.cursor.execute('rollback')
-            raise e
-
-    def add_chapter(self, class_id, chapter_name):
-        self.cursor.execute('insert into chapters (chapter_name, classes_class_id) values (%s, %s)',
-                            (chapter_name, class_id))
-        self.conn.commit()
+        # return (chapter_id, total_size) of the chapter the file was in
+        raise NotImplementedError
+
+    def add_chapter(self, class_id, chapter_name) -> int:
+        raise NotImplementedError
 
     def delete_chapter(self, chapter_id):
-        try:
-            self.cursor.execute('start transaction')
-            self.cursor.execute('delete from filetag where files_file_id in (select file_id from files where '
-                                'chapters_chapter_id = %s)', chapter_id)
-            self.cursor.execute('delete from textfiles where files_file_id in (select file_id from files where '
-                                'chapters_chapter_id = %s)', chapter_id)
-            self.cursor.execute('delete from files where chapters_chapter_id = %s', chapter_id)
-            self.cursor.execute('delete from chapters where chapter_id = %s', chapter_id)
-            self.cursor.execute('commit')
-        except Exception as e:
-            self.cursor.execute('rollback')
-            raise e
+        raise NotImplementedError
+
+    def chapter_exists(self, chapter_id):
+        raise NotImplementedError
+
+    def get_chapter_size(self, chapter_id):
+        raise NotImplementedError
 
     def update_chapter_total_size(self, chapter_id, classes_class_id):
-        self.cursor.execute('call update_total_size(%s, %s)', (chapter_id, classes_class_id))
-        self.conn.commit()
+        raise NotImplementedError
 
     def add_textfile(self, file_id, text):
-        self.cursor.execute('insert into textfiles (files_file_id, content) values (%s, %s)', (file_id, text))
-        self.conn.commit()
+        raise NotImplementedError
+
+    def rebuild_chunks(self, batch_size=100):
+        # cut the text of files added before textchunks existed into chunks, return how many files were done
+        raise NotImplementedError
+
+    def compress_texts(self, batch_size=100):
+        # compress the stored text of rows written uncompressed (see textstore.py), return how many were done
+        raise NotImplementedError
 
     def get_filetags(self, file_id):
-        self.cursor.execute('select tag_id, tag_name from filetag, tagname where files_file_id = %s '
-                            'and tag_id = tagname_tag_id', file_id)
-        return self.cursor.fetchall()
+        # [(tag_id, tag_name)]
+        raise NotImplementedError
 
     def delete_filetag(self, file_id, tag_id):
-        self.cursor.execute('delete from filetag where files_file_id = %s and tagname_tag_id = %s', (file_id, tag_id))
-        self.conn.commit()
+        raise NotImplementedError
 
     def add_filetag(self, file_id, tag_id):
-        try:
-            self.cursor.execute('insert into filetag (files_file_id, tagname_tag_id) values (%s, %s)',
-                                (file_id, tag_id))
-        except pymysql.err.IntegrityError as e:
-            pass
-        self.conn.commit()
+        # adding a tag the file already has is not an error
+        raise NotImplementedError
 
     def add_tag(self, tag_name):
-        self.cursor.execute('insert into tagname (tag_name) values (%s)', tag_name)
-        self.conn.commit()
+        raise NotImplementedError
 
     def delete_tag(self, tag_id):
-        self.cursor.execute('delete from filetag where tagname_tag_id = %s', tag_id)
-        self.cursor.execute('delete from tagname where tag_id = %s', tag_id)
-        self.conn.commit()
+        raise NotImplementedError
 
     def get_tags(self):
-        self.cursor.execute('select tag_id, tag_name from tagname')
-        return self.cursor.fetchall()
+        # [(tag_id, tag_name)]
+        raise NotImplementedError
 
     def get_all_files(self):
-        self.cursor.execute('select class_name, chapter_name, file_name from allfiles')
-        return self.cursor.fetchall()
+        # [(class_name, chapter_name, file_name)]
+        raise NotImplementedError
+
+    def get_all_files_page(self, after_file_id, limit):
+        # [(file_id, class_name, chapter_name, file_name)] with file_id > after_file_id, ordered by file_id
+        raise NotImplementedError
 
     def search(self, keyword):
-        self.cursor.execute('select files_file_id, content from textfiles '
-                            'where MATCH content AGAINST (%s IN NATURAL LANGUAGE MODE)', keyword)
-        return self.cursor.fetchall()
+        # [(file_id, content)] of every file whose text matches, the keyword is in the syntax of search_syntax.py
+        raise NotImplementedError
+
+    def search_files(self, keyword, snippet_length=100, limit=None, offset=0, within=None, filters=None):
+        """full text search with the file information of every hit joined in, best matches first
+        [(file_id, file_name, file_address, file_type, file_size, class_name, chapter_name, position, page, snippet,
+          score)]
+        the keyword is in the syntax of search_syntax.py: words, chinese, "phrases", +required and -excluded terms.
+        the text is searched in chunks (see chunks.py) and every file is ranked by its best matching chunk,
+        a file with an excluded term in any of its chunks is left out,
+        score is the relevance of that chunk (larger is better, only comparable within one backend),
+        the snippet starts at the first occurrence of the first term in that chunk,
+        position is where it was found in the whole text (1-based, the first character of the chunk if the term
+        does not appear literally), page is the page of the chunk or None for a text without pages
+        limit and offset select one page of hits, all hits are returned if limit is None
+        within is a set of file ids the hits are restricted to, e.g. the hits of a keyword this one narrows,
+        filters a SearchFilters
+        """
+        raise NotImplementedError
+
+    def interrupt(self, thread):
+        """stop the statement running on the connection the thread (a threading.get_ident()) has borrowed,
+        the call running there raises. called from another thread, does nothing if the thread isn't in a call
+        """
+        raise NotImplementedError
 
     def get_file_info(self, file_id):
-        self.cursor.execute('select file_name, file_address, file_type, file_size from files '
-                            'where file_id = %s', file_id)
-        return self.cursor.fetchone()
-
-# data = CorporaDatabase()
-# data.add_class('test', 'test')
-# print(data.get_classes())
-# data.add_file('test', 'test', 'test', 1, 2, data.get_classes()[0][0])
-# print(data.get_files(data.get_classes()[0][0]))
+        # (file_name, file_address, file_type, file_size)
+        raise NotImplementedError
+
+
+def open_database(backend=None, cache=None, **kwargs):
+    """connect to the backend named by backend or the CORPORA_BACKEND environment variable
+    mysql: the mysql server created with Corpora.sql (default)
+    sqlite: an embedded database file, no server needed
+    reads go through a QueryCache unless cache is False or CORPORA_QUERY_CACHE=0
+    """
+    backend = backend or os.environ.get('CORPORA_BACKEND', 'mysql')
+    if backend == 'mysql':
+        from mysql_database import MySQLDatabase
+        database = MySQLDatabase(**kwargs)
+    elif backend == 'sqlite':
+        from sqlite_database import SQLiteDatabase
+        database = SQLiteDatabase(**kwargs)
+    else:
+        raise ValueError(f'unknown database backend: {backend}')
+    if cache is None:
+        cache = os.environ.get('CORPORA_QUERY_CACHE', '1') != '0'
+    if cache:
+        from query_cache import CachedDatabase
+        database = CachedDatabase(database)
+    return database
+
+
+class DeferredDatabase:
+    """ open_database() on first use instead of right away, so that the gui can show its window before the
+    connection to the server is made, and doesn't crash if the server is down.
+    the methods of CorporaDatabase can be looked up before the database is open, e.g. to hand database.get_classes
+    to a worker thread, the database is opened by the thread that calls one. a failed open is tried again
+    by the next call
+    """
+
+    def __init__(self, backend=None, cache=None, **kwargs):
+        self.arguments = (backend, cache, kwargs)
+        self.lock = threading.Lock()
+        self.database = None
+
+    def connect(self):
+        # the open database, opened now if it isn't yet
+        with self.lock:
+            if self.database is None:
+                backend, cache, kwargs = self.arguments
+                self.database = open_database(backend, cache, **kwargs)
+            return self.database
+
+    def opened(self):
+        # the database if it has been opened, None otherwise
+        return self.database
+
+    def interrupt(self, thread):
+        # nothing can be running before the database is open, and this must not open it
+        if self.database is not None:
+            self.database.interrupt(thread)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if not callable(getattr(CorporaDatabase, name, None)):
+            return getattr(self.connect(), name)
+
+        def call(*args, **kwargs):
+            return getattr(self.connect(), name)(*args, **kwargs)
+
+        call.__name__ = name
+        return call
@@ -0,0 +1,205 @@
+# persistent cache of extracted text keyed by the hash of the file content,
+# importing the same pdf into another chapter or class doesn't parse it again
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from content import get_text
+
+DEFAULT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'cache')
+# bytes of compressed text kept on disk before the least recently used entries are dropped
+DEFAULT_BUDGET = 512 * 1024 * 1024
+# bump when the extractors change so that text extracted by the old ones is not reused
+EXTRACT_VERSION = 3
+
+SCHEMA = '''
+create table if not exists entries (
+    key text primary key,
+    text blob not null,
+    size integer not null,
+    last_used real not null
+);
+create index if not exists entries_last_used on entries (last_used);
+-- size and mtime of a path when it was last hashed, so unchanged files are not read again
+create table if not exists paths (
+    path text primary key,
+    file_size integer not null,
+    mtime integer not null,
+    hash text not null
+);
+-- files that timed out or took their worker down, they are not extracted again.
+-- timeout or memory_limit is the limit a file ran into, it is tried again once that limit is raised
+create table if not exists quarantine (
+    hash text primary key,
+    path text not null,
+    reason text not null,
+    time real not null,
+    timeout real,
+    memory_limit integer
+);
+'''
+
+
+class Quarantined(Exception):
+    pass
+
+
+def raised(limit, recorded):
+    # whether the limit in effect is higher than the one a file ran into, 0 is no limit at all
+    return recorded is not None and limit is not None and recorded != 0 and (limit == 0 or limit > recorded)
+
+
+def file_hash(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class ExtractCache:
+    def __init__(self, directory=None, budget=None):
+        self.directory = directory or os.environ.get('CORPORA_CACHE_DIR', DEFAULT_DIR)
+        self.budget = budget if budget is not None else int(os.environ.get('CORPORA_CACHE_BUDGET', DEFAULT_BUDGET))
+        os.makedirs(self.directory, exist_ok=True)
+        # the import workers are separate processes sharing this file
+        self.conn = sqlite3.connect(os.path.join(self.directory, 'extract_cache.db'), timeout=30)
+        self.conn.execute('pragma journal_mode = wal')
+        self.conn.executescript(SCHEMA)
+        self.upgrade()
+
+    def upgrade(self):
+        # caches from before the limits were recorded, the files that ran into one get another chance
+        columns = [row[1] for row in self.conn.execute('pragma table_info(quarantine)')]
+        try:
+            with self.conn:
+                if 'timeout' not in columns:
+                    self.conn.execute('alter table quarantine add column timeout real')
+                    self.conn.execute("delete from quarantine where reason like 'timed out%'")
+                if 'memory_limit' not in columns:
+                    self.conn.execute('alter table quarantine add column memory_limit integer')
+                    self.conn.execute("delete from quarantine where reason like 'out of memory%' "
+                                      "or reason like 'extraction worker died%'")
+        except sqlite3.OperationalError:
+            # another worker process upgraded it first
+            pass
+
+    def close(self):
+        self.conn.close()
+
+    def hash(self, path):
+        # reuse the hash of a path whose size and mtime did not change
+        stat = os.stat(path)
+        row = self.conn.execute('select hash from paths where path = ? and file_size = ? and mtime = ?',
+                                (path, stat.st_size, stat.st_mtime_ns)).fetchone()
+        if row:
+            return row[0]
+        digest = file_hash(path)
+        with self.conn:
+            self.conn.execute('insert or replace into paths (path, file_size, mtime, hash) values (?, ?, ?, ?)',
+                              (path, stat.st_size, stat.st_mtime_ns, digest))
+        return digest
+
+    def key(self, path, file_type):
+        # the same bytes read as another type would give another text
+        return f'{self.hash(path)}:{file_type}:{EXTRACT_VERSION}'
+
+    def lookup(self, path, file_type):
+        # the cached text of a file, None if it wasn't extracted before
+        key = self.key(path, file_type)
+        row = self.conn.execute('select text from entries where key = ?', (key,)).fetchone()
+        if not row:
+            return None
+        with self.conn:
+            self.conn.execute('update entries set last_used = ? where key = ?', (time.time(), key))
+        return zlib.decompress(row[0]).decode('utf-8')
+
+    def store(self, path, file_type, text):
+        data = zlib.compress(text.encode('utf-8'))
+        if len(data) > self.budget:
+            return
+        with self.conn:
+            self.conn.execute('insert or replace into entries (key, text, size, last_used) values (?, ?, ?, ?)',
+                              (self.key(path, file_type), data, len(data), time.time()))
+        self.evict()
+
+    def get_text(self, path, file_type):
+        text = self.lookup(path, file_type)
+        if text is None:
+            text = get_text(path, file_type)
+            self.store(path, file_type, text)
+        return text
+
+    def quarantine(self, path, reason, timeout=None, memory_limit=None):
+        with self.conn:
+            self.conn.execute('insert or replace into quarantine (hash, path, reason, time, timeout, memory_limit) '
+                              'values (?, ?, ?, ?, ?, ?)',
+                              (self.hash(path), path, reason, time.time(), timeout, memory_limit))
+
+    def quarantined(self, path, timeout=None, memory_limit=None):
+        """why the file was quarantined, None if it wasn't.
+        a file that timed out or ran out of memory is not quarantined any more when that limit is higher now
+        """
+        row = self.conn.execute('select reason, timeout, memory_limit from quarantine where hash = ?',
+                                (self.hash(path),)).fetchone()
+        if not row or raised(timeout, row[1]) or raised(memory_limit, row[2]):
+            return None
+        return row[0]
+
+    def evict(self):
+        # drop the least recently used entries until the cache fits in the budget again
+        total = self.conn.execute('select coalesce(sum(size), 0) from entries').fetchone()[0]
+        if total <= self.budget:
+            return
+        keys = []
+        for key, size in self.conn.execute('select key, size from entries order by last_used'):
+            if total <= self.budget:
+                break
+            keys.append((key,))
+            total -= size
+        # the hashes of paths that have no text cached any more, unless it was extracted as another type too
+        hashes = {(key.split(':')[0],) for key, in keys}
+        with self.conn:
+            self.conn.executemany('delete from entries where key = ?', keys)
+            self.conn.executemany("delete from paths where hash = ?1 and not exists "
+                                  "(select 1 from entries where key like ?1 || ':%')", hashes)
+
+
+# sqlite connections can't be shared between threads, the folder watcher and the import worker
+# both extract in their own thread
+_local = threading.local()
+
+
+def thread_cache():
+    cache = getattr(_local, 'cache', None)
+    if cache is None:
+        cache = _local.cache = ExtractCache()
+    return cache
+
+
+def get_cache():
+    """the cache of this thread, None if it is switched off with CORPORA_CACHE_BUDGET=0"""
+    cache = thread_cache()
+    return cache if cache.budget > 0 else None
+
+
+def quarantine(path, reason, timeout=None, memory_limit=None):
+    # the quarantine is kept even when the cache is switched off
+    thread_cache().quarantine(path, reason, timeout, memory_limit)
+
+
+def check_quarantine(path, timeout=None, memory_limit=None):
+    reason = thread_cache().quarantined(path, timeout, memory_limit)
+    if reason is not None:
+        raise Quarantined(f'quarantined: {reason}')
+
+
+def cached_get_text(path, file_type):
+    # content.get_text through the cache
+    cache = get_cache()
+    if cache is None:
+        return get_text(path, file_type)
+    return cache.get_text(path, file_type)
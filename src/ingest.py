@@ -0,0 +1,150 @@
+# import files in the background, text extraction runs in a sandboxed process pool
+import os
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from chunks import PAGE_BREAK
+from content import get_text, limit_text, pdf2text, pdf_page_count
+from extract_cache import check_quarantine, get_cache, quarantine
+from sandbox import DEFAULT_MEMORY_LIMIT, DEFAULT_TIMEOUT, SandboxError, SandboxPool
+
+# pages of a pdf parsed by one worker, longer pdfs are spread over the pool
+PAGES_PER_TASK = 40
+
+
+def prepare(path, file_type, split_pages=PAGES_PER_TASK):
+    """first task of every file, runs in a worker process, pdfplumber is cpu bound so threads won't help
+    returns (text, None), or (None, page count) for a pdf long enough to be extracted in page ranges.
+    files imported before are served from the extraction cache
+    """
+    check_quarantine(path, DEFAULT_TIMEOUT, DEFAULT_MEMORY_LIMIT)
+    cache = get_cache()
+    text = cache.lookup(path, file_type) if cache else None
+    if text is not None:
+        return text, None
+    if file_type == 'pdf' and split_pages:
+        pages = pdf_page_count(path)
+        if pages > split_pages:
+            return None, pages
+    text = get_text(path, file_type)
+    if cache:
+        cache.store(path, file_type, text)
+    return text, None
+
+
+def extract_pages(path, start, stop):
+    # one page range of a long pdf, runs in a worker process
+    return pdf2text(path, start, stop)
+
+
+def store(file, file_type, text):
+    # a pdf put together from page ranges is cached here, the workers only saw a part of it
+    cache = get_cache()
+    if cache:
+        try:
+            cache.store(file, file_type, text)
+        except OSError:
+            pass
+
+
+def quarantine_failure(path, error):
+    """keep a file that timed out or took its worker down from being extracted again, return the message to report"""
+    if isinstance(error, (SandboxError, MemoryError)):
+        try:
+            quarantine(path, str(error), getattr(error, 'timeout', None), getattr(error, 'memory_limit', None))
+        except OSError:
+            pass
+        return f'quarantined: {error}'
+    return str(error)
+
+
+class IngestWorker(QThread):
+    """ extract text from files in a process pool without blocking the gui thread """
+    # done, total, file path
+    progress = pyqtSignal(int, int, str)
+    # file path, file name, file type, file size, extracted text (None if extraction failed)
+    extracted = pyqtSignal(str, str, str, str, object)
+    # failed files [(file path, error message)], cancelled
+    done = pyqtSignal(list, bool)
+
+    def __init__(self, files, max_workers=None, parent=None):
+        super().__init__(parent)
+        self.files = [file for file in files if file]
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        total = len(self.files)
+        failed = []
+        if not total:
+            self.done.emit(failed, False)
+            return
+        executor = SandboxPool(max_workers=self.max_workers)
+        # a single file can still use the whole pool if it is a long pdf
+        split_pages = PAGES_PER_TASK if self.max_workers > 1 else 0
+        # future -> (file, file type, first page of the range or None for the prepare task)
+        pending = {}
+        # file -> {first page: text} of a pdf extracted in ranges, and how many ranges it has
+        ranges = {}
+        for file in self.files:
+            file_type = file.split('.')[-1]
+            pending[executor.submit(prepare, file, file_type, split_pages)] = (file, file_type, None)
+        finished = 0
+        try:
+            while pending and not self.cancelled:
+                # wake up regularly so that cancel() takes effect even while a big pdf is being parsed
+                completed, _ = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    file, file_type, start = pending.pop(future)
+                    if start is not None and file not in ranges:
+                        # another range of this file failed already
+                        continue
+                    error = None
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        # the file is still added, it just can't be found by full text search
+                        error = quarantine_failure(file, e)
+                        ranges.pop(file, None)
+                        text = None
+                    else:
+                        if start is None:
+                            text, pages = result
+                            if text is None:
+                                starts = range(0, pages, PAGES_PER_TASK)
+                                ranges[file] = ({}, len(starts))
+                                for first in starts:
+                                    last = min(first + PAGES_PER_TASK, pages)
+                                    future = executor.submit(extract_pages, file, first, last)
+                                    pending[future] = (file, file_type, first)
+                                continue
+                        else:
+                            parts, count = ranges[file]
+                            parts[start] = result
+                            if len(parts) < count:
+                                continue
+                            del ranges[file]
+                            text = limit_text(PAGE_BREAK.join(parts[first] for first in sorted(parts)))
+                            store(file, file_type, text)
+                    finished += 1
+                    try:
+                        file_size = str(os.path.getsize(file))
+                    except OSError as e:
+                        # a file that is gone failed to extract too, it is reported once
+                        failed.append((file, error or str(e)))
+                        self.progress.emit(finished, total, file)
+                        continue
+                    if error is not None:
+                        failed.append((file, error))
+                    self.extracted.emit(file, file.split('/')[-1], file_type, file_size, text)
+                    self.progress.emit(finished, total, file)
+        finally:
+            for future in pending:
+                future.cancel()
+            # files that are still being parsed after a cancel are killed
+            executor.shutdown(wait=not self.cancelled)
+        self.done.emit(failed, self.cancelled)
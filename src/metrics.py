@@ -0,0 +1,252 @@
+# call counts, latency histograms, rows and text bytes of every database method and content extractor,
+# and an opt-in log of the sql statements slower than CORPORA_SLOW_QUERY_MS.
+# the gui shows them on its diagnostics page, metrics.dump(path) writes them as json
+import bisect
+import functools
+import inspect
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+ENABLED = os.environ.get('CORPORA_METRICS', '1') != '0'
+# statements taking longer than this many ms are logged with their parameters, 0 for no log
+SLOW_QUERY_MS = float(os.environ.get('CORPORA_SLOW_QUERY_MS', 0))
+# file the slow statements are appended to, stderr if not set
+SLOW_QUERY_LOG = os.environ.get('CORPORA_SLOW_QUERY_LOG')
+# slow statements kept in memory for the diagnostics page
+SLOW_QUERIES_KEPT = 100
+# upper bounds of the latency buckets in ms, the last bucket takes everything above
+BUCKETS = (0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+
+class Stat:
+    """ what the calls of one name added up to. plain numbers, a worker process sends its stats to the app """
+    __slots__ = ('calls', 'errors', 'seconds', 'max', 'rows', 'text_bytes', 'buckets')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.text_bytes = 0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def add(self, seconds, rows, text_bytes, error):
+        self.calls += 1
+        self.errors += error
+        self.seconds += seconds
+        self.max = max(self.max, seconds)
+        self.rows += rows or 0
+        self.text_bytes += text_bytes
+        self.buckets[bisect.bisect_left(BUCKETS, seconds * 1000)] += 1
+
+    def merge(self, other):
+        self.calls += other.calls
+        self.errors += other.errors
+        self.seconds += other.seconds
+        self.max = max(self.max, other.max)
+        self.rows += other.rows
+        self.text_bytes += other.text_bytes
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+
+    def percentile(self, q):
+        # the upper bound of the bucket the q-th call fell in, the largest call for the last bucket
+        rank = q * self.calls
+        seen = 0
+        for bound, count in zip(BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max * 1000)
+        return self.max * 1000
+
+    def summary(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'total_ms': round(self.seconds * 1000, 3),
+            'mean_ms': round(self.seconds / self.calls * 1000, 3) if self.calls else 0,
+            'p50_ms': round(self.percentile(0.5), 3),
+            'p90_ms': round(self.percentile(0.9), 3),
+            'p99_ms': round(self.percentile(0.99), 3),
+            'max_ms': round(self.max * 1000, 3),
+            'rows': self.rows,
+            'text_bytes': self.text_bytes,
+            'histogram': {(f'<={bound}ms' if bound is not None else f'>{BUCKETS[-1]}ms'): count
+                          for bound, count in zip(BUCKETS + (None,), self.buckets) if count},
+        }
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = {}
+        # (time, seconds, sql, parameters)
+        self.slow = deque(maxlen=SLOW_QUERIES_KEPT)
+        # the text bytes counted for the measured call running on each thread
+        self.local = threading.local()
+
+    def record(self, name, seconds, rows=None, text_bytes=0, error=False):
+        with self.lock:
+            stat = self.stats.get(name)
+            if stat is None:
+                stat = self.stats[name] = Stat()
+            stat.add(seconds, rows, text_bytes, error)
+
+    def count_bytes(self, count):
+        # added to the innermost measured call of this thread, if there is one
+        call = getattr(self.local, 'call', None)
+        if call is not None:
+            call[0] += count
+
+    def counting(self):
+        return getattr(self.local, 'call', None) is not None
+
+    def record_slow(self, sql, parameters, seconds):
+        sql = ' '.join(sql.split())
+        entry = (time.strftime('%Y-%m-%d %H:%M:%S'), seconds, sql if len(sql) <= 1000 else sql[:1000] + '...',
+                 describe(parameters))
+        with self.lock:
+            self.slow.append(entry)
+        line = f'{entry[0]} {seconds * 1000:.1f}ms {entry[2]} -- {entry[3]}'
+        if SLOW_QUERY_LOG:
+            with open(SLOW_QUERY_LOG, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+        else:
+            print("slow query:", line, file=sys.stderr)
+
+    def drain(self):
+        # everything recorded so far, and start over. a worker process sends this with every result
+        with self.lock:
+            stats, self.stats = self.stats, {}
+            slow = list(self.slow)
+            self.slow.clear()
+        return stats, slow
+
+    def merge(self, drained):
+        stats, slow = drained
+        with self.lock:
+            for name, other in stats.items():
+                self.stats.setdefault(name, Stat()).merge(other)
+            self.slow.extend(slow)
+
+    def reset(self):
+        self.drain()
+
+    def forked(self):
+        # in a forked worker process, what the app recorded isn't the worker's to send,
+        # and the lock may have been held by another thread of the app at the fork
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.slow = deque(maxlen=SLOW_QUERIES_KEPT)
+        self.local = threading.local()
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'calls': {name: stat.summary() for name, stat in sorted(self.stats.items())},
+                'slow_queries': [{'time': at, 'ms': round(seconds * 1000, 3), 'sql': sql, 'parameters': parameters}
+                                 for at, seconds, sql, parameters in self.slow],
+            }
+
+    def dump(self, path, **extra):
+        snapshot = self.snapshot()
+        snapshot.update(extra)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False, indent=2)
+
+
+metrics = Metrics()
+
+
+def describe(parameters, limit=200):
+    # the parameters of a statement for the log, long texts and the rows of executemany cut short
+    if isinstance(parameters, list):
+        first = describe(parameters[0], limit) if parameters else ''
+        return f'{len(parameters)} rows, first {first}'
+    text = repr(parameters)
+    return text if len(text) <= limit else text[:limit] + '...'
+
+
+def count_rows(result):
+    # the rows of a result: a list of them, a dict of them, or a tuple of those like get_files returns
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, dict):
+        return sum(len(value) if isinstance(value, list) else 1 for value in result.values())
+    if isinstance(result, tuple) and result and all(isinstance(part, (list, dict)) for part in result):
+        return sum(count_rows(part) for part in result)
+    return None
+
+
+def count_text(text):
+    if text and metrics.counting():
+        metrics.count_bytes(len(text.encode('utf-8')))
+
+
+def measure(name, func, args, kwargs, result_text=False):
+    call = [0]
+    previous = getattr(metrics.local, 'call', None)
+    metrics.local.call = call
+    start = time.perf_counter()
+    try:
+        result = func(*args, **kwargs)
+    except BaseException:
+        metrics.local.call = previous
+        metrics.record(name, time.perf_counter() - start, text_bytes=call[0], error=True)
+        raise
+    seconds = time.perf_counter() - start
+    metrics.local.call = previous
+    if result_text and isinstance(result, str):
+        call[0] += len(result.encode('utf-8'))
+    metrics.record(name, seconds, count_rows(result), call[0])
+    return result
+
+
+def measured(name):
+    """function decorator for a content extractor: its calls are recorded under name,
+    with the bytes of the text it returns
+    """
+    def decorate(func):
+        if not ENABLED:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return measure(name, func, args, kwargs, result_text=True)
+
+        return wrapper
+
+    return decorate
+
+
+def instrumented(prefix):
+    """class decorator: the calls of every public method of the class are recorded as prefix.method,
+    with the rows the method returns and the text bytes textstore packed or unpacked for it
+    """
+    def decorate(cls):
+        if not ENABLED:
+            return cls
+        for name, method in list(vars(cls).items()):
+            if name.startswith('_') or not inspect.isfunction(method):
+                continue
+
+            def wrap(method, name):
+                @functools.wraps(method)
+                def wrapper(*args, **kwargs):
+                    return measure(name, method, args, kwargs)
+                return wrapper
+
+            setattr(cls, name, wrap(method, f'{prefix}.{name}'))
+        return cls
+
+    return decorate
+
+
+def log_slow(sql, parameters, start):
+    seconds = time.perf_counter() - start
+    if seconds * 1000 >= SLOW_QUERY_MS:
+        metrics.record_slow(sql, parameters, seconds)
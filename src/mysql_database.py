@@ -0,0 +1,483 @@
+# connect to a mysql database
+import threading
+import time
+
+import pymysql
+
+from chunks import split_chunks
+from database import CorporaDatabase, search_conditions
+from metrics import SLOW_QUERY_MS, instrumented, log_slow
+from ngram import cjk_text
+from pool import ConnectionPool, pooled, unpooled
+from search_syntax import can_match, first_term, parse_query
+from textstore import compress, pack, unpack
+
+
+# mysql client errors after which a connection is dead: server gone away, lost connection, out of sync
+CONNECTION_LOST = (2006, 2013, 2014, 2055)
+
+
+def boolean_phrase(text):
+    # boolean mode has no escape for a quote, it only separates words there anyway
+    return '"' + text.replace('"', ' ') + '"'
+
+
+def gram_phrase(run):
+    # a run of at least ngram_token_size characters, the bigrams it parses into have to follow each other
+    return f'"{run}"'
+
+
+def split_runs(runs):
+    """the runs the ngram index can find and the single characters it can't: a character starts no bigram
+    at the end of a run, so those are located in the content of the chunk instead
+    """
+    return [run for run in runs if len(run) > 1], [run for run in runs if len(run) == 1]
+
+
+def connection_lost(e):
+    return isinstance(e, pymysql.err.InterfaceError) or \
+        isinstance(e, pymysql.err.OperationalError) and bool(e.args) and e.args[0] in CONNECTION_LOST
+
+
+class LoggedCursor(pymysql.cursors.Cursor):
+    """ puts the statements slower than SLOW_QUERY_MS in the slow query log,
+    executemany goes through execute with the rows of an insert in one statement
+    """
+
+    def execute(self, query, args=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, args)
+        finally:
+            log_slow(query, args, start)
+
+
+class Session:
+    """ a pooled connection and the cursor the operations borrowing it run on """
+
+    def __init__(self, **kwargs):
+        self.conn = pymysql.connect(**kwargs)
+        self.cursor = self.conn.cursor()
+
+    def ping(self):
+        # reconnects in place after the server's wait_timeout, the cursor stays valid
+        self.conn.ping(reconnect=True)
+
+    def close(self):
+        self.cursor.close()
+        self.conn.close()
+
+
+@instrumented('database')
+@pooled
+class MySQLDatabase(CorporaDatabase):
+    def __init__(self, host='localhost', port=3306, user='root', password='Jyxxsn124', db='corpora'):
+        # connect to localhost
+        settings = dict(host=host,  # 数据库地址
+                        port=port,  # 数据库端口
+                        user=user,  # 数据库用户名
+                        password=password,  # 数据库密码
+                        db=db,  # 数据库名称
+                        charset='utf8mb4',  # 数据库编码
+                        # a pooled connection must not keep the snapshot of a read open for the next borrower
+                        autocommit=True,
+                        cursorclass=LoggedCursor if SLOW_QUERY_MS else pymysql.cursors.Cursor
+                        )
+        self.pool = ConnectionPool(lambda: Session(**settings), Session.close, ping=Session.ping,
+                                   broken=connection_lost)
+        self.settings = settings
+        # a connection of its own for kill query, the pool's may all be busy with the queries to kill
+        self.killer = None
+        self.kill_lock = threading.Lock()
+        # fail here instead of on the first query if the server can't be reached
+        with self.pool.connection():
+            pass
+
+    def __del__(self):
+        self.pool.close()
+        if self.killer is not None:
+            self.killer.close()
+
+    @property
+    def conn(self):
+        return self.pool.current().conn
+
+    @property
+    def cursor(self):
+        return self.pool.current().cursor
+
+    def get_classes(self):
+        self.cursor.execute('select * from classes')
+        return self.cursor.fetchall()
+
+    def add_class(self, class_name, teacher_name):
+        try:
+            self.cursor.execute('insert into classes (class_name, teacher_name) values (%s, %s)',
+                                (class_name, teacher_name))
+            self.conn.commit()
+        except pymysql.err.OperationalError as e:
+            raise RuntimeError('class name is null')
+
+    def delete_class(self, class_id):
+        try:
+            self.cursor.execute('start transaction')
+            self.cursor.execute('delete from filetag where files_file_id in '
+                                '(select file_id from files where chapters_classes_class_id = %s)', class_id)
+            self.cursor.execute('delete from textfiles where files_file_id in '
+                                '(select file_id from files where chapters_classes_class_id = %s)', class_id)
+            self.cursor.execute('delete from textchunks where files_file_id in '
+                                '(select file_id from files where chapters_classes_class_id = %s)', class_id)
+            self.cursor.execute('delete from files where chapters_classes_class_id = %s', class_id)
+            self.cursor.execute('delete from chapters where classes_class_id = %s', class_id)
+            self.cursor.execute('delete from classes where class_id = %s', class_id)
+            self.cursor.execute('commit')
+        except Exception as e:
+            self.cursor.execute('rollback')
+            raise e
+
+    def get_files(self, class_id):
+        # chapters and their files in one query, a chapter without files comes back as one row of nulls
+        self.cursor.execute('select chapter_id, chapter_name, total_size, '
+                            'file_id, file_name, file_address, file_type, file_size '
+                            'from chapters left join files on files.chapters_chapter_id = chapters.chapter_id '
+                            'and files.chapters_classes_class_id = chapters.classes_class_id '
+                            'where chapters.classes_class_id = %s '
+                            'order by chapter_id, file_id', class_id)
+        chapters = {}
+        files = {}
+        for chapter_id, chapter_name, total_size, *file in self.cursor.fetchall():
+            if chapter_id not in chapters:
+                chapters[chapter_id] = (chapter_name, total_size)
+                files[chapter_id] = []
+            if file[0] is not None:
+                files[chapter_id].append(tuple(file))
+        return files, chapters
+
+    def add_file(self, file_name, file_address, file_type, file_size, chapter_id, class_id) -> int:
+        self.cursor.execute('insert into files (file_name, file_address, file_type, file_size, chapters_chapter_id,'
+                            ' chapters_classes_class_id) values (%s, %s, %s, %s, %s, %s)',
+                            (file_name, file_address, file_type, file_size, chapter_id, class_id))
+        self.conn.commit()
+        self.update_chapter_total_size(chapter_id, class_id)
+        self.cursor.execute('select @@IDENTITY')
+        return self.cursor.fetchone()[0]
+
+    def add_files(self, files) -> list:
+        file_ids = []
+        chapters = []
+        try:
+            self.cursor.execute('start transaction')
+            for file_name, file_address, file_type, file_size, chapter_id, class_id, text in files:
+                # one row at a time so that every file id is known, nothing is committed until the end
+                self.cursor.execute('insert into files (file_name, file_address, file_type, file_size, '
+                                    'chapters_chapter_id, chapters_classes_class_id) values (%s, %s, %s, %s, %s, %s)',
+                                    (file_name, file_address, file_type, file_size, chapter_id, class_id))
+                file_ids.append(self.cursor.lastrowid)
+                if (chapter_id, class_id) not in chapters:
+                    chapters.append((chapter_id, class_id))
+            self._insert_texts([(file_id, file[6]) for file_id, file in zip(file_ids, files) if file[6] is not None])
+            # total size only needs to be recomputed once per chapter
+            for chapter_id, class_id in chapters:
+                self.cursor.execute('call update_total_size(%s, %s)', (chapter_id, class_id))
+            self.cursor.execute('commit')
+        except Exception as e:
+            self.cursor.execute('rollback')
+            raise e
+        return file_ids
+
+    def update_files(self, files):
+        chapters = []
+        try:
+            self.cursor.execute('start transaction')
+            for file_id, file_size, text in files:
+                self.cursor.execute('update files set file_size = %s where file_id = %s', (file_size, file_id))
+                self.cursor.execute('delete from textfiles where files_file_id = %s', file_id)
+                self.cursor.execute('delete from textchunks where files_file_id = %s', file_id)
+                if text is not None:
+                    self._insert_texts([(file_id, text)])
+                self.cursor.execute('select chapters_chapter_id, chapters_classes_class_id from files '
+                                    'where file_id = %s', file_id)
+                chapter = self.cursor.fetchone()
+                if chapter not in chapters:
+                    chapters.append(chapter)
+            for chapter_id, class_id in chapters:
+                self.cursor.execute('call update_total_size(%s, %s)', (chapter_id, class_id))
+            self.cursor.execute('commit')
+        except Exception as e:
+            self.cursor.execute('rollback')
+            raise e
+
+    def delete_file(self, file_id):
+        try:
+            self.cursor.execute('start transaction')
+            # get chapter_id and class_id
+            self.cursor.execute('select chapters_chapter_id, chapters_classes_class_id from files where file_id = %s',
+                                file_id)
+            chapter_id, class_id = self.cursor.fetchone()
+            # update chapter total size
+            self.cursor.execute('delete from filetag where files_file_id = %s', file_id)
+            self.cursor.execute('delete from textfiles where files_file_id = %s', file_id)
+            self.cursor.execute('delete from textchunks where files_file_id = %s', file_id)
+            self.cursor.execute('delete from files where file_id = %s', file_id)
+            self.cursor.execute('call update_total_size(%s, %s)', (chapter_id, class_id))
+            self.cursor.execute('select total_size from chapters where chapter_id = %s', chapter_id)
+            total_size = self.cursor.fetchone()[0]
+            self.cursor.execute('commit')
+        except Exception as e:
+            self.cursor.execute('rollback')
+            raise e
+        # enough for the caller to update the chapter without reloading the class
+        return chapter_id, total_size
+
+    def add_chapter(self, class_id, chapter_name) -> int:
+        self.cursor.execute('insert into chapters (chapter_name, classes_class_id) values (%s, %s)',
+                            (chapter_name, class_id))
+        self.conn.commit()
+        return self.cursor.lastrowid
+
+    def delete_chapter(self, chapter_id):
+        try:
+            self.cursor.execute('start transaction')
+            self.cursor.execute('delete from filetag where files_file_id in (select file_id from files where '
+                                'chapters_chapter_id = %s)', chapter_id)
+            self.cursor.execute('delete from textfiles where files_file_id in (select file_id from files where '
+                                'chapters_chapter_id = %s)', chapter_id)
+            self.cursor.execute('delete from textchunks where files_file_id in (select file_id from files where '
+                                'chapters_chapter_id = %s)', chapter_id)
+            self.cursor.execute('delete from files where chapters_chapter_id = %s', chapter_id)
+            self.cursor.execute('delete from chapters where chapter_id = %s', chapter_id)
+            self.cursor.execute('commit')
+        except Exception as e:
+            self.cursor.execute('rollback')
+            raise e
+
+    def chapter_exists(self, chapter_id):
+        self.cursor.execute('select 1 from chapters where chapter_id = %s', chapter_id)
+        return self.cursor.fetchone() is not None
+
+    def get_chapter_size(self, chapter_id):
+        self.cursor.execute('select total_size from chapters where chapter_id = %s', chapter_id)
+        return self.cursor.fetchone()[0]
+
+    def update_chapter_total_size(self, chapter_id, classes_class_id):
+        self.cursor.execute('call update_total_size(%s, %s)', (chapter_id, classes_class_id))
+        self.conn.commit()
+
+    def _insert_chunks(self, texts):
+        chunks = [(file_id, chunk, page, start_offset, content, cjk_text(content))
+                  for file_id, text in texts for chunk, page, start_offset, content in split_chunks(text)]
+        if chunks:
+            self.cursor.executemany('insert into textchunks (files_file_id, chunk, page, start_offset, content, grams) '
+                                    'values (%s, %s, %s, %s, %s, %s)', chunks)
+
+    def _insert_texts(self, texts):
+        # [(file_id, text)], inside the caller's transaction
+        if texts:
+            self.cursor.executemany('insert into textfiles (files_file_id, content, content_z) values (%s, %s, %s)',
+                                    [(file_id,) + pack(text) for file_id, text in texts])
+        self._insert_chunks(texts)
+
+    def add_textfile(self, file_id, text):
+        try:
+            self.cursor.execute('start transaction')
+            self._insert_texts([(file_id, text)])
+            self.cursor.execute('commit')
+        except Exception as e:
+            self.cursor.execute('rollback')
+            raise e
+
+    def rebuild_chunks(self, batch_size=100):
+        # chunk the texts added before textchunks existed
+        last_id = 0
+        count = 0
+        while True:
+            self.cursor.execute('select files_file_id, content, content_z from textfiles where files_file_id > %s '
+                                'and files_file_id not in (select files_file_id from textchunks) '
+                                'order by files_file_id limit %s', (last_id, batch_size))
+            rows = self.cursor.fetchall()
+            if not rows:
+                return count
+            self._insert_chunks([(file_id, unpack(content, content_z)) for file_id, content, content_z in rows])
+            self.conn.commit()
+            count += len(rows)
+            last_id = rows[-1][0]
+
+    def compress_texts(self, batch_size=100):
+        # move the text of rows written before sql/compress_text.sql into content_z
+        last_id = 0
+        count = 0
+        while True:
+            self.cursor.execute('select files_file_id, content from textfiles where files_file_id > %s '
+                                'and content is not null order by files_file_id limit %s', (last_id, batch_size))
+            rows = self.cursor.fetchall()
+            if not rows:
+                return count
+            self.cursor.executemany('update textfiles set content = null, content_z = %s where files_file_id = %s',
+                                    [(compress(content), file_id) for file_id, content in rows])
+            self.conn.commit()
+            count += len(rows)
+            last_id = rows[-1][0]
+
+    def get_filetags(self, file_id):
+        self.cursor.execute('select tag_id, tag_name from filetag, tagname where files_file_id = %s '
+                            'and tag_id = tagname_tag_id', file_id)
+        return self.cursor.fetchall()
+
+    def delete_filetag(self, file_id, tag_id):
+        self.cursor.execute('delete from filetag where files_file_id = %s and tagname_tag_id = %s', (file_id, tag_id))
+        self.conn.commit()
+
+    def add_filetag(self, file_id, tag_id):
+        try:
+            self.cursor.execute('insert into filetag (files_file_id, tagname_tag_id) values (%s, %s)',
+                                (file_id, tag_id))
+        except pymysql.err.IntegrityError as e:
+            pass
+        self.conn.commit()
+
+    def add_tag(self, tag_name):
+        self.cursor.execute('insert into tagname (tag_name) values (%s)', tag_name)
+        self.conn.commit()
+
+    def delete_tag(self, tag_id):
+        self.cursor.execute('delete from filetag where tagname_tag_id = %s', tag_id)
+        self.cursor.execute('delete from tagname where tag_id = %s', tag_id)
+        self.conn.commit()
+
+    def get_tags(self):
+        self.cursor.execute('select tag_id, tag_name from tagname')
+        return self.cursor.fetchall()
+
+    def get_all_files(self):
+        self.cursor.execute('select class_name, chapter_name, file_name from allfiles')
+        return self.cursor.fetchall()
+
+    def get_all_files_page(self, after_file_id, limit):
+        # one page of every file with its class and chapter, paginated on file_id
+        # so later pages are as cheap as the first
+        self.cursor.execute('select file_id, class_name, chapter_name, file_name from files '
+                            'join chapters on chapters.chapter_id = files.chapters_chapter_id '
+                            'join classes on classes.class_id = files.chapters_classes_class_id '
+                            'where file_id > %s order by file_id limit %s', (after_file_id, limit))
+        return self.cursor.fetchall()
+
+    def _hits(self, query, conditions=(), condition_args=()):
+        """the query selecting (chunk_id, files_file_id, score) of the chunks matching a SearchQuery,
+        and its arguments, None if nothing can match. chinese is looked up in the ngram index of grams,
+        every run of it has to appear as a phrase, the other words go through the fulltext index of content,
+        the first index that has to match gives the score. a single character is located in the content,
+        only one character on its own ranks every chunk the same. an excluded term leaves out the files it
+        appears in, not just its chunks. conditions on files restrict the hits before they are ranked and cut
+        into snippets, innodb still looks the terms up in the whole fulltext index
+        """
+        if not can_match(query):
+            return None
+        runs, characters = split_runs(query.runs)
+        excluded_runs, excluded_characters = split_runs(query.excluded_runs)
+        # (condition, its argument), the chunks have to match all of them
+        matches = []
+        if runs:
+            matches.append(('MATCH grams AGAINST (%s IN BOOLEAN MODE)',
+                            ' '.join('+' + gram_phrase(run) for run in runs)))
+        # words shorter than innodb_ft_min_token_size are not in the index and would match nothing
+        words = [word for word in query.words if len(word) >= 3]
+        if query.phrases:
+            text = ' '.join('+' + boolean_phrase(phrase) for phrase in query.phrases)
+            if words:
+                text += ' +(' + ' '.join(boolean_phrase(word) for word in words) + ')'
+            matches.append(('MATCH content AGAINST (%s IN BOOLEAN MODE)', text))
+        elif words:
+            # ranks better than boolean mode
+            matches.append(('MATCH content AGAINST (%s IN NATURAL LANGUAGE MODE)', ' '.join(words)))
+        if not matches and not characters:
+            return None
+        # a fulltext match scores the chunks, locate doesn't
+        score, score_args = (matches[0][0], (matches[0][1],)) if matches else ('1', ())
+        matches += [('locate(%s, content) > 0', character) for character in characters]
+        # (condition, its argument) of the chunks the excluded terms appear in, their files are left out
+        excluded = []
+        if excluded_runs:
+            excluded.append(('MATCH grams AGAINST (%s IN BOOLEAN MODE)',
+                             ' '.join(gram_phrase(run) for run in excluded_runs)))
+        excluded += [('locate(%s, content) > 0', character) for character in excluded_characters]
+        if query.excluded_phrases:
+            excluded.append(('MATCH content AGAINST (%s IN BOOLEAN MODE)',
+                             ' '.join(boolean_phrase(phrase) for phrase in query.excluded_phrases)))
+        # one subquery each, so that each of them can use its fulltext index
+        matches += [('textchunks.files_file_id not in (select files_file_id from textchunks where ' + condition + ')',
+                     arg) for condition, arg in excluded]
+        sql = 'select chunk_id, files_file_id, ' + score + ' as score from textchunks'
+        if conditions:
+            sql += ' join files on files.file_id = textchunks.files_file_id'
+        sql += ' where ' + ' and '.join([condition for condition, arg in matches] + list(conditions))
+        return sql, score_args + tuple(arg for condition, arg in matches) + tuple(condition_args)
+
+    def search(self, keyword):
+        hits = self._hits(parse_query(keyword))
+        if hits is None:
+            return []
+        sql, args = hits
+        self.cursor.execute('select files_file_id, content, content_z from textfiles where files_file_id in '
+                            '(select files_file_id from (' + sql + ') as hits)', args)
+        return [(file_id, unpack(content, content_z)) for file_id, content, content_z in self.cursor.fetchall()]
+
+    def search_files(self, keyword, snippet_length=100, limit=None, offset=0, within=None, filters=None):
+        # every file is ranked by its best chunk, the page is taken inside the derived table
+        # so that only its hits are joined and cut into snippets
+        if within is not None and not within:
+            return []
+        query = parse_query(keyword)
+        hits = self._hits(query, *search_conditions(within, filters, '%s'))
+        if hits is None:
+            return []
+        hits, args = hits
+        page = ' limit %s offset %s' if limit is not None else ''
+        if limit is not None:
+            args += (limit, offset)
+        # the snippet starts at the first term, locate ignores case like the fulltext index
+        term = first_term(query)
+        self.cursor.execute('select file_id, file_name, file_address, file_type, file_size, class_name, chapter_name, '
+                            'start_offset + greatest(locate(%s, content), 1), page, '
+                            'substring(content, greatest(locate(%s, content), 1), %s), score from '
+                            '(select files_file_id, chunk_id, score from '
+                            '(select files_file_id, chunk_id, score, row_number() over '
+                            '(partition by files_file_id order by score desc, chunk_id) as best '
+                            'from (' + hits + ') as chunk_hits) as ranked '
+                            'where best = 1 order by score desc, files_file_id' + page + ') as hits '
+                            'join textchunks on textchunks.chunk_id = hits.chunk_id '
+                            'join files on files.file_id = hits.files_file_id '
+                            'join chapters on chapters.chapter_id = files.chapters_chapter_id '
+                            'join classes on classes.class_id = files.chapters_classes_class_id '
+                            'order by score desc, file_id', (term, term, snippet_length) + args)
+        return self.cursor.fetchall()
+
+    @unpooled
+    def interrupt(self, thread):
+        with self.kill_lock:
+            if self.killer is None:
+                # before the pool is locked, connecting may take a while
+                self.killer = pymysql.connect(**self.settings)
+            self.pool.interrupt(thread, self._kill_query)
+
+    def _kill_query(self, session):
+        try:
+            with self.killer.cursor() as cursor:
+                cursor.execute('kill query %s', session.conn.thread_id())
+        except pymysql.err.MySQLError as e:
+            # 1094: the connection is gone already
+            if e.args and e.args[0] == 1094:
+                return
+            if connection_lost(e):
+                self.killer = None
+            raise
+
+    def get_file_info(self, file_id):
+        self.cursor.execute('select file_name, file_address, file_type, file_size from files '
+                            'where file_id = %s', file_id)
+        return self.cursor.fetchone()
+
+# data = MySQLDatabase()
+# data.add_class('test', 'test')
+# print(data.get_classes())
+# data.add_file('test', 'test', 'test', 1, 2, data.get_classes()[0][0])
+# print(data.get_files(data.get_classes()[0][0]))
@@ -0,0 +1,47 @@
+# split chinese (and japanese/korean) text into bigrams so that it can be found by a full text index,
+# the default parsers only split on whitespace and treat a whole sentence of chinese as one word
+import re
+
+# kana, cjk unified ideographs and extension a, compatibility ideographs and hangul syllables,
+# cjk punctuation is not included so it separates runs like whitespace does
+CJK = re.compile('[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]+')
+
+
+def has_cjk(text):
+    return CJK.search(text) is not None
+
+
+def cjk_runs(text):
+    # the uninterrupted pieces of cjk text
+    return CJK.findall(text)
+
+
+def latin_words(text):
+    # everything that is not cjk, split on whitespace
+    return CJK.sub(' ', text).split()
+
+
+def cjk_text(text):
+    # only the cjk part of a document, one run per line, for indexes that do their own ngram parsing
+    return '\n'.join(cjk_runs(text))
+
+
+def bigrams(run):
+    """the overlapping bigrams of a run, followed by its last character on its own
+    so that every character of the run starts a token and a one character query can be a prefix search
+    """
+    if len(run) == 1:
+        return [run]
+    return [run[i:i + 2] for i in range(len(run) - 1)] + [run[-1]]
+
+
+def query_bigrams(run):
+    # the bigrams a query for run has to find next to each other, without the trailing single character
+    if len(run) == 1:
+        return [run]
+    return [run[i:i + 2] for i in range(len(run) - 1)]
+
+
+def gram_text(text):
+    # the cjk part of a document as space separated bigrams, for indexes that split on whitespace
+    return ' '.join(gram for run in cjk_runs(text) for gram in bigrams(run))
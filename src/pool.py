@@ -0,0 +1,158 @@
+# connections shared by the threads of the app: every call of a database method borrows one for its duration,
+# so the gui, the import worker and the folder watcher never use the same connection or cursor at once
+import functools
+import inspect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# connections open at most, a thread that wants one more waits for one to be given back
+DEFAULT_SIZE = int(os.environ.get('CORPORA_POOL_SIZE', 4))
+# seconds a connection may sit idle before it is checked again when it is handed out
+PING_INTERVAL = 60
+
+
+class ConnectionPool:
+    """ connect() opens a connection, ping(connection) checks it before reuse and reconnects or raises,
+    broken(exception) says whether the connection can't be used any more after that exception
+    """
+
+    def __init__(self, connect, close, ping=None, broken=None, size=None):
+        self.connect = connect
+        self.close_connection = close
+        self.ping = ping
+        self.broken = broken or (lambda e: False)
+        self.size = size or DEFAULT_SIZE
+        # [(connection, time it was given back)]
+        self.idle = []
+        self.count = 0
+        self.condition = threading.Condition()
+        self.local = threading.local()
+        # thread ident -> the connection that thread has borrowed, for interrupting it from another thread.
+        # changed only with borrow_lock held, which interrupt() holds until the statement is killed
+        self.borrowed = {}
+        self.borrow_lock = threading.Lock()
+
+    def acquire(self):
+        with self.condition:
+            while not self.idle and self.count >= self.size:
+                self.condition.wait()
+            if self.idle:
+                connection, released = self.idle.pop()
+            else:
+                connection, released = None, None
+                self.count += 1
+        try:
+            if connection is None:
+                return self.connect()
+            if self.ping is not None and time.monotonic() - released > PING_INTERVAL:
+                try:
+                    # the server may have dropped it after its wait_timeout
+                    self.ping(connection)
+                except Exception:
+                    self.discard(connection)
+                    with self.condition:
+                        self.count += 1
+                    return self.connect()
+            return connection
+        except BaseException:
+            with self.condition:
+                self.count -= 1
+                self.condition.notify()
+            raise
+
+    def release(self, connection):
+        with self.condition:
+            self.idle.append((connection, time.monotonic()))
+            self.condition.notify()
+
+    def discard(self, connection):
+        try:
+            self.close_connection(connection)
+        except Exception:
+            pass
+        with self.condition:
+            self.count -= 1
+            self.condition.notify()
+
+    @contextmanager
+    def connection(self):
+        # the connection borrowed by this thread, nested calls share it
+        connection = getattr(self.local, 'connection', None)
+        if connection is not None:
+            yield connection
+            return
+        connection = self.acquire()
+        thread = threading.get_ident()
+        self.local.connection = connection
+        with self.borrow_lock:
+            self.borrowed[thread] = connection
+        try:
+            yield connection
+        except BaseException as e:
+            self.give_back(thread, connection)
+            if self.broken(e):
+                self.discard(connection)
+            else:
+                self.release(connection)
+            raise
+        self.give_back(thread, connection)
+        self.release(connection)
+
+    def give_back(self, thread, connection):
+        # not while interrupt() kills a statement on it, it could be handed to another thread right after
+        self.local.connection = None
+        with self.borrow_lock:
+            del self.borrowed[thread]
+
+    def current(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            raise RuntimeError('no connection borrowed by this thread, use pool.connection()')
+        return connection
+
+    def interrupt(self, thread, kill):
+        """kill(connection) with the connection thread has borrowed, nothing if it has none right now.
+        the thread can't give the connection back before kill returns, so kill never stops the call of another
+        thread the connection was handed to
+        """
+        with self.borrow_lock:
+            connection = self.borrowed.get(thread)
+            if connection is not None:
+                kill(connection)
+
+    def close(self):
+        with self.condition:
+            idle, self.idle = self.idle, []
+            self.count -= len(idle)
+        for connection, released in idle:
+            try:
+                self.close_connection(connection)
+            except Exception:
+                pass
+
+
+def unpooled(method):
+    # a public method that must not wait for a connection, e.g. one that interrupts the connection of another thread
+    method.unpooled = True
+    return method
+
+
+def pooled(cls):
+    """class decorator: every public method of cls runs with a connection of self.pool borrowed,
+    the private helpers are only called from those, and the methods marked unpooled run without one
+    """
+    for name, method in list(vars(cls).items()):
+        if name.startswith('_') or not inspect.isfunction(method) or getattr(method, 'unpooled', False):
+            continue
+
+        def wrap(method):
+            @functools.wraps(method)
+            def wrapper(self, *args, **kwargs):
+                with self.pool.connection():
+                    return method(self, *args, **kwargs)
+            return wrapper
+
+        setattr(cls, name, wrap(method))
+    return cls
@@ -0,0 +1,204 @@
+# a read-through cache in front of a CorporaDatabase, open_database() puts it there
+# reads remember which tables they looked at, a write drops exactly the cached reads of the tables it changed.
+# a dependency is a table name, or (table, class_id) for the part of a table that belongs to one class
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from database import CorporaDatabase
+
+# cached results at most, the least recently used go first
+DEFAULT_SIZE = int(os.environ.get('CORPORA_QUERY_CACHE_SIZE', 256))
+# seconds a result is used, a bound on how stale it gets when another process writes to the database
+DEFAULT_TTL = float(os.environ.get('CORPORA_QUERY_CACHE_TTL', 30))
+
+# what a search reads, filetag for the tag filter
+SEARCH_TABLES = ('textfiles', 'files', 'chapters', 'classes', 'filetag')
+
+
+def table(dependency):
+    return dependency[0] if isinstance(dependency, tuple) else dependency
+
+
+def overlaps(dependency, change):
+    # the same table, and the same class unless one of them is about the whole table
+    if table(dependency) != table(change):
+        return False
+    return not isinstance(dependency, tuple) or not isinstance(change, tuple) or dependency == change
+
+
+class QueryCache:
+    def __init__(self, size=None, ttl=None):
+        self.size = size or DEFAULT_SIZE
+        self.ttl = DEFAULT_TTL if ttl is None else ttl
+        # key -> (expires, dependencies, value)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        # counts invalidations, a read that overlapped one doesn't store its possibly stale result
+        self.generation = 0
+        self.hits = {}
+        self.misses = {}
+
+    def get(self, key, dependencies, load, copy=None):
+        """the cached result of key, load() on a miss. copy makes what the caller gets from a cached value,
+        for results the gui changes in place
+        """
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(key)
+                self.hits[key[0]] = self.hits.get(key[0], 0) + 1
+                return copy(entry[2]) if copy else entry[2]
+            self.misses[key[0]] = self.misses.get(key[0], 0) + 1
+            generation = self.generation
+        value = load()
+        with self.lock:
+            if generation == self.generation:
+                self.entries[key] = (now + self.ttl, dependencies, value)
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.size:
+                    self.entries.popitem(last=False)
+        return copy(value) if copy else value
+
+    def invalidate(self, *changes):
+        with self.lock:
+            self.generation += 1
+            for key in [key for key, (expires, dependencies, value) in self.entries.items()
+                        if any(overlaps(dependency, change) for dependency in dependencies for change in changes)]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+    def stats(self):
+        # {method: (hits, misses)}
+        with self.lock:
+            return {method: (self.hits.get(method, 0), self.misses.get(method, 0))
+                    for method in sorted(set(self.hits) | set(self.misses))}
+
+    def reset_stats(self):
+        with self.lock:
+            self.hits = {}
+            self.misses = {}
+
+
+def copy_files(result):
+    files, chapters = result
+    return {chapter_id: list(chapter_files) for chapter_id, chapter_files in files.items()}, dict(chapters)
+
+
+class CachedDatabase(CorporaDatabase):
+    """ the reads of database through a QueryCache, the writes go straight through and invalidate it """
+
+    def __init__(self, database, size=None, ttl=None):
+        self.database = database
+        self.cache = QueryCache(size, ttl)
+
+    def write(self, changes, method, *args):
+        try:
+            return method(*args)
+        finally:
+            # also after a failed write, part of it may have been committed
+            self.cache.invalidate(*changes)
+
+    def get_classes(self):
+        return self.cache.get(('get_classes',), ('classes',), self.database.get_classes, list)
+
+    def add_class(self, class_name, teacher_name):
+        return self.write(('classes',), self.database.add_class, class_name, teacher_name)
+
+    def delete_class(self, class_id):
+        return self.write(('classes', ('chapters', class_id), ('files', class_id), 'filetag', 'textfiles'),
+                          self.database.delete_class, class_id)
+
+    def get_files(self, class_id):
+        return self.cache.get(('get_files', class_id), (('chapters', class_id), ('files', class_id)),
+                              lambda: self.database.get_files(class_id), copy_files)
+
+    def add_file(self, file_name, file_address, file_type, file_size, chapter_id, class_id) -> int:
+        return self.write((('files', class_id), ('chapters', class_id)), self.database.add_file,
+                          file_name, file_address, file_type, file_size, chapter_id, class_id)
+
+    def add_files(self, files) -> list:
+        class_ids = {file[5] for file in files}
+        return self.write([('files', class_id) for class_id in class_ids] +
+                          [('chapters', class_id) for class_id in class_ids] + ['textfiles'],
+                          self.database.add_files, files)
+
+    def update_files(self, files):
+        return self.write(('files', 'chapters', 'textfiles'), self.database.update_files, files)
+
+    def delete_file(self, file_id):
+        return self.write(('files', 'chapters', 'filetag', 'textfiles'), self.database.delete_file, file_id)
+
+    def add_chapter(self, class_id, chapter_name) -> int:
+        return self.write((('chapters', class_id),), self.database.add_chapter, class_id, chapter_name)
+
+    def delete_chapter(self, chapter_id):
+        return self.write(('chapters', 'files', 'filetag', 'textfiles'), self.database.delete_chapter, chapter_id)
+
+    def chapter_exists(self, chapter_id):
+        return self.cache.get(('chapter_exists', chapter_id), ('chapters',),
+                              lambda: self.database.chapter_exists(chapter_id))
+
+    def get_chapter_size(self, chapter_id):
+        return self.cache.get(('get_chapter_size', chapter_id), ('chapters',),
+                              lambda: self.database.get_chapter_size(chapter_id))
+
+    def update_chapter_total_size(self, chapter_id, classes_class_id):
+        return self.write((('chapters', classes_class_id),), self.database.update_chapter_total_size,
+                          chapter_id, classes_class_id)
+
+    def add_textfile(self, file_id, text):
+        return self.write(('textfiles',), self.database.add_textfile, file_id, text)
+
+    def rebuild_chunks(self, batch_size=100):
+        return self.write(('textfiles',), self.database.rebuild_chunks, batch_size)
+
+    def compress_texts(self, batch_size=100):
+        return self.write(('textfiles',), self.database.compress_texts, batch_size)
+
+    def get_filetags(self, file_id):
+        return self.cache.get(('get_filetags', file_id), (('filetag', file_id), 'tagname'),
+                              lambda: self.database.get_filetags(file_id), list)
+
+    def delete_filetag(self, file_id, tag_id):
+        return self.write((('filetag', file_id),), self.database.delete_filetag, file_id, tag_id)
+
+    def add_filetag(self, file_id, tag_id):
+        return self.write((('filetag', file_id),), self.database.add_filetag, file_id, tag_id)
+
+    def add_tag(self, tag_name):
+        return self.write(('tagname',), self.database.add_tag, tag_name)
+
+    def delete_tag(self, tag_id):
+        return self.write(('tagname', 'filetag'), self.database.delete_tag, tag_id)
+
+    def get_tags(self):
+        return self.cache.get(('get_tags',), ('tagname',), self.database.get_tags, list)
+
+    def get_all_files(self):
+        return self.cache.get(('get_all_files',), ('classes', 'chapters', 'files'), self.database.get_all_files, list)
+
+    def get_all_files_page(self, after_file_id, limit):
+        return self.cache.get(('get_all_files_page', after_file_id, limit), ('classes', 'chapters', 'files'),
+                              lambda: self.database.get_all_files_page(after_file_id, limit), list)
+
+    def search(self, keyword):
+        # whole texts, too big to keep around
+        return self.database.search(keyword)
+
+    def search_files(self, keyword, snippet_length=100, limit=None, offset=0, within=None, filters=None):
+        return self.cache.get(('search_files', keyword, snippet_length, limit, offset, within, filters), SEARCH_TABLES,
+                              lambda: self.database.search_files(keyword, snippet_length, limit, offset, within,
+                                                                 filters), list)
+
+    def interrupt(self, thread):
+        self.database.interrupt(thread)
+
+    def get_file_info(self, file_id):
+        return self.cache.get(('get_file_info', file_id), ('files',), lambda: self.database.get_file_info(file_id))
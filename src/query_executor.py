@@ -0,0 +1,142 @@
+# database calls off the gui thread: a widget submits a call and gets its result in a callback on the gui thread,
+# so a slow search or a long delete never freezes the window
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+# threads running reads at once, the connection pool should have at least as many connections
+DEFAULT_WORKERS = int(os.environ.get('CORPORA_QUERY_WORKERS', 4))
+
+
+class Query:
+    def __init__(self, key, done, failed):
+        self.key = key
+        self.done = done
+        self.failed = failed
+        self.future = None
+        self.cancelled = False
+
+    def cancel(self):
+        # a query that is already running finishes, but its result is dropped
+        self.cancelled = True
+        self.future.cancel()
+
+
+class QueryExecutor(QObject):
+    """ read() and write() run func(*args) on a worker thread, then done(result) or failed(exception)
+    is called on the thread the executor was created on.
+    a read submitted under a key supersedes the read still pending under the same key: the older one is
+    cancelled, or its result is dropped if it already started, so only the latest result is delivered.
+    a read that is already running is also stopped with interrupt(thread), e.g. database.interrupt, if given,
+    so that superseded searches don't keep the workers and the server busy.
+    writes run one at a time in the order they were submitted, and a read waits for the writes submitted
+    before it, so a refresh after a change sees the change
+    """
+    # query, result, exception, emitted on a worker thread and delivered through the event loop
+    finished = pyqtSignal(object, object, object)
+
+    def __init__(self, workers=None, interrupt=None, parent=None):
+        super().__init__(parent)
+        self.readers = ThreadPoolExecutor(workers or DEFAULT_WORKERS, thread_name_prefix='query')
+        self.writer = ThreadPoolExecutor(1, thread_name_prefix='write')
+        # key -> the latest read submitted under it that hasn't been delivered, only used on the gui thread
+        self.pending = {}
+        self.last_write = None
+        self.interrupt = interrupt
+        # interrupting may take a round trip to the server, it is done on a thread of its own
+        self.interrupter = ThreadPoolExecutor(1, thread_name_prefix='interrupt') if interrupt else None
+        # worker thread -> the query it is running, a thread leaves it only with the lock held,
+        # so a query found here under the lock is still the one running on that thread
+        self.running = {}
+        self.lock = threading.Lock()
+        # set by shutdown, the reads still queued then are dropped without calling the database
+        self.closed = False
+        self.finished.connect(self.deliver)
+
+    def read(self, key, func, *args, done=None, failed=None):
+        """key is any hashable, e.g. (widget, 'files'), None for a read that is never superseded"""
+        query = Query(key, done, failed)
+        if key is not None:
+            self.cancel(key)
+            self.pending[key] = query
+        barrier = self.last_write
+        query.future = self.readers.submit(self.run_read, query, self.after(barrier, func), args)
+        return query
+
+    def write(self, func, *args, done=None, failed=None):
+        query = Query(None, done, failed)
+        query.future = self.writer.submit(self.run, query, func, args)
+        self.last_write = query.future
+        return query
+
+    def cancel(self, key):
+        query = self.pending.pop(key, None)
+        if query is not None:
+            query.cancel()
+            if self.interrupter is not None and query.future.running():
+                self.interrupter.submit(self.stop, query)
+
+    def stop(self, query):
+        with self.lock:
+            for thread, running in self.running.items():
+                if running is query:
+                    try:
+                        self.interrupt(thread)
+                    except Exception as e:
+                        print("error: interrupt", e)
+
+    @staticmethod
+    def after(barrier, func):
+        if barrier is None or barrier.done():
+            return func
+
+        def call(*args):
+            wait([barrier])
+            return func(*args)
+
+        return call
+
+    def run_read(self, query, func, args):
+        if not self.closed:
+            self.run(query, func, args)
+
+    def run(self, query, func, args):
+        thread = threading.get_ident()
+        with self.lock:
+            if query.cancelled:
+                return
+            self.running[thread] = query
+        try:
+            result = func(*args)
+        except Exception as e:
+            self.finished.emit(query, None, e)
+            return
+        finally:
+            with self.lock:
+                del self.running[thread]
+        self.finished.emit(query, result, None)
+
+    def deliver(self, query, result, error):
+        if query.key is not None and self.pending.get(query.key) is query:
+            del self.pending[query.key]
+        if query.cancelled:
+            return
+        if error is not None:
+            if query.failed is not None:
+                query.failed(error)
+            else:
+                print("error:", error)
+        elif query.done is not None:
+            query.done(result)
+
+    def shutdown(self):
+        # pending reads are dropped, the writes already submitted are finished
+        self.closed = True
+        for key in list(self.pending):
+            self.cancel(key)
+        self.readers.shutdown(wait=False)
+        self.writer.shutdown(wait=True)
+        if self.interrupter is not None:
+            self.interrupter.shutdown(wait=False)
@@ -0,0 +1,250 @@
+# a process pool for text extraction that a bad file can't take down: every task has a wall clock timeout,
+# the workers run under a memory limit and are replaced after a number of files or when they grew too big
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import CancelledError, Future
+from multiprocessing.connection import wait as wait_connections
+
+from metrics import metrics
+
+try:
+    import resource
+except ImportError:
+    # windows, the workers run without a memory limit
+    resource = None
+
+# seconds one file (or one page range of a pdf) may take
+DEFAULT_TIMEOUT = float(os.environ.get('CORPORA_EXTRACT_TIMEOUT', 120))
+# address space of a worker in MiB, 0 for no limit
+DEFAULT_MEMORY_LIMIT = int(os.environ.get('CORPORA_EXTRACT_MEMORY', 2048))
+# files a worker extracts before it is replaced by a fresh one
+DEFAULT_TASKS_PER_WORKER = int(os.environ.get('CORPORA_EXTRACT_RECYCLE', 50))
+# a worker whose peak resident size went over this (MiB) is replaced after its task
+RECYCLE_RSS = 512
+
+
+class SandboxError(Exception):
+    """ the task didn't fail by itself, the worker running it had to be stopped """
+
+
+class ExtractTimeout(SandboxError):
+    def __init__(self, timeout):
+        super().__init__(f'timed out after {timeout:g}s')
+        # the limit in effect, a longer one may be enough for the file
+        self.timeout = timeout
+
+
+class WorkerCrashed(SandboxError):
+    def __init__(self, message, memory_limit):
+        super().__init__(message)
+        # the limit the worker ran under, it may have been killed for going over it
+        self.memory_limit = memory_limit
+
+
+def out_of_memory(memory_limit):
+    error = MemoryError(f'out of memory (limit {memory_limit} MiB)')
+    # pickled with the exception, a larger limit may be enough for the file
+    error.memory_limit = memory_limit
+    return error
+
+
+def peak_rss():
+    # MiB, ru_maxrss is in KiB on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def serve(conn, memory_limit, tasks_per_worker):
+    # the loop of a worker process: run tasks until told to stop or until it should be replaced
+    metrics.forked()
+    if resource is not None and memory_limit:
+        # RLIMIT_RSS is not enforced by linux, the address space limit makes big allocations fail instead
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit * 1024 * 1024, memory_limit * 1024 * 1024))
+    for done in range(1, tasks_per_worker + 1):
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        func, args = task
+        try:
+            result = True, func(*args)
+            retire = done == tasks_per_worker
+        except MemoryError:
+            result = False, out_of_memory(memory_limit)
+            retire = True
+        except Exception as e:
+            result = False, e
+            retire = done == tasks_per_worker
+        if resource is not None and peak_rss() > RECYCLE_RSS:
+            retire = True
+        # what the task recorded goes to the metrics of the app
+        drained = metrics.drain()
+        try:
+            conn.send(result + (retire, drained))
+        except Exception as e:
+            # an exception that can't be pickled
+            conn.send((False, RuntimeError(str(e) or type(e).__name__), retire, drained))
+        if retire:
+            return
+
+
+class Worker:
+    def __init__(self, context, memory_limit, tasks_per_worker):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=serve, args=(child_conn, memory_limit, tasks_per_worker), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.future = None
+        self.deadline = None
+
+    def run(self, future, func, args, timeout):
+        self.future = future
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.conn.send((func, args))
+
+    def finish(self):
+        future, self.future, self.deadline = self.future, None, None
+        return future
+
+    def stop(self, kill=False):
+        if kill:
+            self.process.terminate()
+        else:
+            try:
+                self.conn.send(None)
+            except OSError:
+                pass
+        self.process.join()
+        self.conn.close()
+
+
+class SandboxPool:
+    """ submit() returns a concurrent.futures.Future like a ProcessPoolExecutor does,
+    a task that times out or whose worker dies fails with a SandboxError and the worker is replaced
+    """
+
+    def __init__(self, max_workers=None, timeout=None, memory_limit=None, tasks_per_worker=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.timeout = DEFAULT_TIMEOUT if timeout is None else timeout
+        self.memory_limit = DEFAULT_MEMORY_LIMIT if memory_limit is None else memory_limit
+        self.tasks_per_worker = tasks_per_worker or DEFAULT_TASKS_PER_WORKER
+        self.context = multiprocessing.get_context()
+        self.queue = deque()
+        self.lock = threading.Lock()
+        self.workers = []
+        self.closing = False
+        self.aborted = False
+        # set when there is something for an idle dispatcher to do
+        self.wakeup = threading.Event()
+        self.dispatcher = threading.Thread(target=self.dispatch, daemon=True)
+        self.dispatcher.start()
+
+    def submit(self, func, *args):
+        future = Future()
+        with self.lock:
+            if self.closing:
+                raise RuntimeError('cannot submit after shutdown')
+            self.queue.append((future, func, args))
+        self.wakeup.set()
+        return future
+
+    def shutdown(self, wait=True):
+        """wait: finish the queued tasks first, otherwise they are cancelled and the running ones are killed"""
+        with self.lock:
+            self.closing = True
+            if not wait:
+                self.aborted = True
+                while self.queue:
+                    self.queue.popleft()[0].cancel()
+        self.wakeup.set()
+        if wait:
+            self.dispatcher.join()
+
+    def next_task(self):
+        with self.lock:
+            while self.queue:
+                future, func, args = self.queue.popleft()
+                if future.set_running_or_notify_cancel():
+                    return future, func, args
+        return None
+
+    def dispatch(self):
+        while True:
+            with self.lock:
+                closing = self.closing
+                idle = not self.queue
+            if self.aborted:
+                for worker in self.workers:
+                    if worker.future is not None:
+                        worker.finish().set_exception(CancelledError())
+                    worker.stop(kill=True)
+                self.workers = []
+                return
+            busy = [worker for worker in self.workers if worker.future is not None]
+            if closing and idle and not busy:
+                break
+            # hand queued tasks to idle workers, start workers up to max_workers
+            for worker in self.workers + [None] * (self.max_workers - len(self.workers)):
+                if worker is not None and worker.future is not None:
+                    continue
+                task = self.next_task()
+                if task is None:
+                    break
+                if worker is None:
+                    worker = Worker(self.context, self.memory_limit, self.tasks_per_worker)
+                    self.workers.append(worker)
+                future, func, args = task
+                try:
+                    worker.run(future, func, args, self.timeout)
+                except OSError:
+                    # an idle worker that died in the meantime
+                    self.fail(worker, WorkerCrashed('extraction worker died', self.memory_limit))
+            busy = [worker for worker in self.workers if worker.future is not None]
+            if not busy:
+                self.wakeup.wait()
+                self.wakeup.clear()
+                continue
+            ready = wait_connections([worker.conn for worker in busy] + [worker.process.sentinel for worker in busy],
+                                     timeout=0.05)
+            now = time.monotonic()
+            for worker in busy:
+                if worker.conn in ready:
+                    try:
+                        ok, result, retire, drained = worker.conn.recv()
+                    except (EOFError, OSError):
+                        self.crashed(worker)
+                        continue
+                    metrics.merge(drained)
+                    future = worker.finish()
+                    if ok:
+                        future.set_result(result)
+                    else:
+                        future.set_exception(result)
+                    if retire:
+                        self.replace(worker)
+                elif worker.process.sentinel in ready:
+                    self.crashed(worker)
+                elif worker.deadline is not None and now > worker.deadline:
+                    self.fail(worker, ExtractTimeout(self.timeout))
+        for worker in self.workers:
+            worker.stop()
+        self.workers = []
+
+    def crashed(self, worker):
+        # killed by the kernel for its memory, or a segfault in a native library
+        worker.process.join()
+        self.fail(worker, WorkerCrashed(f'extraction worker died (exit code {worker.process.exitcode})',
+                                        self.memory_limit))
+
+    def fail(self, worker, error):
+        worker.finish().set_exception(error)
+        self.replace(worker, kill=True)
+
+    def replace(self, worker, kill=False):
+        # a new worker is started for the next task
+        worker.stop(kill=kill)
+        self.workers.remove(worker)
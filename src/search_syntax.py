@@ -0,0 +1,74 @@
+# the query language of the search bar, both backends turn it into the syntax of their full text index:
+#   words          at least one of the words has to appear
+#   中文            every run of chinese has to appear as it is written
+#   "a phrase"     has to appear as it is written, so does +word
+#   -word          must not appear anywhere in the file, nor must -"a phrase"
+# a match is one page or chunk of a file (see chunks.py), an excluded term leaves out the whole file. the chinese
+# runs and the other words of a phrase are looked up in different indexes, so a phrase mixing them only needs
+# each of its parts on the page
+import re
+from collections import namedtuple
+
+from ngram import cjk_runs, latin_words
+
+# runs: chinese that has to appear, phrases: words that have to appear next to each other (space separated),
+# words: at least one of them has to appear, excluded_runs and excluded_phrases: none of them may appear
+SearchQuery = namedtuple('SearchQuery', ['runs', 'phrases', 'words', 'excluded_runs', 'excluded_phrases'])
+
+# an operator, then a quoted phrase or a word. the closing quote may still be missing while the user types
+TOKEN = re.compile(r'([+-]?)(?:"([^"]*)"?|(\S+))')
+# a word without a letter or a digit, e.g. the - of 数据-库, has nothing the full text indexes could find
+INDEXED = re.compile(r'\w')
+
+
+def words_of(text):
+    return [word for word in latin_words(text) if INDEXED.search(word)]
+
+
+def parse_query(keyword):
+    runs, phrases, words, excluded_runs, excluded_phrases = [], [], [], [], []
+    for match in TOKEN.finditer(keyword):
+        operator, quoted, word = match.groups()
+        text = word if quoted is None else quoted
+        latin = ' '.join(words_of(text))
+        if operator == '-':
+            excluded_runs += cjk_runs(text)
+            if latin:
+                excluded_phrases.append(latin)
+        elif operator == '+' or quoted is not None:
+            runs += cjk_runs(text)
+            if latin:
+                phrases.append(latin)
+        else:
+            runs += cjk_runs(text)
+            words += words_of(text)
+    return SearchQuery(runs, phrases, words, excluded_runs, excluded_phrases)
+
+
+def can_match(query):
+    # a query of only exclusions would be every page but those, it finds nothing instead
+    return bool(query.runs or query.phrases or query.words)
+
+
+def first_term(query):
+    # what the snippet of a hit starts at
+    for terms in (query.runs, query.phrases, query.words):
+        if terms:
+            return terms[0]
+    return ''
+
+
+def narrows(keyword, extended):
+    """whether every file search_files finds for extended is also found for keyword, so that the hits of keyword
+    can be passed as within when the user types on: every run of keyword is part of a run of extended,
+    extended has the phrases and the exclusions of keyword, and both have the same words,
+    since more words only widen the search
+    """
+    query = parse_query(keyword)
+    extended = parse_query(extended)
+    if not can_match(query) or query.words != extended.words:
+        return False
+    return all(any(run in extended_run for extended_run in extended.runs) for run in query.runs) and \
+        set(query.phrases) <= set(extended.phrases) and \
+        set(query.excluded_runs) <= set(extended.excluded_runs) and \
+        set(query.excluded_phrases) <= set(extended.excluded_phrases)
@@ -0,0 +1,490 @@
+# an embedded sqlite database, full text search uses an fts5 index
+import os
+import sqlite3
+import time
+
+from database import CorporaDatabase, search_conditions
+from chunks import split_chunks
+from metrics import SLOW_QUERY_MS, instrumented, log_slow
+from ngram import gram_text, query_bigrams
+from pool import ConnectionPool, pooled, unpooled
+from search_syntax import can_match, first_term, parse_query
+from textstore import compress, pack, unpack
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'corpora.db')
+
+# the same tables as Corpora.sql, total_size is kept up to date by update_chapter_total_size
+SCHEMA = '''
+create table if not exists classes (
+    class_id integer primary key autoincrement,
+    class_name text not null check (class_name <> ''),
+    teacher_name text
+);
+create table if not exists chapters (
+    chapter_id integer primary key autoincrement,
+    chapter_name text not null,
+    total_size integer default 0,
+    classes_class_id integer not null references classes (class_id)
+);
+create index if not exists chapters_class on chapters (classes_class_id);
+create table if not exists files (
+    file_id integer primary key autoincrement,
+    file_name text not null,
+    file_address text,
+    file_type text,
+    file_size integer,
+    chapters_chapter_id integer not null references chapters (chapter_id),
+    chapters_classes_class_id integer not null references classes (class_id)
+);
+create index if not exists files_chapter on files (chapters_chapter_id);
+create index if not exists files_class on files (chapters_classes_class_id);
+create index if not exists files_type on files (file_type);
+create table if not exists textfiles (
+    files_file_id integer primary key references files (file_id),
+    content text,
+    -- the text compressed by textstore.pack, content is null then
+    content_z blob
+);
+create table if not exists tagname (
+    tag_id integer primary key autoincrement,
+    tag_name text not null
+);
+create table if not exists filetag (
+    files_file_id integer not null references files (file_id),
+    tagname_tag_id integer not null references tagname (tag_id),
+    primary key (files_file_id, tagname_tag_id)
+);
+create index if not exists filetag_tag on filetag (tagname_tag_id);
+create view if not exists allfiles as
+    select class_name, chapter_name, file_name from files
+    join chapters on chapters.chapter_id = files.chapters_chapter_id
+    join classes on classes.class_id = files.chapters_classes_class_id;
+
+-- the text of every file cut into pages or chunks (see chunks.py), search looks in these instead of textfiles
+create table if not exists textchunks (
+    chunk_id integer primary key autoincrement,
+    files_file_id integer not null references files (file_id),
+    chunk integer not null,
+    page integer,
+    start_offset integer not null,
+    content text not null
+);
+create index if not exists textchunks_file on textchunks (files_file_id, chunk);
+create trigger if not exists textfiles_delete_chunks after delete on textfiles begin
+    delete from textchunks where files_file_id = old.files_file_id;
+end;
+
+-- external content fts5 index over textchunks, kept in sync by triggers
+create virtual table if not exists textchunks_fts using fts5 (content, content='textchunks', content_rowid='chunk_id');
+-- the cjk text of a chunk as space separated bigrams (see ngram.py), written next to it by _insert_texts
+create virtual table if not exists chunkgrams using fts5 (grams);
+create trigger if not exists textchunks_insert after insert on textchunks begin
+    insert into textchunks_fts (rowid, content) values (new.chunk_id, new.content);
+end;
+create trigger if not exists textchunks_delete after delete on textchunks begin
+    insert into textchunks_fts (textchunks_fts, rowid, content) values ('delete', old.chunk_id, old.content);
+    delete from chunkgrams where rowid = old.chunk_id;
+end;
+'''
+
+# the per file indexes of databases created before textchunks, the chunks are built from textfiles when they go
+MIGRATION = '''
+drop trigger if exists textfiles_insert;
+drop trigger if exists textfiles_delete;
+drop trigger if exists textfiles_update;
+drop trigger if exists textgrams_delete;
+drop table if exists textfiles_fts;
+drop table if exists textgrams;
+'''
+
+
+def fts_phrase(text):
+    # quoting keeps user input such as - or " from being parsed as query syntax
+    return '"' + text.replace('"', '""') + '"'
+
+
+def fts_query(query):
+    # every phrase and at least one of the words, like mysql's natural language mode for words alone
+    parts = [fts_phrase(phrase) for phrase in query.phrases]
+    if query.words:
+        parts.append('(' + ' OR '.join(fts_phrase(word) for word in query.words) + ')')
+    return ' AND '.join(parts)
+
+
+def gram_phrase(run):
+    # a cjk run as a phrase of its bigrams, a single character is a prefix search since it only starts bigrams
+    return '"' + ' '.join(query_bigrams(run)) + '"' + ('*' if len(run) == 1 else '')
+
+
+def gram_query(runs):
+    # all of the runs have to match
+    return ' AND '.join(gram_phrase(run) for run in runs)
+
+
+class LoggedConnection(sqlite3.Connection):
+    """ puts the statements slower than SLOW_QUERY_MS in the slow query log,
+    for a select that is the time to its first row
+    """
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            log_slow(sql, parameters, start)
+
+    def executemany(self, sql, parameters):
+        parameters = list(parameters)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            log_slow(sql, parameters, start)
+
+    def executescript(self, script):
+        start = time.perf_counter()
+        try:
+            return super().executescript(script)
+        finally:
+            log_slow(script, None, start)
+
+
+@instrumented('database')
+@pooled
+class SQLiteDatabase(CorporaDatabase):
+    def __init__(self, path=None):
+        self.path = path or os.environ.get('CORPORA_SQLITE_PATH', DEFAULT_PATH)
+        # readers don't block each other in wal mode, a second writer waits for the first one
+        self.pool = ConnectionPool(self._connect, sqlite3.Connection.close)
+        with self.pool.connection():
+            migrate = self.conn.execute("select 1 from sqlite_master where name = 'textfiles_fts'").fetchone()
+            self.conn.executescript(SCHEMA)
+            if 'content_z' not in [column[1] for column in self.conn.execute('pragma table_info(textfiles)')]:
+                self.conn.execute('alter table textfiles add column content_z blob')
+            if migrate:
+                self.conn.executescript(MIGRATION)
+                self.rebuild_chunks()
+
+    def _connect(self):
+        # statements are parsed once and reused from the connection's statement cache,
+        # the pool makes sure only one thread at a time uses a connection
+        conn = sqlite3.connect(self.path, cached_statements=256, timeout=30, check_same_thread=False,
+                               factory=LoggedConnection if SLOW_QUERY_MS else sqlite3.Connection)
+        conn.execute('pragma journal_mode = wal')
+        conn.execute('pragma synchronous = normal')
+        conn.execute('pragma foreign_keys = on')
+        return conn
+
+    def __del__(self):
+        self.pool.close()
+
+    @property
+    def conn(self):
+        return self.pool.current()
+
+    def get_classes(self):
+        return self.conn.execute('select class_id, class_name, teacher_name from classes').fetchall()
+
+    def add_class(self, class_name, teacher_name):
+        try:
+            with self.conn:
+                self.conn.execute('insert into classes (class_name, teacher_name) values (?, ?)',
+                                  (class_name, teacher_name))
+        except sqlite3.IntegrityError:
+            raise RuntimeError('class name is null')
+
+    def delete_class(self, class_id):
+        with self.conn:
+            self.conn.execute('delete from filetag where files_file_id in '
+                              '(select file_id from files where chapters_classes_class_id = ?)', (class_id,))
+            self.conn.execute('delete from textfiles where files_file_id in '
+                              '(select file_id from files where chapters_classes_class_id = ?)', (class_id,))
+            self.conn.execute('delete from files where chapters_classes_class_id = ?', (class_id,))
+            self.conn.execute('delete from chapters where classes_class_id = ?', (class_id,))
+            self.conn.execute('delete from classes where class_id = ?', (class_id,))
+
+    def get_files(self, class_id):
+        rows = self.conn.execute('select chapter_id, chapter_name, total_size, '
+                                 'file_id, file_name, file_address, file_type, file_size '
+                                 'from chapters left join files on files.chapters_chapter_id = chapters.chapter_id '
+                                 'and files.chapters_classes_class_id = chapters.classes_class_id '
+                                 'where chapters.classes_class_id = ? '
+                                 'order by chapter_id, file_id', (class_id,))
+        chapters = {}
+        files = {}
+        for chapter_id, chapter_name, total_size, *file in rows:
+            if chapter_id not in chapters:
+                chapters[chapter_id] = (chapter_name, total_size)
+                files[chapter_id] = []
+            if file[0] is not None:
+                files[chapter_id].append(tuple(file))
+        return files, chapters
+
+    def add_file(self, file_name, file_address, file_type, file_size, chapter_id, class_id) -> int:
+        with self.conn:
+            cursor = self.conn.execute('insert into files (file_name, file_address, file_type, file_size, '
+                                       'chapters_chapter_id, chapters_classes_class_id) values (?, ?, ?, ?, ?, ?)',
+                                       (file_name, file_address, file_type, file_size, chapter_id, class_id))
+            self._update_total_size(chapter_id)
+        return cursor.lastrowid
+
+    def add_files(self, files) -> list:
+        file_ids = []
+        chapters = []
+        with self.conn:
+            for file_name, file_address, file_type, file_size, chapter_id, class_id, text in files:
+                cursor = self.conn.execute('insert into files (file_name, file_address, file_type, file_size, '
+                                           'chapters_chapter_id, chapters_classes_class_id) '
+                                           'values (?, ?, ?, ?, ?, ?)',
+                                           (file_name, file_address, file_type, file_size, chapter_id, class_id))
+                file_ids.append(cursor.lastrowid)
+                if chapter_id not in chapters:
+                    chapters.append(chapter_id)
+            self._insert_texts([(file_id, file[6]) for file_id, file in zip(file_ids, files) if file[6] is not None])
+            for chapter_id in chapters:
+                self._update_total_size(chapter_id)
+        return file_ids
+
+    def update_files(self, files):
+        chapters = []
+        with self.conn:
+            for file_id, file_size, text in files:
+                self.conn.execute('update files set file_size = ? where file_id = ?', (file_size, file_id))
+                # the triggers take the old chunks out of both indexes
+                self.conn.execute('delete from textfiles where files_file_id = ?', (file_id,))
+                if text is not None:
+                    self._insert_texts([(file_id, text)])
+                chapter_id, = self.conn.execute('select chapters_chapter_id from files where file_id = ?',
+                                                (file_id,)).fetchone()
+                if chapter_id not in chapters:
+                    chapters.append(chapter_id)
+            for chapter_id in chapters:
+                self._update_total_size(chapter_id)
+
+    def delete_file(self, file_id):
+        with self.conn:
+            chapter_id, = self.conn.execute('select chapters_chapter_id from files where file_id = ?',
+                                            (file_id,)).fetchone()
+            self.conn.execute('delete from filetag where files_file_id = ?', (file_id,))
+            self.conn.execute('delete from textfiles where files_file_id = ?', (file_id,))
+            self.conn.execute('delete from files where file_id = ?', (file_id,))
+            self._update_total_size(chapter_id)
+        return chapter_id, self.get_chapter_size(chapter_id)
+
+    def add_chapter(self, class_id, chapter_name) -> int:
+        with self.conn:
+            cursor = self.conn.execute('insert into chapters (chapter_name, classes_class_id) values (?, ?)',
+                                       (chapter_name, class_id))
+        return cursor.lastrowid
+
+    def delete_chapter(self, chapter_id):
+        with self.conn:
+            self.conn.execute('delete from filetag where files_file_id in (select file_id from files where '
+                              'chapters_chapter_id = ?)', (chapter_id,))
+            self.conn.execute('delete from textfiles where files_file_id in (select file_id from files where '
+                              'chapters_chapter_id = ?)', (chapter_id,))
+            self.conn.execute('delete from files where chapters_chapter_id = ?', (chapter_id,))
+            self.conn.execute('delete from chapters where chapter_id = ?', (chapter_id,))
+
+    def chapter_exists(self, chapter_id):
+        return self.conn.execute('select 1 from chapters where chapter_id = ?', (chapter_id,)).fetchone() is not None
+
+    def get_chapter_size(self, chapter_id):
+        return self.conn.execute('select total_size from chapters where chapter_id = ?', (chapter_id,)).fetchone()[0]
+
+    def _update_total_size(self, chapter_id):
+        # what the update_total_size procedure does on mysql
+        self.conn.execute('update chapters set total_size = (select coalesce(sum(file_size), 0) from files '
+                          'where chapters_chapter_id = ?) where chapter_id = ?', (chapter_id, chapter_id))
+
+    def update_chapter_total_size(self, chapter_id, classes_class_id):
+        with self.conn:
+            self._update_total_size(chapter_id)
+
+    def _insert_chunks(self, file_id, text):
+        # one row at a time, the bigrams of a chunk are stored under its chunk_id
+        grams = []
+        for chunk, page, start_offset, content in split_chunks(text):
+            cursor = self.conn.execute('insert into textchunks (files_file_id, chunk, page, start_offset, content) '
+                                       'values (?, ?, ?, ?, ?)', (file_id, chunk, page, start_offset, content))
+            chunk_grams = gram_text(content)
+            if chunk_grams:
+                grams.append((cursor.lastrowid, chunk_grams))
+        self.conn.executemany('insert into chunkgrams (rowid, grams) values (?, ?)', grams)
+
+    def _insert_texts(self, texts):
+        # [(file_id, text)], inside the caller's transaction
+        self.conn.executemany('insert into textfiles (files_file_id, content, content_z) values (?, ?, ?)',
+                              [(file_id,) + pack(text) for file_id, text in texts])
+        for file_id, text in texts:
+            self._insert_chunks(file_id, text)
+
+    def add_textfile(self, file_id, text):
+        with self.conn:
+            self._insert_texts([(file_id, text)])
+
+    def rebuild_chunks(self, batch_size=100):
+        last_id = 0
+        count = 0
+        while True:
+            rows = self.conn.execute('select files_file_id, content, content_z from textfiles where files_file_id > ? '
+                                     'and files_file_id not in (select files_file_id from textchunks) '
+                                     'order by files_file_id limit ?', (last_id, batch_size)).fetchall()
+            if not rows:
+                return count
+            with self.conn:
+                for file_id, content, content_z in rows:
+                    self._insert_chunks(file_id, unpack(content, content_z))
+            count += len(rows)
+            last_id = rows[-1][0]
+
+    def compress_texts(self, batch_size=100):
+        last_id = 0
+        count = 0
+        while True:
+            rows = self.conn.execute('select files_file_id, content from textfiles where files_file_id > ? '
+                                     'and content is not null order by files_file_id limit ?',
+                                     (last_id, batch_size)).fetchall()
+            if not rows:
+                return count
+            with self.conn:
+                self.conn.executemany('update textfiles set content = null, content_z = ? where files_file_id = ?',
+                                      [(compress(content), file_id) for file_id, content in rows])
+            count += len(rows)
+            last_id = rows[-1][0]
+
+    def get_filetags(self, file_id):
+        return self.conn.execute('select tag_id, tag_name from filetag, tagname where files_file_id = ? '
+                                 'and tag_id = tagname_tag_id', (file_id,)).fetchall()
+
+    def delete_filetag(self, file_id, tag_id):
+        with self.conn:
+            self.conn.execute('delete from filetag where files_file_id = ? and tagname_tag_id = ?', (file_id, tag_id))
+
+    def add_filetag(self, file_id, tag_id):
+        with self.conn:
+            self.conn.execute('insert or ignore into filetag (files_file_id, tagname_tag_id) values (?, ?)',
+                              (file_id, tag_id))
+
+    def add_tag(self, tag_name):
+        with self.conn:
+            self.conn.execute('insert into tagname (tag_name) values (?)', (tag_name,))
+
+    def delete_tag(self, tag_id):
+        with self.conn:
+            self.conn.execute('delete from filetag where tagname_tag_id = ?', (tag_id,))
+            self.conn.execute('delete from tagname where tag_id = ?', (tag_id,))
+
+    def get_tags(self):
+        return self.conn.execute('select tag_id, tag_name from tagname').fetchall()
+
+    def get_all_files(self):
+        return self.conn.execute('select class_name, chapter_name, file_name from allfiles').fetchall()
+
+    def get_all_files_page(self, after_file_id, limit):
+        return self.conn.execute('select file_id, class_name, chapter_name, file_name from files '
+                                 'join chapters on chapters.chapter_id = files.chapters_chapter_id '
+                                 'join classes on classes.class_id = files.chapters_classes_class_id '
+                                 'where file_id > ? order by file_id limit ?', (after_file_id, limit)).fetchall()
+
+    def _hits(self, query, filtered=None):
+        """the query selecting (rowid, rank) of the chunks matching a SearchQuery and its arguments,
+        None if nothing can match. chinese is looked up in the bigram index chunkgrams, the other words
+        in textchunks_fts, the first index that has to match gives the rank. an excluded term drops every chunk
+        of the files it appears in.
+        filtered is (conditions on files, their arguments) the hits will be restricted to. fts5 can't use the
+        indexes of files, but it can skip to a range of rowids: the chunks are only looked for between the first
+        and the last chunk of the files that pass, a small range for a class or a chapter imported together,
+        so a search in one of them doesn't get slower as the rest of the corpus grows
+        """
+        if not can_match(query):
+            return None
+        # (index, fts5 query, whether the chunks must not match it)
+        matches = []
+        if query.runs:
+            matches.append(('chunkgrams', gram_query(query.runs), False))
+        if query.phrases or query.words:
+            matches.append(('textchunks_fts', fts_query(query), False))
+        if query.excluded_runs:
+            matches.append(('chunkgrams', ' OR '.join(gram_phrase(run) for run in query.excluded_runs), True))
+        if query.excluded_phrases:
+            matches.append(('textchunks_fts', ' OR '.join(fts_phrase(phrase) for phrase in query.excluded_phrases),
+                            True))
+        bound = ''
+        bound_args = ()
+        if filtered:
+            conditions, args = filtered
+            first, last = self.conn.execute('select min(chunk_id), max(chunk_id) from textchunks '
+                                            'where files_file_id in (select file_id from files where ' +
+                                            ' and '.join(conditions) + ')', args).fetchone()
+            if first is None:
+                return None
+            bound = ' and rowid between ? and ?'
+            bound_args = (first, last)
+        index, match, excluded = matches[0]
+        sql = 'select rowid, rank from ' + index + ' where ' + index + ' match ?' + bound
+        args = (match,) + bound_args
+        for index, match, excluded in matches[1:]:
+            found = 'select rowid from ' + index + ' where ' + index + ' match ?' + bound
+            if excluded:
+                # the chunks of the files that have the term in any of theirs
+                found = 'select chunk_id from textchunks where files_file_id in ' \
+                        '(select files_file_id from textchunks where chunk_id in (' + found + '))'
+            sql += (' and rowid not in (' if excluded else ' and rowid in (') + found + ')'
+            args += (match,) + bound_args
+        return sql, args
+
+    def search(self, keyword):
+        hits = self._hits(parse_query(keyword))
+        if hits is None:
+            return []
+        sql, args = hits
+        rows = self.conn.execute('select files_file_id, content, content_z from textfiles where files_file_id in '
+                                 '(select files_file_id from (' + sql + ') as hits '
+                                 'join textchunks on textchunks.chunk_id = hits.rowid)', args)
+        return [(file_id, unpack(content, content_z)) for file_id, content, content_z in rows]
+
+    def search_files(self, keyword, snippet_length=100, limit=None, offset=0, within=None, filters=None):
+        if within is not None and not within:
+            return []
+        query = parse_query(keyword)
+        conditions, filter_args = search_conditions(within, filters, '?')
+        hits = self._hits(query, (conditions, filter_args) if conditions else None)
+        if hits is None:
+            return []
+        sql, args = hits
+        restrict = ''
+        if conditions:
+            restrict = ' join files on files.file_id = textchunks.files_file_id where ' + ' and '.join(conditions)
+            args += filter_args
+        # the snippet starts at the first term. fts5 ignores the case of ascii letters, and lower() only changes
+        # those so the offsets stay the same, chinese is found without lowering the whole chunk
+        term = first_term(query)
+        text = 'lower(content)' if term != term.lower() or term != term.upper() else 'content'
+        term = term.lower()
+        # every file is ranked by its best chunk, fts5's rank is bm25 and smaller is better.
+        # a negative limit means no limit in sqlite
+        return self.conn.execute('select file_id, file_name, file_address, file_type, file_size, class_name, '
+                                 'chapter_name, start_offset + max(instr(' + text + ', ?), 1), page, '
+                                 'substr(content, max(instr(' + text + ', ?), 1), ?), -hits.rank from '
+                                 '(select files_file_id, chunk_id, rank from '
+                                 '(select textchunks.files_file_id, chunk_id, hits.rank, row_number() over '
+                                 '(partition by textchunks.files_file_id order by hits.rank, chunk_id) as best '
+                                 'from (' + sql + ') as hits join textchunks on textchunks.chunk_id = hits.rowid' +
+                                 restrict + ') where best = 1 order by rank, files_file_id limit ? offset ?) as hits '
+                                 'join textchunks on textchunks.chunk_id = hits.chunk_id '
+                                 'join files on files.file_id = hits.files_file_id '
+                                 'join chapters on chapters.chapter_id = files.chapters_chapter_id '
+                                 'join classes on classes.class_id = files.chapters_classes_class_id '
+                                 'order by hits.rank, file_id',
+                                 (term, term, snippet_length) + args +
+                                 (-1 if limit is None else limit, offset)).fetchall()
+
+    @unpooled
+    def interrupt(self, thread):
+        # sqlite3_interrupt may be called from any thread, the statement fails with 'interrupted'
+        self.pool.interrupt(thread, sqlite3.Connection.interrupt)
+
+    def get_file_info(self, file_id):
+        return self.conn.execute('select file_name, file_address, file_type, file_size from files '
+                                 'where file_id = ?', (file_id,)).fetchone()
@@ -0,0 +1,33 @@
+# how the whole text of a file is kept in textfiles. search only reads textchunks (see chunks.py),
+# so the stored copy is zlib compressed unless CORPORA_COMPRESS_TEXT=0
+import os
+import zlib
+
+from metrics import count_text, metrics
+
+COMPRESS_TEXT = os.environ.get('CORPORA_COMPRESS_TEXT', '1') != '0'
+LEVEL = 6
+
+
+def compress(text):
+    return zlib.compress(text.encode('utf-8'), LEVEL)
+
+
+def pack(text):
+    # (content, content_z) of a textfiles row
+    if COMPRESS_TEXT:
+        data = text.encode('utf-8')
+        metrics.count_bytes(len(data))
+        return None, zlib.compress(data, LEVEL)
+    count_text(text)
+    return text, None
+
+
+def unpack(content, content_z):
+    # rows written before compression, or with it switched off, still have their text in content
+    if content_z is not None:
+        data = zlib.decompress(content_z)
+        metrics.count_bytes(len(data))
+        return data.decode('utf-8')
+    count_text(content)
+    return content or ''
@@ -1,23 +1,76 @@
 # coding:utf-8
+import json
 import os
 import sys
+import time
+from array import array
+from collections import OrderedDict
 
-from PyQt5.QtCore import Qt, QRect, QSize
+from PyQt5.QtCore import Qt, QRect, QSize, QEvent, QAbstractListModel, QAbstractTableModel, QModelIndex, \
+    QCoreApplication, QObject, QTimer, pyqtSignal
 from PyQt5.QtGui import QIcon, QPainter, QImage, QBrush, QColor, QFont, QStandardItemModel, QStandardItem
-from PyQt5.QtWidgets import QApplication, QFrame, QStackedWidget, QHBoxLayout, QLabel, QListWidgetItem, QVBoxLayout, \
-    QWidget, QHeaderView, QFileDialog, QTableWidgetItem, \
-    QAbstractItemView, QSizePolicy
+from PyQt5.QtWidgets import QApplication, QFrame, QStackedWidget, QHBoxLayout, QLabel, QVBoxLayout, \
+    QWidget, QHeaderView, QFileDialog, \
+    QAbstractItemView, QSizePolicy, QProgressDialog, QStyledItemDelegate, QStyle
 from qfluentwidgets import FluentIcon as FIF
 from qfluentwidgets import (NavigationInterface, NavigationItemPosition, NavigationWidget, MessageBox,
                             isDarkTheme, setTheme, Theme, ListWidget, ToolButton, LineEdit, TreeView,
-                            ComboBox, InfoBar, InfoBarPosition, FlowLayout, TableWidget)
+                            ComboBox, InfoBar, InfoBarPosition, FlowLayout, TableView, ListView)
 from qframelesswindow import FramelessWindow, TitleBar
 
-from content import get_text
-from database import CorporaDatabase
-
-database = CorporaDatabase()
+from database import DeferredDatabase, SearchFilters
+from ingest import IngestWorker
+from metrics import metrics
+from query_cache import CachedDatabase
+from query_executor import QueryExecutor
+from search_syntax import narrows
+from watcher import FolderWatcher
+
+# opened by the first call, on a worker thread of the executor, never on the gui thread
+database = DeferredDatabase()
+# every database call of the widgets runs on its threads, a superseded read is interrupted on the database
+executor = QueryExecutor(interrupt=database.interrupt)
 FONT = QFont('Segoe UI, Microsoft Yahei UI', 11)
+# number of imported files written to the database per transaction
+IMPORT_BATCH_SIZE = 64
+# characters of content shown under a search hit
+SNIPPET_LENGTH = 100
+# search hits fetched per query, and how many of those pages are kept in memory
+SEARCH_PAGE_SIZE = 50
+SEARCH_CACHED_PAGES = 4
+# ms after the last key stroke before the search runs, 0 to search only on enter or the button
+SEARCH_DEBOUNCE_MS = int(os.environ.get('CORPORA_SEARCH_DEBOUNCE_MS', 300))
+# the hits of a keyword restrict the search for a keyword that narrows it if there are at most this many
+SEARCH_WITHIN_MAX = 500
+# the file types the search can be restricted to
+SEARCH_FILE_TYPES = ['pdf', 'doc', 'docx', 'ppt', 'pptx', 'txt', 'md']
+# rows of the files table fetched at a time
+FILES_PAGE_SIZE = 500
+# the metrics are written to this file when the app closes
+METRICS_DUMP = os.environ.get('CORPORA_METRICS_DUMP')
+# seconds before connecting is tried again after the database couldn't be opened
+RECONNECT_INTERVAL = 5
+# print how long the start took and quit, see bench/bench_startup.py
+STARTUP_PROFILE = os.environ.get('CORPORA_STARTUP_PROFILE', '0') != '0'
+
+
+def query_cache_stats():
+    # {method: (hits, misses)} of the query cache, the hits are calls that never reached the database
+    opened = database.opened()
+    return opened.cache.stats() if isinstance(opened, CachedDatabase) else None
+
+
+def dump_metrics(path):
+    metrics.dump(path, query_cache=query_cache_stats())
+
+
+def load_failed(widget):
+    """failed= of the reads that fill a widget, the window refreshes it once the database is connected"""
+    def failed(error):
+        print("error:", error)
+        widget.load_failed = True
+
+    return failed
 
 
 def int_to_size(size):
@@ -47,6 +100,47 @@ class CustomWidgetItem(QWidget):
         self.button.clicked.connect(func)
 
 
+class DeleteButtonDelegate(QStyledItemDelegate):
+    """ draws a transparent close button in a cell and reports clicks on it,
+    so that the rows of a big tree don't need a ToolButton widget each
+    """
+    clicked = pyqtSignal(QModelIndex)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.icon = FIF.CLOSE.icon()
+
+    @staticmethod
+    def button_rect(option):
+        # the same 20x20 spot the index widget used to take, at the left of the cell
+        rect = option.rect
+        return QRect(rect.x(), rect.y() + (rect.height() - 20) // 2, 20, 20)
+
+    def paint(self, painter, option, index):
+        super().paint(painter, option, index)
+        if index.data(Qt.UserRole) is None:
+            return
+        rect = self.button_rect(option)
+        painter.save()
+        painter.setRenderHint(QPainter.Antialiasing)
+        if option.state & QStyle.State_MouseOver:
+            c = 255 if isDarkTheme() else 0
+            painter.setPen(Qt.NoPen)
+            painter.setBrush(QColor(c, c, c, 15))
+            painter.drawRoundedRect(rect, 4, 4)
+        self.icon.paint(painter, rect.adjusted(5, 5, -5, -5))
+        painter.restore()
+
+    def editorEvent(self, event, model, option, index):
+        if index.data(Qt.UserRole) is not None \
+                and event.type() in (QEvent.MouseButtonPress, QEvent.MouseButtonRelease) \
+                and event.button() == Qt.LeftButton and self.button_rect(option).contains(event.pos()):
+            if event.type() == QEvent.MouseButtonRelease:
+                self.clicked.emit(index)
+            return True
+        return super().editorEvent(event, model, option, index)
+
+
 class Widget(QFrame):
     def __init__(self, text: str, parent=None):
         super().__init__(parent=parent)
@@ -89,13 +183,15 @@ class TagsWidget(QFrame):
     def add_tag(self):
         tag_name = self.line_edit1.text()
         if tag_name:
-            database.add_tag(tag_name)
+            executor.write(database.add_tag, tag_name, done=lambda tag_id: self.refresh())
             self.line_edit1.clear()
-            self.refresh()
 
     def refresh(self):
+        self.load_failed = False
+        executor.read((self, 'tags'), database.get_tags, done=self.show_tags, failed=load_failed(self))
+
+    def show_tags(self, tags):
         self.listWidget.clear()
-        tags = database.get_tags()
         for idx, (tag_id, tag_name) in enumerate(tags):
             widget = CustomWidgetItem(tag_name, self.listWidget)
             widget.click(self.delete_class(tag_id))
@@ -110,8 +206,7 @@ class TagsWidget(QFrame):
 
     def delete_class(self, tag_id):
         def delete():
-            database.delete_tag(tag_id)
-            self.refresh()
+            executor.write(database.delete_tag, tag_id, done=lambda result: self.refresh())
 
         return delete
 
@@ -187,27 +282,35 @@ class ClassWidget(QFrame):
         class_name = self.line_edit1.text()
         teacher_name = self.line_edit2.text()
         print("add", class_name, teacher_name)
-        try:
-            database.add_class(class_name, teacher_name)
-        except RuntimeError:
-            InfoBar.error(
-                title='ERROR',
-                content="课程名不能为空",
-                orient=Qt.Horizontal,
-                isClosable=True,
-                position=InfoBarPosition.TOP_RIGHT,
-                duration=2000,
-                parent=self
-            )
-            return
+        executor.write(database.add_class, class_name, teacher_name,
+                       done=self.class_added, failed=self.add_class_failed)
+
+    def class_added(self, result):
         self.line_edit1.clear()
         self.line_edit2.clear()
         self.refresh()
 
+    def add_class_failed(self, error):
+        if not isinstance(error, RuntimeError):
+            print("error:", error)
+            return
+        InfoBar.error(
+            title='ERROR',
+            content="课程名不能为空",
+            orient=Qt.Horizontal,
+            isClosable=True,
+            position=InfoBarPosition.TOP_RIGHT,
+            duration=2000,
+            parent=self
+        )
+
     def refresh(self):
+        self.load_failed = False
         self.update_navigation_func()
+        executor.read((self, 'classes'), database.get_classes, done=self.show_classes, failed=load_failed(self))
+
+    def show_classes(self, classes):
         self.listWidget.clear()
-        classes = database.get_classes()
         for idx, (class_id, class_name, teacher_name) in enumerate(classes):
             name = class_name + "    by: " + teacher_name
             widget = CustomWidgetItem(name, self.listWidget)
@@ -223,21 +326,27 @@ class ClassWidget(QFrame):
 
     def delete_class(self, class_id):
         def delete():
-            database.delete_class(class_id)
-            self.refresh()
+            executor.write(database.delete_class, class_id, done=lambda result: self.refresh())
 
         return delete
 
 
 class FilelistWidget(QFrame):
-    def __init__(self, parent=None):
+    def __init__(self, folder_watcher, parent=None):
         super().__init__(parent=parent)
 
+        self.folder_watcher = folder_watcher
+
         self.class_id = None
         self.filelist = {}
         self.chapter_names = {}
         self.current_file_id = None
         self.tags = []
+        self.ingest_worker = None
+        self.progress_dialog = None
+        self.import_chapter_id = None
+        self.import_class_id = None
+        self.import_batch = []
 
         # main layout
         self.vBoxLayout = QVBoxLayout(self)
@@ -270,6 +379,9 @@ class FilelistWidget(QFrame):
         self.view.doubleClicked.connect(self.doubleclick_handler)
         self.view.clicked.connect(self.click_handler)
         self.view.setAlternatingRowColors(True)
+        self.delete_delegate = DeleteButtonDelegate(self.view)
+        self.delete_delegate.clicked.connect(self.delete_row)
+        self.view.setItemDelegateForColumn(3, self.delete_delegate)
         self.vBoxLayout.addWidget(self.view)
 
         # tags ui
@@ -330,6 +442,12 @@ class FilelistWidget(QFrame):
         self.add_button.setFixedSize(36, 36)
         self.add_button.clicked.connect(self.add_file)
         self.add_file_widget.addWidget(self.add_button, alignment=Qt.AlignBottom | Qt.AlignRight)
+        # keep the chapter in sync with a folder
+        self.bind_button = ToolButton(FIF.FOLDER_ADD, self)
+        self.bind_button.setFixedSize(36, 36)
+        self.bind_button.setToolTip("绑定文件夹")
+        self.bind_button.clicked.connect(self.bind_folder)
+        self.add_file_widget.addWidget(self.bind_button, alignment=Qt.AlignBottom | Qt.AlignRight)
         self.vBoxLayout.addLayout(self.add_file_widget)
 
         # initialize
@@ -338,74 +456,102 @@ class FilelistWidget(QFrame):
 
     def refresh(self):
         print('refresh')
+        self.load_failed = False
         if self.class_id:
-            self.filelist, self.chapter_names = database.get_files(self.class_id)
-            font = FONT
-            font.setPointSize(12)
-            print(self.filelist)
-            # filelist = {1: (('file1', 'type1', 'size1'), ('file2', 'type2', 'size2')),
-            #             2: (('file3', 'type3', 'size3'))}
-            self.rootNode.removeRows(0, self.rootNode.rowCount())
-            for chapter, files in self.filelist.items():
-                section_node = QStandardItem(self.chapter_names[chapter][0])
-                section_node.setIcon(FIF.FOLDER.icon())
-                section_node.setEditable(False)
-                section_node2 = QStandardItem('')
-                section_node2.setEditable(False)
-                section_node3 = QStandardItem(int_to_size(self.chapter_names[chapter][1]
-                                                          if self.chapter_names[chapter][1] else 0))
-                section_node3.setEditable(False)
-                section_node4 = QStandardItem('')
-                section_node4.setEditable(False)
-                del_button = ToolButton(FIF.CLOSE, self)
-                # make button transparent
-                del_button.setStyleSheet("background-color: transparent;")
-                del_button.setFixedSize(20, 20)
-                del_button.clicked.connect(self.delete_chapter(chapter))
-                # set text size
-                section_node.setFont(font)
-                section_node2.setFont(font)
-                section_node3.setFont(font)
-                self.rootNode.appendRow([section_node, section_node2, section_node3, section_node4])
-                self.view.setIndexWidget(section_node4.index(), del_button)
-                for file in files:
-                    file_node = QStandardItem(file[1])
-                    file_node.setIcon(FIF.DOCUMENT.icon())
-                    file_node.setEditable(False)
-                    type_node = QStandardItem(file[3])
-                    type_node.setEditable(False)
-                    size_node = QStandardItem(int_to_size(file[4] if file[4] else 0))
-                    size_node.setEditable(False)
-                    del_node = QStandardItem('')
-                    del_node.setEditable(False)
-                    # set text size
-                    file_node.setFont(font)
-                    type_node.setFont(font)
-                    size_node.setFont(font)
-                    del_button = ToolButton(FIF.CLOSE, self)
-                    # make button transparent
-                    del_button.setStyleSheet("background-color: transparent;")
-                    del_button.setFixedSize(20, 20)
-                    del_button.clicked.connect(self.delete_file(file[0]))
-                    section_node.appendRow([file_node, type_node, size_node, del_node])
-                    self.view.setIndexWidget(del_node.index(), del_button)
+            class_id = self.class_id
+            executor.read((self, 'files'), database.get_files, class_id,
+                          done=lambda result: self.show_files(class_id, result), failed=load_failed(self))
+        executor.read((self, 'tags'), database.get_tags, done=self.show_tag_choices, failed=load_failed(self))
 
+    def show_files(self, class_id, result):
+        if class_id != self.class_id:
+            return
+        self.filelist, self.chapter_names = result
+        # filelist = {1: (('file1', 'type1', 'size1'), ('file2', 'type2', 'size2')),
+        #             2: (('file3', 'type3', 'size3'))}
+        self.rootNode.removeRows(0, self.rootNode.rowCount())
+        for chapter, files in self.filelist.items():
+            section_node = self.append_chapter_row(chapter)
+            for file in files:
+                self.append_file_row(section_node, file)
         self.view.expandAll()
         self.combo_box.clear()
         self.combo_box.addItems([x[0] for x in self.chapter_names.values()])
+
+    def show_tag_choices(self, tags):
         self.tag_combo_box.clear()
-        self.tags = list(database.get_tags())
+        self.tags = list(tags)
         print("tags:", self.tags)
         self.tag_combo_box.addItems([x[1] for x in self.tags])
 
+    # the rows of the tree are kept in the same order as self.chapter_names and the lists in self.filelist,
+    # mutations patch both instead of reloading the whole class
+    def append_chapter_row(self, chapter):
+        font = FONT
+        font.setPointSize(12)
+        section_node = QStandardItem(self.chapter_names[chapter][0])
+        section_node.setIcon(FIF.FOLDER.icon())
+        section_node.setEditable(False)
+        section_node2 = QStandardItem('')
+        section_node2.setEditable(False)
+        section_node3 = QStandardItem(int_to_size(self.chapter_names[chapter][1]
+                                                  if self.chapter_names[chapter][1] else 0))
+        section_node3.setEditable(False)
+        section_node4 = QStandardItem('')
+        section_node4.setEditable(False)
+        # the delete button is drawn by DeleteButtonDelegate
+        section_node4.setData(('chapter', chapter), Qt.UserRole)
+        # set text size
+        section_node.setFont(font)
+        section_node2.setFont(font)
+        section_node3.setFont(font)
+        self.rootNode.appendRow([section_node, section_node2, section_node3, section_node4])
+        return section_node
+
+    def append_file_row(self, section_node, file):
+        font = FONT
+        font.setPointSize(12)
+        file_node = QStandardItem(file[1])
+        file_node.setIcon(FIF.DOCUMENT.icon())
+        file_node.setEditable(False)
+        type_node = QStandardItem(file[3])
+        type_node.setEditable(False)
+        size_node = QStandardItem(int_to_size(file[4] if file[4] else 0))
+        size_node.setEditable(False)
+        del_node = QStandardItem('')
+        del_node.setEditable(False)
+        del_node.setData(('file', file[0]), Qt.UserRole)
+        # set text size
+        file_node.setFont(font)
+        type_node.setFont(font)
+        size_node.setFont(font)
+        section_node.appendRow([file_node, type_node, size_node, del_node])
+
+    def chapter_row(self, chapter_id):
+        return list(self.chapter_names.keys()).index(chapter_id)
+
+    def set_chapter_size(self, chapter_id, total_size):
+        self.chapter_names[chapter_id] = (self.chapter_names[chapter_id][0], total_size)
+        self.rootNode.child(self.chapter_row(chapter_id), 2).setText(int_to_size(total_size if total_size else 0))
+
     def change_class(self, class_id):
         self.class_id = class_id
         self.refresh()
 
     def add_chapter(self):
         if self.class_id and self.line_edit.text():
-            database.add_chapter(self.class_id, self.line_edit.text())
-            self.refresh()
+            chapter_name = self.line_edit.text()
+            class_id = self.class_id
+            executor.write(database.add_chapter, class_id, chapter_name,
+                           done=lambda chapter_id: self.chapter_added(class_id, chapter_id, chapter_name))
+
+    def chapter_added(self, class_id, chapter_id, chapter_name):
+        if class_id != self.class_id:
+            return
+        self.chapter_names[chapter_id] = (chapter_name, 0)
+        self.filelist[chapter_id] = []
+        self.append_chapter_row(chapter_id)
+        self.combo_box.addItem(chapter_name)
 
     def add_file(self):
         if self.class_id:
@@ -422,34 +568,169 @@ class FilelistWidget(QFrame):
                 return
             chapter_id = list(self.chapter_names.keys())[self.combo_box.currentIndex()]
             files = QFileDialog.getOpenFileNames(self, "选择文件", "D://Document")[0]
-            print(files)
-            for file in files:
-                if file:
-                    file_name = file.split('/')[-1]
-                    file_type = file.split('.')[-1]
-                    file_size = str(os.path.getsize(file))
-                    file_id = database.add_file(file_name, file, file_type, file_size, chapter_id, self.class_id)
-                    try:
-                        content = get_text(file, file_type)
-                        database.add_textfile(file_id, content)
-                    except Exception as e:
-                        print("error:", e)
-                        pass
+            files = [file for file in files if file]
+            if not files:
+                return
+            self.import_chapter_id = chapter_id
+            self.import_class_id = self.class_id
+            self.import_batch = []
+            # extract text in the background, the database is written from the gui thread
+            self.ingest_worker = IngestWorker(files, parent=self)
+            self.progress_dialog = QProgressDialog("正在导入文件...", "取消", 0, len(files), self)
+            self.progress_dialog.setWindowModality(Qt.WindowModal)
+            self.progress_dialog.setMinimumDuration(0)
+            self.progress_dialog.canceled.connect(self.ingest_worker.cancel)
+            self.ingest_worker.progress.connect(self.import_progress)
+            self.ingest_worker.extracted.connect(self.import_file)
+            self.ingest_worker.done.connect(self.import_done)
+            self.add_button.setEnabled(False)
+            self.ingest_worker.start()
+
+    def bind_folder(self):
+        if self.class_id:
+            if self.combo_box.currentIndex() == -1:
+                InfoBar.error(
+                    title='ERROR',
+                    content="请选择一个章节或新建一个章节",
+                    orient=Qt.Horizontal,
+                    isClosable=True,
+                    position=InfoBarPosition.TOP_RIGHT,
+                    duration=2000,
+                    parent=self
+                )
+                return
+            chapter_id = list(self.chapter_names.keys())[self.combo_box.currentIndex()]
+            folder = QFileDialog.getExistingDirectory(self, "选择文件夹", "D://Document")
+            if not folder:
+                return
+            # the watcher imports the folder in the background and keeps it up to date
+            self.folder_watcher.bind(chapter_id, self.class_id, folder)
+            InfoBar.success(
+                title='SUCCESS',
+                content=f"已绑定 {folder}，其中的文件会自动导入并保持同步",
+                orient=Qt.Horizontal,
+                isClosable=True,
+                position=InfoBarPosition.TOP_RIGHT,
+                duration=3000,
+                parent=self
+            )
+
+    def folder_synced(self, chapter_id, class_id):
+        if class_id == self.class_id and self.ingest_worker is None:
             self.refresh()
 
+    def import_progress(self, done, total, file):
+        self.progress_dialog.setLabelText(f"正在导入 {file.split('/')[-1]} ({done}/{total})")
+        self.progress_dialog.setValue(done)
+
+    def import_file(self, file, file_name, file_type, file_size, text):
+        self.import_batch.append((file_name, file, file_type, file_size, self.import_chapter_id,
+                                  self.import_class_id, text))
+        if len(self.import_batch) >= IMPORT_BATCH_SIZE:
+            self.flush_import()
+
+    def flush_import(self):
+        if not self.import_batch:
+            return
+        batch, chapter_id, class_id = self.import_batch, self.import_chapter_id, self.import_class_id
+
+        def write():
+            return database.add_files(batch), database.get_chapter_size(chapter_id)
+
+        executor.write(write, done=lambda result: self.files_imported(class_id, chapter_id, batch, *result))
+        self.import_batch = []
+
+    def files_imported(self, class_id, chapter_id, batch, file_ids, total_size):
+        # only patch the tree if the chapter is still on screen
+        if class_id != self.class_id or chapter_id not in self.chapter_names:
+            return
+        section_node = self.rootNode.child(self.chapter_row(chapter_id))
+        for file_id, (file_name, file_address, file_type, file_size, *_) in zip(file_ids, batch):
+            file = (file_id, file_name, file_address, file_type, int(file_size))
+            self.filelist[chapter_id].append(file)
+            self.append_file_row(section_node, file)
+        self.view.expand(section_node.index())
+        self.set_chapter_size(chapter_id, total_size)
+
+    def stop_import(self):
+        # the window is closing: the import is cancelled, the files extracted so far are still written
+        if self.ingest_worker is None:
+            return
+        self.ingest_worker.cancel()
+        self.ingest_worker.wait()
+        # the files and the done signal the worker sent before it stopped
+        QCoreApplication.sendPostedEvents()
+        self.flush_import()
+
+    def import_done(self, failed, cancelled):
+        self.flush_import()
+        self.progress_dialog.close()
+        self.add_button.setEnabled(True)
+        self.ingest_worker = None
+        if failed:
+            names = [file.split('/')[-1] for file, error in failed]
+            content = "以下文件无法提取文本: " + ", ".join(names[:5])
+            if len(names) > 5:
+                content += f" 等{len(names)}个文件"
+            InfoBar.warning(
+                title='WARNING',
+                content=content,
+                orient=Qt.Horizontal,
+                isClosable=True,
+                position=InfoBarPosition.TOP_RIGHT,
+                duration=5000,
+                parent=self
+            )
+            for file, error in failed:
+                print("error:", file, error)
+        elif cancelled:
+            InfoBar.info(
+                title='INFO',
+                content="导入已取消",
+                orient=Qt.Horizontal,
+                isClosable=True,
+                position=InfoBarPosition.TOP_RIGHT,
+                duration=2000,
+                parent=self
+            )
+
+    def delete_row(self, index):
+        kind, row_id = index.data(Qt.UserRole)
+        if kind == 'chapter':
+            self.delete_chapter(row_id)
+        else:
+            self.delete_file(row_id)
+
     def delete_chapter(self, chapter_id):
-        def delete():
-            database.delete_chapter(chapter_id)
-            self.refresh()
+        self.folder_watcher.unbind(chapter_id)
+        executor.write(database.delete_chapter, chapter_id, done=lambda result: self.chapter_deleted(chapter_id))
 
-        return delete
+    def chapter_deleted(self, chapter_id):
+        if chapter_id not in self.chapter_names:
+            return
+        row = self.chapter_row(chapter_id)
+        if self.current_file_id in [file[0] for file in self.filelist[chapter_id]]:
+            self.current_file_id = None
+            self.refresh_tags()
+        self.rootNode.removeRow(row)
+        self.combo_box.removeItem(row)
+        del self.chapter_names[chapter_id]
+        del self.filelist[chapter_id]
 
     def delete_file(self, file_id):
-        def delete():
-            database.delete_file(file_id)
-            self.refresh()
+        executor.write(database.delete_file, file_id, done=lambda result: self.file_deleted(file_id, *result))
 
-        return delete
+    def file_deleted(self, file_id, chapter_id, total_size):
+        files = self.filelist.get(chapter_id, [])
+        if file_id not in [file[0] for file in files]:
+            return
+        row = [file[0] for file in files].index(file_id)
+        self.rootNode.child(self.chapter_row(chapter_id)).removeRow(row)
+        del files[row]
+        self.set_chapter_size(chapter_id, total_size)
+        if self.current_file_id == file_id:
+            self.current_file_id = None
+            self.refresh_tags()
 
     def doubleclick_handler(self, index):
         # if item is a file, open it
@@ -485,15 +766,23 @@ class FilelistWidget(QFrame):
 
     def refresh_tags(self):
         print("refresh tags")
-        self.tags_area.takeAllWidgets()
         if not self.current_file_id:
+            executor.cancel((self, 'filetags'))
+            self.tags_area.takeAllWidgets()
             return
         print("current file id:", self.current_file_id)
-        tag_names = database.get_filetags(self.current_file_id)
+        file_id = self.current_file_id
+        executor.read((self, 'filetags'), database.get_filetags, file_id,
+                      done=lambda tag_names: self.show_filetags(file_id, tag_names))
+
+    def show_filetags(self, file_id, tag_names):
+        if file_id != self.current_file_id:
+            return
+        self.tags_area.takeAllWidgets()
         for tag_id, tag_name in tag_names:
             tag = TagWidget(tag_name, self)
             tag.setFont(FONT)
-            tag.button.clicked.connect(self.delete_tag(self.current_file_id, tag_id))
+            tag.button.clicked.connect(self.delete_tag(file_id, tag_id))
             self.tags_area.addWidget(tag)
         self.tags_area.update()
 
@@ -501,28 +790,112 @@ class FilelistWidget(QFrame):
         if not self.current_file_id:
             return
         tag_id = list(self.tags)[self.tag_combo_box.currentIndex()][0]
-        database.add_filetag(self.current_file_id, tag_id)
+        executor.write(database.add_filetag, self.current_file_id, tag_id, done=lambda result: self.refresh_tags())
         print("add tag", tag_id)
-        self.refresh_tags()
 
     def delete_tag(self, file_id, tag_id):
         def delete():
-            database.delete_filetag(file_id, tag_id)
-            self.refresh_tags()
+            executor.write(database.delete_filetag, file_id, tag_id, done=lambda result: self.refresh_tags())
 
         return delete
 
 
+class FilesTableModel(QAbstractTableModel):
+    """ every file with its class and chapter, fetched page by page as the view scrolls.
+    rows are kept column by column, class and chapter names are shared between rows,
+    and cells are only turned into display data when the view asks for them.
+    a page is fetched in the background and its rows are inserted when it arrives
+    """
+    headers = ['File', 'Class', 'Chapter']
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.file_ids = array('q')
+        self.file_names = []
+        self.class_names = []
+        self.chapter_names = []
+        self.names = {}
+        self.exhausted = False
+        self.loading = False
+        self.icon = FIF.DOCUMENT.icon()
+
+    def reload(self):
+        executor.cancel((self, 'page'))
+        self.beginResetModel()
+        self.file_ids = array('q')
+        self.file_names = []
+        self.class_names = []
+        self.chapter_names = []
+        self.names = {}
+        self.exhausted = False
+        self.loading = False
+        self.endResetModel()
+        self.fetchMore(QModelIndex())
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.file_ids)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
+
+    def canFetchMore(self, parent):
+        return not parent.isValid() and not self.exhausted and not self.loading
+
+    def fetchMore(self, parent):
+        if parent.isValid() or self.loading:
+            return
+        self.loading = True
+        after = self.file_ids[-1] if self.file_ids else 0
+        executor.read((self, 'page'), database.get_all_files_page, after, FILES_PAGE_SIZE,
+                      done=self.append_page, failed=self.page_failed)
+
+    def page_failed(self, error):
+        print("error:", error)
+        self.loading = False
+
+    def append_page(self, rows):
+        self.loading = False
+        if len(rows) < FILES_PAGE_SIZE:
+            self.exhausted = True
+        if not rows:
+            return
+        start = len(self.file_ids)
+        self.beginInsertRows(QModelIndex(), start, start + len(rows) - 1)
+        for file_id, class_name, chapter_name, file_name in rows:
+            self.file_ids.append(file_id)
+            self.file_names.append(file_name)
+            self.class_names.append(self.names.setdefault(class_name, class_name))
+            self.chapter_names.append(self.names.setdefault(chapter_name, chapter_name))
+        self.endInsertRows()
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row, column = index.row(), index.column()
+        if role == Qt.DisplayRole:
+            return (self.file_names, self.class_names, self.chapter_names)[column][row]
+        elif role == Qt.DecorationRole and column == 0:
+            return self.icon
+        elif role == Qt.FontRole:
+            return FONT
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.headers[section]
+        return None
+
+
 class FilesWidget(QFrame):
     def __init__(self, text, parent=None):
         super().__init__(parent=parent)
-        self.files = []
         self.setObjectName(text.replace(' ', '-'))
         self.vBoxLayout = QVBoxLayout(self)
-        self.tableView = TableWidget(self)
+        self.model = FilesTableModel(self)
+        self.tableView = TableView(self)
+        self.tableView.setModel(self.model)
         self.tableView.setWordWrap(False)
-        self.tableView.setRowHeight(0, 36)
-        self.tableView.setColumnCount(3)
+        self.tableView.verticalHeader().setDefaultSectionSize(36)
         # make it resizable, but default size is fixed
         self.tableView.horizontalHeader().setSectionResizeMode(0, QHeaderView.Interactive)
         self.tableView.horizontalHeader().setSectionResizeMode(1, QHeaderView.Interactive)
@@ -547,30 +920,169 @@ class FilesWidget(QFrame):
         self.refresh()
 
     def refresh(self):
-        self.tableView.clear()
-        self.tableView.setHorizontalHeaderLabels(['File', 'Class', 'Chapter'])
-        # self.tableView.horizontalHeader().setFont(FONT)
-        self.files = database.get_all_files()
-        print(self.files)
-        self.tableView.setRowCount(len(self.files) + 1)
-        for idx, (class_name, chapter_name, file_name) in enumerate(self.files):
-            file_item = QTableWidgetItem(file_name)
-            file_item.setIcon(FIF.DOCUMENT.icon())
-            file_item.setFont(FONT)
-            class_item = QTableWidgetItem(class_name)
-            class_item.setFont(FONT)
-            chapter_item = QTableWidgetItem(chapter_name)
-            chapter_item.setFont(FONT)
-            self.tableView.setItem(idx, 0, file_item)
-            self.tableView.setItem(idx, 1, class_item)
-            self.tableView.setItem(idx, 2, chapter_item)
-        self.tableView.update()
+        self.model.reload()
+
+
+class SearchResultModel(QAbstractListModel):
+    """ search hits fetched page by page as the view scrolls, every hit is shown as two rows:
+    the file name and the snippet under it. only the last few pages are kept in memory,
+    a page that has been dropped is fetched again when it is scrolled back into view.
+    pages are fetched in the background, the rows of a page are empty until it arrives.
+    when the user types on, the search for the longer keyword only looks at the files the shorter one found
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.keyword = ''
+        self.hit_count = 0
+        self.exhausted = True
+        self.pages = OrderedDict()
+        # pages being fetched
+        self.loading = set()
+        # the file ids of the hits so far, and the hits of an earlier keyword the search is restricted to
+        self.found = set()
+        self.within = None
+        self.filters = None
+        self.icon = FIF.DOCUMENT.icon()
+        self.snippet_font = QFont()
+        self.snippet_font.setFamily("Segoe UI, Microsoft YaHei UI")
+        self.snippet_font.setStyle(QFont.StyleItalic)
+        self.snippet_font.setPointSize(11)
+
+    def set_keyword(self, keyword, filters=None, refine=False):
+        """filters: a SearchFilters or None
+        refine: the search may be restricted to the hits of the last keyword if keyword narrows it (see narrows),
+        when all of them have been fetched. those are as old as the last search, enter searches everything again
+        """
+        # the pages still being fetched for the last keyword are of no use any more
+        for page in self.loading:
+            executor.cancel((self, page))
+        within = None
+        if refine and self.keyword and self.exhausted and len(self.found) <= SEARCH_WITHIN_MAX and \
+                filters == self.filters and narrows(self.keyword, keyword):
+            within = frozenset(self.found)
+        self.beginResetModel()
+        self.keyword = keyword
+        self.within = within
+        self.filters = filters
+        self.hit_count = 0
+        # nothing can match if the last keyword found nothing
+        self.exhausted = not keyword or within == frozenset()
+        self.pages.clear()
+        self.loading.clear()
+        self.found.clear()
+        self.endResetModel()
+        if self.canFetchMore(QModelIndex()):
+            self.fetchMore(QModelIndex())
+
+    def load_page(self, page):
+        """the hits of page if they are in memory, otherwise the page is fetched and None is returned"""
+        if page in self.pages:
+            self.pages.move_to_end(page)
+            return self.pages[page]
+        if page not in self.loading:
+            self.loading.add(page)
+            keyword = self.keyword
+            executor.read((self, page), database.search_files, keyword, SNIPPET_LENGTH, SEARCH_PAGE_SIZE,
+                          page * SEARCH_PAGE_SIZE, self.within, self.filters,
+                          done=lambda hits: self.page_loaded(keyword, page, hits),
+                          failed=lambda error: self.page_failed(keyword, page, error))
+        return None
+
+    def page_loaded(self, keyword, page, hits):
+        if keyword != self.keyword:
+            return
+        self.loading.discard(page)
+        self.pages[page] = hits
+        while len(self.pages) > SEARCH_CACHED_PAGES:
+            self.pages.popitem(last=False)
+        first = page * SEARCH_PAGE_SIZE
+        if first == self.hit_count and not self.exhausted:
+            # the next page, asked for by fetchMore
+            if len(hits) < SEARCH_PAGE_SIZE:
+                self.exhausted = True
+            self.found.update(hit[0] for hit in hits)
+            if hits:
+                self.beginInsertRows(QModelIndex(), self.hit_count * 2, (self.hit_count + len(hits)) * 2 - 1)
+                self.hit_count += len(hits)
+                self.endInsertRows()
+        elif first < self.hit_count:
+            # a page that was dropped and scrolled back into view
+            last = min(first + SEARCH_PAGE_SIZE, self.hit_count) * 2 - 1
+            self.dataChanged.emit(self.index(first * 2), self.index(last))
+
+    def page_failed(self, keyword, page, error):
+        print("error:", error)
+        if keyword == self.keyword:
+            self.loading.discard(page)
+
+    def hit(self, row):
+        hit = row // 2
+        hits = self.load_page(hit // SEARCH_PAGE_SIZE)
+        # a page fetched again may have shrunk if files were deleted in the meantime
+        if hits is None or hit % SEARCH_PAGE_SIZE >= len(hits):
+            return None
+        return hits[hit % SEARCH_PAGE_SIZE]
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.hit_count * 2
+
+    def canFetchMore(self, parent):
+        return not parent.isValid() and not self.exhausted and self.hit_count // SEARCH_PAGE_SIZE not in self.loading
+
+    def fetchMore(self, parent):
+        if parent.isValid():
+            return
+        page = self.hit_count // SEARCH_PAGE_SIZE
+        hits = self.load_page(page)
+        if hits is not None:
+            # still in memory from an earlier fetch
+            self.page_loaded(self.keyword, page, hits)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= self.hit_count * 2:
+            return None
+        if role == Qt.SizeHintRole:
+            return QSize(0, 36)
+        hit = self.hit(index.row())
+        if hit is None:
+            return None
+        is_snippet = index.row() % 2 == 1
+        file_id, file_name, file_address, file_type, file_size, class_name, chapter_name, position, page, snippet, \
+            score = hit
+        if role == Qt.DisplayRole:
+            if is_snippet:
+                return self.format_search_result(snippet, position)
+            # the page the best match is on
+            return f'{file_name} (p. {page})' if page else file_name
+        elif role == Qt.ToolTipRole:
+            if is_snippet:
+                return file_address
+            return f'{class_name} / {chapter_name}\n{file_address}\n相关度 {score:.3g}'
+        elif role == Qt.DecorationRole and not is_snippet:
+            return self.icon
+        elif role == Qt.FontRole:
+            return self.snippet_font if is_snippet else FONT
+        elif role == Qt.TextAlignmentRole and is_snippet:
+            return Qt.AlignRight | Qt.AlignVCenter
+        return None
+
+    @staticmethod
+    def format_search_result(snippet, position):
+        """the snippet is cut out by the database starting at the keyword
+        add ... before and after the snippet if the content goes on
+        """
+        snippet = (snippet or '').replace('\n', ' ')
+        if len(snippet) >= SNIPPET_LENGTH:
+            snippet = snippet + '...'
+        if position > 1:
+            snippet = '...' + snippet
+        return snippet
 
 
 class SearchWidget(QFrame):
     def __init__(self, text: str, parent=None):
         super().__init__(parent=parent)
-        self.result_list = []
         self.setObjectName(text.replace(' ', '-'))
         self.vBoxLayout = QVBoxLayout(self)
         self.vBoxLayout.setContentsMargins(24, 42, 24, 24)
@@ -582,6 +1094,13 @@ class SearchWidget(QFrame):
         self.search_bar.setFixedHeight(36)
         self.search_bar.setClearButtonEnabled(True)
         self.search_bar.returnPressed.connect(self.search)
+        # searches as the user types, once they stop for SEARCH_DEBOUNCE_MS
+        self.debounce = QTimer(self)
+        self.debounce.setSingleShot(True)
+        self.debounce.setInterval(SEARCH_DEBOUNCE_MS)
+        self.debounce.timeout.connect(self.search_typed)
+        if SEARCH_DEBOUNCE_MS:
+            self.search_bar.textChanged.connect(lambda text: self.debounce.start())
         self.hBoxLayout.addWidget(self.search_bar, alignment=Qt.AlignTop)
         # add a search button
         self.search_button = ToolButton(FIF.SEARCH, self)
@@ -592,66 +1111,103 @@ class SearchWidget(QFrame):
 
         self.vBoxLayout.addLayout(self.hBoxLayout)
 
-        self.listWidget = ListWidget(self)
-        self.listWidget.setAlternatingRowColors(True)
-        self.listWidget.doubleClicked.connect(self.doubleclick_handler)
-        self.vBoxLayout.addWidget(self.listWidget)
-
-    def search(self):
-        text = self.search_bar.text()
-        result = database.search(text)
-        self.listWidget.clear()
-        self.result_list = []
-        for file_id, content in result:
-            item = QListWidgetItem()
-            file_name, file_address, file_type, file_size = database.get_file_info(file_id)
-            item.setIcon(FIF.DOCUMENT.icon())
-            item.setText(file_name)
-            item.setToolTip(file_address)
-            item.setSizeHint(QSize(0, 36))
-            item.setFont(FONT)
-            item1 = QListWidgetItem()
-            item1.setText(self.format_search_result(content, text))
-            item1.setToolTip(file_address)
-            item1.setSizeHint(QSize(0, 36))
-            font = QFont()
-            font.setFamily("Segoe UI, Microsoft YaHei UI")
-            font.setStyle(QFont.StyleItalic)
-            font.setPointSize(11)
-            item1.setFont(font)
-            item1.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
-            # print(self.format_search_result(content, text))
-            self.listWidget.addItem(item)
-            self.listWidget.addItem(item1)
-            self.result_list.append((file_id, file_name, file_address, file_type, file_size))
-
-    def format_search_result(self, content, keyword):
-        """get the content near the keyword
-        add ... before and after the content
-        match the keyword with red color
+        # restrict the search to a class, a chapter of it, a tag or a file type
+        self.filterLayout = QHBoxLayout()
+        self.filterLayout.setContentsMargins(0, 8, 0, 0)
+        self.class_filter = self.add_filter("所有课程")
+        self.chapter_filter = self.add_filter("所有章节")
+        self.tag_filter = self.add_filter("所有标签")
+        self.type_filter = self.add_filter("所有类型")
+        self.set_choices(self.type_filter, "所有类型", [(file_type, file_type) for file_type in SEARCH_FILE_TYPES])
+        self.chapter_filter.setEnabled(False)
+        self.vBoxLayout.addLayout(self.filterLayout)
+
+        self.model = SearchResultModel(self)
+        self.listView = ListView(self)
+        self.listView.setModel(self.model)
+        self.listView.setUniformItemSizes(True)
+        self.listView.setAlternatingRowColors(True)
+        self.listView.doubleClicked.connect(self.doubleclick_handler)
+        self.vBoxLayout.addWidget(self.listView)
+
+    def add_filter(self, everything):
+        combo_box = ComboBox(self)
+        combo_box.setFixedHeight(32)
+        combo_box.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed)
+        self.set_choices(combo_box, everything, [])
+        combo_box.currentIndexChanged.connect(lambda index: self.filter_changed(combo_box))
+        self.filterLayout.addWidget(combo_box)
+        return combo_box
+
+    @staticmethod
+    def set_choices(combo_box, everything, choices):
+        """choices: [(id, name)] after the choice of everything, which is None.
+        what was chosen stays chosen if it is still there, return False if it isn't
         """
-        content = content.replace('\n', ' ')
-        index = content.find(keyword)
-        if index == -1:
-            return content
-        else:
-            if index < 0:
-                start = 0
-            else:
-                start = index - 0
-            if index + 100 > len(content):
-                end = len(content)
+        chosen = combo_box.currentData()
+        combo_box.clear()
+        combo_box.addItem(everything, userData=None)
+        for value, name in choices:
+            combo_box.addItem(name, userData=value)
+        index = next((index for index in range(combo_box.count()) if combo_box.itemData(index) == chosen), 0)
+        combo_box.setCurrentIndex(index)
+        return chosen is None or index != 0
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        # classes and tags may have been added or deleted on the other pages
+        executor.read((self, 'classes'), database.get_classes, done=self.show_class_choices)
+        executor.read((self, 'tags'), database.get_tags, done=self.show_tag_choices)
+
+    def show_class_choices(self, classes):
+        choices = [(class_id, class_name) for class_id, class_name, teacher_name in classes]
+        if not self.set_choices(self.class_filter, "所有课程", choices):
+            self.filter_changed(self.class_filter)
+
+    def show_tag_choices(self, tags):
+        if not self.set_choices(self.tag_filter, "所有标签", tags):
+            self.search()
+
+    def show_chapter_choices(self, class_id, chapters):
+        if class_id != self.class_filter.currentData():
+            return
+        choices = [(chapter_id, chapter_name) for chapter_id, (chapter_name, total_size) in chapters.items()]
+        if not self.set_choices(self.chapter_filter, "所有章节", choices):
+            self.search()
+
+    def filter_changed(self, combo_box):
+        if combo_box is self.class_filter:
+            # the chapters of another class
+            class_id = self.class_filter.currentData()
+            self.set_choices(self.chapter_filter, "所有章节", [])
+            self.chapter_filter.setEnabled(class_id is not None)
+            if class_id is not None:
+                executor.read((self, 'chapters'), database.get_files, class_id,
+                              done=lambda result: self.show_chapter_choices(class_id, result[1]))
             else:
-                end = index + 100
-            content = content[start:end]
-            if start != 0:
-                content = '...' + content
-            if end != len(content):
-                content = content + '...'
-            return content
+                executor.cancel((self, 'chapters'))
+        self.search()
+
+    def filters(self):
+        filters = SearchFilters(self.class_filter.currentData(), self.chapter_filter.currentData(),
+                                self.tag_filter.currentData(), self.type_filter.currentData())
+        return filters if filters != SearchFilters() else None
+
+    def search(self):
+        self.debounce.stop()
+        self.model.set_keyword(self.search_bar.text(), self.filters())
+
+    def search_typed(self):
+        keyword = self.search_bar.text()
+        # e.g. a character typed and deleted again
+        if keyword != self.model.keyword:
+            self.model.set_keyword(keyword, self.filters(), refine=True)
 
     def doubleclick_handler(self, index):
-        file_id, file_name, file_path, file_type, file_size = self.result_list[index.row() // 2]
+        hit = self.model.hit(index.row())
+        if hit is None:
+            return
+        file_id, file_name, file_path, file_type, file_size = hit[:5]
         if file_type in ['txt', 'py', 'c', 'cpp', 'java', 'html', 'css', 'js', 'php', 'sql', 'xml', 'json']:
             # open file using default editor
             print("open", file_path)
@@ -670,6 +1226,96 @@ class SearchWidget(QFrame):
             )
 
 
+class DiagnosticsWidget(QFrame):
+    """ what the calls to the database and the extractors cost so far, the most expensive first,
+    and the slow statements if CORPORA_SLOW_QUERY_MS is set. updated every second while it is shown
+    """
+    headers = ['Call', 'Calls', 'Errors', 'Total (ms)', 'Mean (ms)', 'p50 (ms)', 'p90 (ms)', 'p99 (ms)', 'Max (ms)',
+               'Rows', 'Text (KiB)', 'Cache hits', 'Cache misses']
+    columns = ['calls', 'errors', 'total_ms', 'mean_ms', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms', 'rows']
+
+    def __init__(self, text: str, parent=None):
+        super().__init__(parent=parent)
+        self.setObjectName(text.replace(' ', '-'))
+        self.vBoxLayout = QVBoxLayout(self)
+        self.vBoxLayout.setContentsMargins(24, 42, 24, 24)
+
+        self.model = QStandardItemModel(self)
+        self.model.setHorizontalHeaderLabels(self.headers)
+        self.tableView = TableView(self)
+        self.tableView.setModel(self.model)
+        self.tableView.setWordWrap(False)
+        self.tableView.verticalHeader().setVisible(False)
+        self.tableView.verticalHeader().setDefaultSectionSize(32)
+        self.tableView.horizontalHeader().setStyleSheet("background-color: transparent;")
+        self.tableView.horizontalHeader().setFixedHeight(32)
+        self.tableView.setColumnWidth(0, 220)
+        self.tableView.setShowGrid(False)
+        self.tableView.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.vBoxLayout.addWidget(self.tableView, 3)
+
+        self.slow_list = ListWidget(self)
+        self.slow_list.setFont(FONT)
+        self.vBoxLayout.addWidget(self.slow_list, 1)
+
+        self.button_layout = QHBoxLayout()
+        self.button_layout.addStretch(1)
+        self.reset_button = ToolButton(FIF.DELETE, self)
+        self.reset_button.setFixedSize(36, 36)
+        self.reset_button.setToolTip("清零")
+        self.reset_button.clicked.connect(self.reset)
+        self.button_layout.addWidget(self.reset_button)
+        self.save_button = ToolButton(FIF.SAVE, self)
+        self.save_button.setFixedSize(36, 36)
+        self.save_button.setToolTip("保存为JSON")
+        self.save_button.clicked.connect(self.save)
+        self.button_layout.addWidget(self.save_button)
+        self.vBoxLayout.addLayout(self.button_layout)
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(1000)
+        self.timer.timeout.connect(self.refresh)
+
+    def showEvent(self, e):
+        self.refresh()
+        self.timer.start()
+        super().showEvent(e)
+
+    def hideEvent(self, e):
+        self.timer.stop()
+        super().hideEvent(e)
+
+    def refresh(self):
+        snapshot = metrics.snapshot()
+        cache = query_cache_stats() or {}
+        self.model.removeRows(0, self.model.rowCount())
+        for name, stat in sorted(snapshot['calls'].items(), key=lambda item: -item[1]['total_ms']):
+            row = [QStandardItem(name)] + [QStandardItem(f'{stat[column]:g}') for column in self.columns]
+            row.append(QStandardItem(f'{stat["text_bytes"] / 1024:.1f}'))
+            # the calls of the database are named backend.method, the query cache counts them by method
+            hits, misses = cache.get(name.split('.')[-1], ('', ''))
+            row += [QStandardItem(str(hits)), QStandardItem(str(misses))]
+            for item in row[1:]:
+                item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+            row[0].setToolTip(' '.join(f'{bucket}: {count}' for bucket, count in stat['histogram'].items()))
+            self.model.appendRow(row)
+        self.slow_list.clear()
+        for query in reversed(snapshot['slow_queries']):
+            self.slow_list.addItem(f'{query["time"]}  {query["ms"]:.1f}ms  {query["sql"]}  -- {query["parameters"]}')
+
+    def reset(self):
+        metrics.reset()
+        opened = database.opened()
+        if isinstance(opened, CachedDatabase):
+            opened.cache.reset_stats()
+        self.refresh()
+
+    def save(self):
+        path = QFileDialog.getSaveFileName(self, "保存", "metrics.json", "JSON (*.json)")[0]
+        if path:
+            dump_metrics(path)
+
+
 class AvatarWidget(NavigationWidget):
     """ Avatar widget """
 
@@ -735,12 +1381,16 @@ class CustomTitleBar(TitleBar):
 
 
 class Window(FramelessWindow):
+    # the database is open
+    connected = pyqtSignal()
 
     def __init__(self):
         super().__init__()
         # datas
         self.classes = []
         self.class_bars = []
+        self.connect_failed = False
+        self.load_failed = False
 
         self.setTitleBar(CustomTitleBar(self))
 
@@ -751,13 +1401,19 @@ class Window(FramelessWindow):
         self.navigationInterface = NavigationInterface(self, showMenuButton=True, showReturnButton=False)
         self.stackWidget = QStackedWidget(self)
 
+        # imports the files of folders bound to a chapter, in the background. started once the database is open,
+        # binds until then wait in its queue
+        self.folderWatcher = FolderWatcher(database, self)
+
         # create sub interface
         self.searchInterface = SearchWidget('Search', self)
         self.classesInterface = ClassWidget('My Classes', self.update_navigation_bar, self)
         self.tagsInterface = TagsWidget('Tags', self)
         self.filesInterface = FilesWidget('Files', self)
-        self.filelistInterface = FilelistWidget(self)
+        self.diagnosticsInterface = DiagnosticsWidget('Diagnostics', self)
+        self.filelistInterface = FilelistWidget(self.folderWatcher, self)
         self.stackWidget.addWidget(self.filelistInterface)
+        self.folderWatcher.synced.connect(self.filelistInterface.folder_synced)
 
         # initialize layout
         self.init_layout()
@@ -788,6 +1444,8 @@ class Window(FramelessWindow):
 
         self.update_navigation_bar()
 
+        self.add_sub_interface(self.diagnosticsInterface, FIF.INFO, 'Diagnostics', NavigationItemPosition.BOTTOM)
+
         # add custom widget to bottom
         self.navigationInterface.addWidget(
             routeKey='avatar',
@@ -869,11 +1527,56 @@ class Window(FramelessWindow):
         self.titleBar.move(46, 0)
         self.titleBar.resize(self.width() - 46, self.titleBar.height())
 
+    def closeEvent(self, e):
+        self.folderWatcher.stop()
+        # before the executor is shut down, it writes the last files of the import
+        self.filelistInterface.stop_import()
+        executor.shutdown()
+        if METRICS_DUMP:
+            dump_metrics(METRICS_DUMP)
+        super().closeEvent(e)
+
+    def connect_database(self):
+        # the widgets already asked for their data, whichever thread gets to it first opens the database
+        executor.write(database.connect, done=self.database_connected, failed=self.database_failed)
+
+    def database_connected(self, result):
+        self.connect_failed = False
+        # the first reads ran before the database was open, or while it was being opened, and may have failed
+        # even though connecting worked
+        if self.load_failed:
+            self.update_navigation_bar()
+        for widget in (self.classesInterface, self.tagsInterface, self.filelistInterface):
+            if widget.load_failed:
+                widget.refresh()
+        self.folderWatcher.start()
+        self.connected.emit()
+
+    def database_failed(self, error):
+        print("error: database", error)
+        if not self.connect_failed:
+            InfoBar.error(
+                title='ERROR',
+                content=f"无法连接数据库，{RECONNECT_INTERVAL}秒后重试: {error}",
+                orient=Qt.Horizontal,
+                isClosable=True,
+                position=InfoBarPosition.TOP_RIGHT,
+                duration=5000,
+                parent=self
+            )
+        self.connect_failed = True
+        QTimer.singleShot(RECONNECT_INTERVAL * 1000, self.connect_database)
+
     def update_navigation_bar(self):
+        self.load_failed = False
+        executor.read((self, 'classes'), database.get_classes, done=self.show_navigation_bar,
+                      failed=load_failed(self))
+
+    def show_navigation_bar(self, classes):
         for i in range(len(self.classes)):
             self.navigationInterface.removeWidget(str(self.classes[i][0]))
         self.class_bars = []
-        self.classes = database.get_classes()
+        self.classes = classes
         for cls in self.classes:
             cls_button = self.navigationInterface.addItem(
                 str(cls[0]),
@@ -896,6 +1599,42 @@ class Window(FramelessWindow):
         self.switchTo(self.filesInterface)
 
 
+class StartupProfile(QObject):
+    """ CORPORA_STARTUP_PROFILE=1: print when the start got to each point as json and quit.
+    the times are epoch seconds so that the process that started the app can tell how long the interpreter took
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.times = {'imported': time.time()}
+        self.timer = QTimer(self)
+        self.timer.setInterval(5)
+        self.timer.timeout.connect(self.check_populated)
+
+    def watch(self, window):
+        self.times['window'] = time.time()
+        window.installEventFilter(self)
+        window.connected.connect(self.database_connected)
+
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Paint and 'first_frame' not in self.times:
+            self.times['first_frame'] = time.time()
+        return False
+
+    def database_connected(self):
+        self.times['database'] = time.time()
+        self.timer.start()
+
+    def check_populated(self):
+        # every widget got the data it asked for
+        if executor.pending:
+            return
+        self.timer.stop()
+        self.times['populated'] = time.time()
+        print(json.dumps(self.times))
+        QApplication.instance().quit()
+
+
 if __name__ == '__main__':
     QApplication.setHighDpiScaleFactorRoundingPolicy(
         Qt.HighDpiScaleFactorRoundingPolicy.PassThrough)
@@ -903,6 +1642,11 @@ if __name__ == '__main__':
     QApplication.setAttribute(Qt.AA_UseHighDpiPixmaps)
 
     app = QApplication(sys.argv)
+    profile = StartupProfile() if STARTUP_PROFILE else None
     w = Window()
+    if profile:
+        profile.watch(w)
     w.show()
+    # the window is painted before the database is waited for
+    QTimer.singleShot(0, w.connect_database)
     app.exec_()
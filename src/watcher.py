@@ -0,0 +1,432 @@
+# keep chapters that are bound to a folder in sync with the files on disk
+# on linux inotify says which paths changed, elsewhere the folders are polled
+import ctypes
+import ctypes.util
+import os
+import queue
+import select
+import sqlite3
+import struct
+import sys
+import time
+
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from chunks import PAGE_BREAK
+from content import limit_text
+from extract_cache import file_hash
+from ingest import PAGES_PER_TASK, extract_pages, prepare, quarantine_failure, store
+from sandbox import SandboxPool
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'watch.db')
+# seconds between two scans of the folders that are polled
+POLL_INTERVAL = 30
+# inotify events are collected until the folders have been quiet for this long
+SETTLE_TIME = 0.5
+
+SCHEMA = '''
+create table if not exists folders (
+    chapter_id integer primary key,
+    class_id integer not null,
+    folder text not null
+);
+-- every file imported from a bound folder, with its size, mtime and hash when it was imported
+create table if not exists watched (
+    chapter_id integer not null,
+    path text not null,
+    file_id integer not null,
+    file_size integer not null,
+    mtime integer not null,
+    hash text not null,
+    primary key (chapter_id, path)
+);
+'''
+
+# inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR
+EVENT = struct.Struct('iIII')
+
+
+def ignored(name):
+    # hidden files and the lock files office keeps next to open documents
+    return name.startswith('.') or name.startswith('~$')
+
+
+def under(path, folder):
+    return path == folder or path.startswith(folder.rstrip(os.sep) + os.sep)
+
+
+class Inotify:
+    """ the directories of a tree watched with inotify through libc """
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.directories = {}
+
+    def close(self):
+        os.close(self.fd)
+
+    def watch_tree(self, folder):
+        # return False if some directory could not be watched, e.g. fs.inotify.max_user_watches was reached
+        complete = True
+        for directory, dirs, files in os.walk(folder):
+            dirs[:] = [name for name in dirs if not ignored(name)]
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+            if wd < 0:
+                complete = False
+                continue
+            self.directories[wd] = directory
+        return complete
+
+    def read(self, timeout):
+        # [(path, mask)], path is None when the kernel queue overflowed and events were lost
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+            name = data[offset + EVENT.size:offset + EVENT.size + length].rstrip(b'\0')
+            offset += EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                events.append((None, mask))
+            elif mask & IN_IGNORED:
+                self.directories.pop(wd, None)
+            elif wd in self.directories:
+                directory = self.directories[wd]
+                events.append((os.path.join(directory, os.fsdecode(name)) if name else directory, mask))
+        return events
+
+
+class WatchState:
+    """ which chapter is bound to which folder, and what was imported from it """
+
+    def __init__(self, path=None):
+        self.conn = sqlite3.connect(path or os.environ.get('CORPORA_WATCH_DB', DEFAULT_PATH), timeout=30)
+        self.conn.execute('pragma journal_mode = wal')
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def folders(self):
+        return self.conn.execute('select chapter_id, class_id, folder from folders').fetchall()
+
+    def bind(self, chapter_id, class_id, folder):
+        with self.conn:
+            self.conn.execute('delete from watched where chapter_id = ?', (chapter_id,))
+            self.conn.execute('insert or replace into folders (chapter_id, class_id, folder) values (?, ?, ?)',
+                              (chapter_id, class_id, folder))
+
+    def unbind(self, chapter_id):
+        with self.conn:
+            self.conn.execute('delete from watched where chapter_id = ?', (chapter_id,))
+            self.conn.execute('delete from folders where chapter_id = ?', (chapter_id,))
+
+    def get(self, chapter_id, path):
+        # (file_id, file_size, mtime, hash) or None
+        return self.conn.execute('select file_id, file_size, mtime, hash from watched '
+                                 'where chapter_id = ? and path = ?', (chapter_id, path)).fetchone()
+
+    def paths_under(self, chapter_id, directory):
+        prefix = directory.rstrip(os.sep) + os.sep
+        return [path for path, in self.conn.execute('select path from watched where chapter_id = ? and '
+                                                    '(path = ? or substr(path, 1, ?) = ?)',
+                                                    (chapter_id, directory, len(prefix), prefix))]
+
+    def put(self, rows):
+        # [(chapter_id, path, file_id, file_size, mtime, hash)]
+        with self.conn:
+            self.conn.executemany('insert or replace into watched (chapter_id, path, file_id, file_size, mtime, hash) '
+                                  'values (?, ?, ?, ?, ?, ?)', rows)
+
+    def remove(self, chapter_id, paths):
+        with self.conn:
+            self.conn.executemany('delete from watched where chapter_id = ? and path = ?',
+                                  [(chapter_id, path) for path in paths])
+
+
+class FolderSync:
+    """ applies what changed on disk to the database. only the paths it is given are looked at,
+    and only files whose size or mtime changed are hashed, and only those whose hash changed are extracted
+    """
+
+    def __init__(self, database, state):
+        self.database = database
+        self.state = state
+        self.executor = None
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    def extract_texts(self, files):
+        # [(path, file_type)] -> [text or None], always in the sandboxed worker processes
+        if not files:
+            return []
+        if self.executor is None:
+            self.executor = SandboxPool()
+        futures = [self.executor.submit(prepare, path, file_type) for path, file_type in files]
+        texts = []
+        for (path, file_type), future in zip(files, futures):
+            ranges = []
+            try:
+                text, pages = future.result()
+                if text is None:
+                    # a long pdf is extracted in page ranges spread over the pool, the way an import does
+                    ranges = [self.executor.submit(extract_pages, path, first, min(first + PAGES_PER_TASK, pages))
+                              for first in range(0, pages, PAGES_PER_TASK)]
+                    text = limit_text(PAGE_BREAK.join(part.result() for part in ranges))
+                    store(path, file_type, text)
+                texts.append(text)
+            except Exception as e:
+                for part in ranges:
+                    part.cancel()
+                print("error:", path, quarantine_failure(path, e))
+                texts.append(None)
+        return texts
+
+    def scan(self, chapter_id, class_id, directory):
+        # everything below directory, including what was imported from it but is gone now
+        paths = set(self.state.paths_under(chapter_id, directory))
+        for root, dirs, files in os.walk(directory):
+            dirs[:] = [name for name in dirs if not ignored(name)]
+            paths.update(os.path.join(root, name) for name in files if not ignored(name))
+        return self.apply(chapter_id, class_id, paths)
+
+    def apply(self, chapter_id, class_id, paths):
+        # return True if the chapter changed
+        added = []
+        updated = []
+        removed = []
+        touched = []
+        for path in paths:
+            row = self.state.get(chapter_id, path)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                stat = None
+            if stat is None or not os.path.isfile(path) or ignored(os.path.basename(path)):
+                if row:
+                    removed.append((path, row[0]))
+                continue
+            if row and row[1] == stat.st_size and row[2] == stat.st_mtime_ns:
+                continue
+            try:
+                digest = file_hash(path)
+            except OSError:
+                continue
+            if row and row[3] == digest:
+                touched.append((chapter_id, path, row[0], stat.st_size, stat.st_mtime_ns, digest))
+            elif row:
+                updated.append((path, stat, digest, row[0]))
+            else:
+                added.append((path, stat, digest))
+
+        texts = self.extract_texts([(path, path.split('.')[-1]) for path, *_ in added + updated])
+        added_texts, updated_texts = texts[:len(added)], texts[len(added):]
+        if added:
+            file_ids = self.database.add_files([
+                (os.path.basename(path), path.replace(os.sep, '/'), path.split('.')[-1], str(stat.st_size),
+                 chapter_id, class_id, text)
+                for (path, stat, digest), text in zip(added, added_texts)])
+            touched += [(chapter_id, path, file_id, stat.st_size, stat.st_mtime_ns, digest)
+                        for (path, stat, digest), file_id in zip(added, file_ids)]
+        if updated:
+            self.database.update_files([(file_id, str(stat.st_size), text)
+                                        for (path, stat, digest, file_id), text in zip(updated, updated_texts)])
+            touched += [(chapter_id, path, file_id, stat.st_size, stat.st_mtime_ns, digest)
+                        for path, stat, digest, file_id in updated]
+        for path, file_id in removed:
+            try:
+                self.database.delete_file(file_id)
+            except Exception as e:
+                # already deleted by hand in the file list
+                print("error:", path, e)
+        self.state.put(touched)
+        self.state.remove(chapter_id, [path for path, file_id in removed])
+        return bool(added or updated or removed)
+
+
+class FolderWatcher(QThread):
+    """ runs FolderSync whenever a bound folder changes """
+    # chapter_id, class_id of a chapter whose files changed
+    synced = pyqtSignal(int, int)
+
+    def __init__(self, database, parent=None):
+        super().__init__(parent)
+        self.database = database
+        self.requests = queue.Queue()
+        self.running = True
+        self.folders = {}
+        self.polled = set()
+        # chapter_id -> (directories, files) whose sync failed, tried again on the next poll
+        self.failed = {}
+        # bind and unbind requests that failed, tried again on the next poll
+        self.failed_requests = []
+        self.inotify = None
+        self.sync = None
+
+    def bind(self, chapter_id, class_id, folder):
+        self.requests.put(('bind', chapter_id, class_id, os.path.normpath(folder)))
+
+    def unbind(self, chapter_id):
+        self.requests.put(('unbind', chapter_id))
+
+    def stop(self):
+        self.running = False
+        self.wait()
+
+    def watch(self, chapter_id, folder):
+        if self.inotify is None or not self.inotify.watch_tree(folder):
+            self.polled.add(chapter_id)
+
+    def scan(self, chapter_id, directories=None, files=()):
+        """sync the directories and files of a chapter that changed, its whole folder if directories is None.
+        what can't be synced now, e.g. because the database is down, a file vanished mid-scan or the disk is full,
+        is kept and tried again on the next poll
+        """
+        if chapter_id not in self.folders:
+            return
+        class_id, folder = self.folders[chapter_id]
+        directories = [folder] if directories is None else directories
+        try:
+            if not self.sync.database.chapter_exists(chapter_id):
+                # the chapter or its class was deleted
+                self.sync.state.unbind(chapter_id)
+                del self.folders[chapter_id]
+                self.polled.discard(chapter_id)
+                self.failed.pop(chapter_id, None)
+                return
+            changed = False
+            for directory in directories:
+                changed = self.sync.scan(chapter_id, class_id, directory) or changed
+            if files:
+                changed = self.sync.apply(chapter_id, class_id, files) or changed
+        except Exception as e:
+            print("error: sync", folder, e)
+            failed_directories, failed_files = self.failed.setdefault(chapter_id, (set(), set()))
+            failed_directories.update(directories)
+            failed_files.update(files)
+            return
+        if changed:
+            self.synced.emit(chapter_id, class_id)
+
+    def retry(self):
+        failed, self.failed = self.failed, {}
+        requests, self.failed_requests = self.failed_requests, []
+        for request in requests:
+            self.requests.put(request)
+        self.handle_requests()
+        for chapter_id in list(self.polled):
+            failed.pop(chapter_id, None)
+            self.scan(chapter_id)
+        for chapter_id, (directories, files) in failed.items():
+            self.scan(chapter_id, list(directories), list(files))
+
+    def handle_requests(self):
+        while True:
+            try:
+                request = self.requests.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                if request[0] == 'bind':
+                    kind, chapter_id, class_id, folder = request
+                    self.sync.state.bind(chapter_id, class_id, folder)
+                    self.folders[chapter_id] = (class_id, folder)
+                    self.failed.pop(chapter_id, None)
+                    self.watch(chapter_id, folder)
+                    self.scan(chapter_id)
+                else:
+                    kind, chapter_id = request
+                    self.sync.state.unbind(chapter_id)
+                    self.folders.pop(chapter_id, None)
+                    self.polled.discard(chapter_id)
+                    self.failed.pop(chapter_id, None)
+            except Exception as e:
+                print("error:", request[0], e)
+                self.failed_requests.append(request)
+
+    def handle_events(self, events):
+        directories = set()
+        files = set()
+        for path, mask in events:
+            if path is None:
+                # events were lost, look at everything again
+                for chapter_id in list(self.folders):
+                    self.scan(chapter_id)
+                return
+            if mask & IN_ISDIR or mask & IN_DELETE_SELF:
+                directories.add(path)
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self.inotify.watch_tree(path)
+            else:
+                files.add(path)
+        for chapter_id, (class_id, folder) in list(self.folders.items()):
+            changed_directories = [directory for directory in directories if under(directory, folder)]
+            paths = [path for path in files if under(path, folder)]
+            if changed_directories or paths:
+                self.scan(chapter_id, changed_directories, paths)
+
+    def run(self):
+        # the database borrows a pooled connection for every call, so it is shared with the gui thread.
+        # nothing may escape from here, pyqt aborts the whole app on an exception in QThread.run
+        try:
+            state = WatchState()
+        except Exception as e:
+            print("error: watch state", e)
+            return
+        self.sync = FolderSync(self.database, state)
+        if sys.platform.startswith('linux'):
+            try:
+                self.inotify = Inotify()
+            except OSError as e:
+                print("error: inotify", e)
+        last_poll = time.monotonic()
+        try:
+            for chapter_id, class_id, folder in self.sync.state.folders():
+                self.folders[chapter_id] = (class_id, folder)
+                self.watch(chapter_id, folder)
+                # catch up with what changed while the app was closed
+                self.scan(chapter_id)
+            while self.running:
+                self.handle_requests()
+                if self.inotify is not None:
+                    events = self.inotify.read(1)
+                    # an editor saving or a folder being copied comes as a burst of events
+                    while events:
+                        more = self.inotify.read(SETTLE_TIME)
+                        if not more:
+                            break
+                        events += more
+                    if events:
+                        self.handle_events(events)
+                else:
+                    time.sleep(1)
+                if (self.polled or self.failed or self.failed_requests) and \
+                        time.monotonic() - last_poll > POLL_INTERVAL:
+                    self.retry()
+                    last_poll = time.monotonic()
+        finally:
+            self.sync.close()
+            self.sync.state.close()
+            if self.inotify is not None:
+                self.inotify.close()
@@ -0,0 +1,9 @@
+# the modules of the app import each other from src, the way python src/ui.py runs them
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'mysql: needs the MySQL server named by CORPORA_TEST_MYSQL')
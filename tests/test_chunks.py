@@ -0,0 +1,41 @@
+from chunks import CHUNK_SIZE, PAGE_BREAK, split_chunks
+
+
+def test_pages():
+    text = PAGE_BREAK.join(['first page', '', 'third page'])
+    assert split_chunks(text) == [
+        (0, 1, 0, 'first page'),
+        # the empty page is left out but still counted
+        (1, 3, text.index('third'), 'third page'),
+    ]
+
+
+def test_text_without_pages():
+    assert split_chunks('no pages') == [(0, None, 0, 'no pages')]
+    assert split_chunks(' \n ') == []
+
+
+def test_long_text_is_cut_after_a_line_break():
+    line = 'x' * 99 + '\n'
+    text = line * (CHUNK_SIZE // len(line) * 3)
+    chunks = split_chunks(text)
+    assert all(len(content) <= CHUNK_SIZE and content.endswith('\n') for chunk, page, start, content in chunks)
+    assert ''.join(content for chunk, page, start, content in chunks) == text
+    assert [start for chunk, page, start, content in chunks] == [CHUNK_SIZE * i for i in range(3)]
+
+
+def test_long_text_without_line_breaks_is_cut_at_the_chunk_size():
+    text = 'y' * (CHUNK_SIZE * 2 + 10)
+    chunks = split_chunks(text)
+    assert [(chunk, start, len(content)) for chunk, page, start, content in chunks] == \
+        [(0, 0, CHUNK_SIZE), (1, CHUNK_SIZE, CHUNK_SIZE), (2, CHUNK_SIZE * 2, 10)]
+
+
+def test_long_page_keeps_its_number_and_offset():
+    first = 'short'
+    text = first + PAGE_BREAK + 'z' * (CHUNK_SIZE + 1)
+    chunks = split_chunks(text)
+    second = len(first) + len(PAGE_BREAK)
+    assert [(chunk, page, start) for chunk, page, start, content in chunks] == \
+        [(0, 1, 0), (1, 2, second), (2, 2, second + CHUNK_SIZE)]
+    assert all(text[start:start + len(content)] == content for chunk, page, start, content in chunks)
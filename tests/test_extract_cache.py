@@ -0,0 +1,90 @@
+import os
+import sqlite3
+import zlib
+
+from extract_cache import ExtractCache
+
+
+def random_text():
+    return os.urandom(600).hex()
+
+
+# two random texts fit in it, a third doesn't
+BUDGET = len(zlib.compress(random_text().encode())) * 5 // 2
+
+
+def write(path, data):
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_evict_least_recently_used(tmp_path):
+    texts = [random_text() for i in range(3)]
+    cache = ExtractCache(str(tmp_path / 'cache'), budget=BUDGET)
+    paths = [write(tmp_path / f'{i}.txt', f'file {i}'.encode()) for i in range(3)]
+    cache.store(paths[0], 'txt', texts[0])
+    cache.store(paths[1], 'txt', texts[1])
+    assert cache.lookup(paths[0], 'txt') == texts[0]
+    cache.store(paths[2], 'txt', texts[2])
+    assert cache.lookup(paths[0], 'txt') == texts[0]
+    assert cache.lookup(paths[1], 'txt') is None
+    assert cache.lookup(paths[2], 'txt') == texts[2]
+    cache.close()
+
+
+def test_evict_drops_the_paths_of_evicted_hashes(tmp_path):
+    cache = ExtractCache(str(tmp_path / 'cache'), budget=BUDGET)
+    paths = [write(tmp_path / f'{i}.txt', f'file {i}'.encode()) for i in range(3)]
+    for path in paths:
+        cache.store(path, 'txt', random_text())
+    hashed = {row[0] for row in cache.conn.execute('select path from paths')}
+    assert hashed == set(paths[1:])
+    cache.close()
+
+
+def test_evict_keeps_the_path_of_a_hash_cached_as_another_type(tmp_path):
+    cache = ExtractCache(str(tmp_path / 'cache'), budget=BUDGET)
+    shared = write(tmp_path / 'shared.bin', b'shared')
+    other = write(tmp_path / 'other.txt', b'other')
+    cache.store(shared, 'txt', random_text())
+    cache.store(shared, 'docx', random_text())
+    cache.store(other, 'txt', random_text())
+    assert cache.lookup(shared, 'txt') is None
+    assert cache.lookup(shared, 'docx') is not None
+    assert shared in {row[0] for row in cache.conn.execute('select path from paths')}
+    cache.close()
+
+
+def test_quarantine_is_lifted_by_a_higher_limit(tmp_path):
+    cache = ExtractCache(str(tmp_path / 'cache'))
+    slow = write(tmp_path / 'slow.pdf', b'slow')
+    big = write(tmp_path / 'big.pdf', b'big')
+    bad = write(tmp_path / 'bad.pdf', b'bad')
+    cache.quarantine(slow, 'timed out after 120s', timeout=120)
+    cache.quarantine(big, 'out of memory (limit 1024 MiB)', memory_limit=1024)
+    cache.quarantine(bad, 'no limit to raise')
+    assert cache.quarantined(slow, 120, 1024) is not None
+    assert cache.quarantined(slow, 300, 1024) is None
+    assert cache.quarantined(big, 300, 1024) is not None
+    assert cache.quarantined(big, 120, 2048) is None
+    # 0 is no memory limit at all
+    assert cache.quarantined(big, 120, 0) is None
+    assert cache.quarantined(bad, 300, 0) == 'no limit to raise'
+    cache.close()
+
+
+def test_upgrade_lifts_the_quarantines_without_a_limit(tmp_path):
+    directory = tmp_path / 'cache'
+    directory.mkdir()
+    conn = sqlite3.connect(str(directory / 'extract_cache.db'))
+    # a cache from before the limits were recorded
+    conn.execute('create table quarantine (hash text primary key, path text not null, reason text not null, '
+                 'time real not null)')
+    conn.executemany('insert into quarantine values (?, ?, ?, 0)',
+                     [('a', 'a.pdf', 'timed out after 120s'), ('b', 'b.pdf', 'out of memory (limit 2048 MiB)'),
+                      ('c', 'c.pdf', 'extraction worker died (exit code -9)'), ('d', 'd.pdf', 'kept')])
+    conn.commit()
+    conn.close()
+    cache = ExtractCache(str(directory))
+    assert cache.conn.execute('select hash from quarantine').fetchall() == [('d',)]
+    cache.close()
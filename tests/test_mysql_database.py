@@ -0,0 +1,173 @@
+import itertools
+import threading
+
+import pymysql
+import pytest
+
+import mysql_database
+from mysql_database import MySQLDatabase
+from search_syntax import parse_query
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def execute(self, query, args=None):
+        self.connection.server.execute(self.connection, query, args)
+
+    def fetchall(self):
+        return []
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, server):
+        self.server = server
+        self.id = next(server.ids)
+
+    def thread_id(self):
+        return self.id
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def ping(self, reconnect=False):
+        pass
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeServer:
+    """ a select blocks until release is set, kill query calls on_kill and raises kill_error if there are """
+
+    def __init__(self):
+        self.ids = itertools.count(1)
+        self.statements = []
+        self.selecting = threading.Event()
+        self.release = threading.Event()
+        self.kill_error = None
+        self.on_kill = None
+
+    def connect(self, **kwargs):
+        return FakeConnection(self)
+
+    def execute(self, connection, query, args):
+        self.statements.append((connection.id, query, args))
+        if query.startswith('kill query'):
+            if self.on_kill is not None:
+                self.on_kill()
+            if self.kill_error is not None:
+                raise self.kill_error
+        if query.startswith('select'):
+            self.selecting.set()
+            self.release.wait(5)
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = FakeServer()
+    monkeypatch.setattr(mysql_database.pymysql, 'connect', server.connect)
+    yield server
+    server.release.set()
+
+
+def kills(server):
+    return [(connection, args) for connection, query, args in server.statements if query.startswith('kill query')]
+
+
+def run_select(database, server):
+    # a call on another thread that is stopped inside its statement
+    thread = threading.Thread(target=database.get_classes)
+    thread.start()
+    server.selecting.wait(5)
+    session = database.pool.borrowed[thread.ident]
+    return thread, session
+
+
+def test_interrupt_kills_the_statement_of_the_thread(server):
+    database = MySQLDatabase()
+    thread, session = run_select(database, server)
+    database.interrupt(thread.ident)
+    killer = database.killer.thread_id()
+    assert kills(server) == [(killer, session.conn.thread_id())]
+    server.release.set()
+    thread.join()
+    # the connection was given back, it may run the call of another thread by now
+    database.interrupt(thread.ident)
+    assert len(kills(server)) == 1
+
+
+def test_connection_is_kept_until_the_kill_is_sent(server):
+    database = MySQLDatabase()
+    thread, session = run_select(database, server)
+    borrowed = []
+
+    def finish():
+        # the statement finishes while kill query is on its way, the connection must not be handed on yet
+        server.release.set()
+        thread.join(0.2)
+        borrowed.append(database.pool.borrowed.get(thread.ident))
+
+    server.on_kill = finish
+    database.interrupt(thread.ident)
+    thread.join()
+    assert borrowed == [session]
+    assert thread.ident not in database.pool.borrowed
+
+
+def test_interrupt_ignores_an_unknown_thread(server):
+    database = MySQLDatabase()
+    thread, session = run_select(database, server)
+    server.kill_error = pymysql.err.InternalError(1094, 'Unknown thread id: 1')
+    database.interrupt(thread.ident)
+    assert database.killer is not None
+    server.release.set()
+    thread.join()
+
+
+def test_interrupt_reconnects_the_killer_after_losing_it(server):
+    database = MySQLDatabase()
+    thread, session = run_select(database, server)
+    server.kill_error = pymysql.err.OperationalError(2013, 'Lost connection to MySQL server during query')
+    with pytest.raises(pymysql.err.OperationalError):
+        database.interrupt(thread.ident)
+    assert database.killer is None
+    server.kill_error = None
+    database.interrupt(thread.ident)
+    assert kills(server)[-1] == (database.killer.thread_id(), session.conn.thread_id())
+    server.release.set()
+    thread.join()
+
+
+def hits(keyword):
+    # _hits only builds the statement, it doesn't need a server
+    return MySQLDatabase._hits(None, parse_query(keyword))
+
+
+def test_hits_locate_single_characters():
+    # with ngram_token_size=2 the last character of a run (库 in 数据库) starts no bigram in grams
+    sql, args = hits('库')
+    assert 'grams' not in sql and 'locate(%s, content) > 0' in sql
+    assert args == ('库',)
+    sql, args = hits('数据 库 -表')
+    assert 'not in (select files_file_id from textchunks where locate(%s, content) > 0)' in sql
+    assert args == ('+"数据"', '+"数据"', '库', '表')
+
+
+def test_hits_exclude_whole_files():
+    sql, args = hits('kernel -network -网络')
+    assert sql.count('textchunks.files_file_id not in (select files_file_id from textchunks where MATCH') == 2
+    assert args == ('kernel', 'kernel', '"网络"', '"network"')
@@ -0,0 +1,35 @@
+import threading
+
+from pool import ConnectionPool
+
+
+def test_interrupt_keeps_the_connection_until_killed():
+    pool = ConnectionPool(connect=object, close=lambda connection: None, size=1)
+    borrowed = threading.Event()
+    finish = threading.Event()
+    events = []
+
+    def call():
+        with pool.connection() as connection:
+            events.append(('borrowed', connection))
+            borrowed.set()
+            finish.wait()
+        events.append('given back')
+
+    def kill(connection):
+        events.append(('kill', connection))
+        # the call finishes while its statement is being killed
+        finish.set()
+        thread.join(0.2)
+        events.append('killed')
+
+    thread = threading.Thread(target=call)
+    thread.start()
+    borrowed.wait()
+    pool.interrupt(thread.ident, kill)
+    thread.join()
+    connection = events[0][1]
+    assert events == [('borrowed', connection), ('kill', connection), 'killed', 'given back']
+    # nothing is borrowed any more, there is nothing to kill
+    pool.interrupt(thread.ident, kill)
+    assert len(events) == 4
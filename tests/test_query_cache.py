@@ -0,0 +1,87 @@
+import threading
+
+import pytest
+
+from query_cache import SEARCH_TABLES, CachedDatabase, QueryCache
+
+
+class FakeDatabase:
+    """ search_files counts how often it really ran, every other method is a write that does nothing """
+
+    def __init__(self):
+        self.searches = 0
+
+    def search_files(self, *args):
+        self.searches += 1
+        return [('hit', self.searches)]
+
+    def __getattr__(self, name):
+        return lambda *args: None
+
+
+# a write to each of the tables a search reads, class and file ids are 1
+WRITES = [
+    ('textfiles', 'add_textfile', (1, 'text')),
+    ('textfiles', 'rebuild_chunks', ()),
+    ('textfiles', 'compress_texts', ()),
+    ('files', 'add_file', ('a.txt', '/a.txt', 'txt', '1', 1, 1)),
+    ('files', 'add_files', ([('a.txt', '/a.txt', 'txt', '1', 1, 1, 'text')],)),
+    ('files', 'update_files', ([(1, '1', 'text')],)),
+    ('files', 'delete_file', (1,)),
+    ('chapters', 'add_chapter', (1, 'chapter')),
+    ('chapters', 'delete_chapter', (1,)),
+    ('chapters', 'update_chapter_total_size', (1, 1)),
+    ('classes', 'add_class', ('class', 'teacher')),
+    ('classes', 'delete_class', (1,)),
+    ('filetag', 'add_filetag', (1, 1)),
+    ('filetag', 'delete_filetag', (1, 1)),
+    ('filetag', 'delete_tag', (1,)),
+]
+
+
+def test_every_search_table_is_written():
+    assert {table for table, method, args in WRITES} == set(SEARCH_TABLES)
+
+
+@pytest.mark.parametrize('table, method, args', WRITES, ids=[method for table, method, args in WRITES])
+def test_write_evicts_search_files(table, method, args):
+    database = CachedDatabase(FakeDatabase())
+    first = database.search_files('数据')
+    assert database.search_files('数据') == first
+    assert database.database.searches == 1
+    getattr(database, method)(*args)
+    assert database.search_files('数据') != first
+    assert database.database.searches == 2
+
+
+def test_other_writes_keep_search_files():
+    database = CachedDatabase(FakeDatabase())
+    database.search_files('数据')
+    database.add_tag('tag')
+    database.search_files('数据')
+    assert database.database.searches == 1
+
+
+def test_read_overlapping_a_write_is_not_stored():
+    cache = QueryCache()
+    loading = threading.Event()
+    written = threading.Event()
+
+    def load():
+        loading.set()
+        # the write commits and invalidates while the read is still running
+        written.wait()
+        return 'stale'
+
+    def write():
+        loading.wait()
+        cache.invalidate('files')
+        written.set()
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    assert cache.get(('get_classes',), ('classes',), load) == 'stale'
+    thread.join()
+    # another table, but the result may still predate the write, it is loaded again
+    assert cache.get(('get_classes',), ('classes',), lambda: 'fresh') == 'fresh'
+    assert cache.get(('get_classes',), ('classes',), lambda: 'not loaded') == 'fresh'
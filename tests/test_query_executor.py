@@ -0,0 +1,136 @@
+import threading
+import time
+
+import pytest
+from PyQt5.QtCore import QCoreApplication
+
+from query_executor import QueryExecutor
+
+
+@pytest.fixture(scope='module')
+def app():
+    # the results are delivered through the event loop of the thread the executor was created on
+    return QCoreApplication.instance() or QCoreApplication([])
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        QCoreApplication.processEvents()
+        time.sleep(0.01)
+    QCoreApplication.processEvents()
+
+
+class FakeDatabase:
+    """ calls that record themselves, blocked ones wait for release """
+
+    def __init__(self):
+        self.calls = []
+        self.threads = {}
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.interrupted = []
+
+    def blocked(self, name):
+        self.calls.append(name)
+        self.threads[name] = threading.get_ident()
+        self.started.set()
+        self.release.wait(5)
+        return name
+
+    def call(self, name):
+        self.calls.append(name)
+        return name
+
+    def interrupt(self, thread):
+        self.interrupted.append(thread)
+        self.release.set()
+
+
+@pytest.fixture
+def database():
+    database = FakeDatabase()
+    yield database
+    database.release.set()
+
+
+def test_read_supersedes_the_read_with_the_same_key(app, database):
+    executor = QueryExecutor(workers=1)
+    results = []
+    # keeps the only worker busy, the first search is still queued when the second replaces it
+    executor.read(None, database.blocked, 'busy')
+    database.started.wait()
+    queued = executor.read('search', database.call, 'old', done=results.append)
+    latest = executor.read('search', database.call, 'new', done=results.append)
+    assert queued.future.cancelled()
+    database.release.set()
+    wait_until(lambda: latest.future.done())
+    assert database.calls == ['busy', 'new']
+    assert results == ['new']
+    executor.shutdown()
+
+
+def test_superseded_running_read_is_dropped(app, database):
+    executor = QueryExecutor(workers=2)
+    results = []
+    running = executor.read('search', database.blocked, 'old', done=results.append)
+    database.started.wait()
+    latest = executor.read('search', database.call, 'new', done=results.append)
+    database.release.set()
+    wait_until(lambda: running.future.done() and latest.future.done())
+    assert sorted(database.calls) == ['new', 'old']
+    assert results == ['new']
+    executor.shutdown()
+
+
+def test_read_waits_for_the_writes_before_it(app, database):
+    executor = QueryExecutor(workers=2)
+    executor.write(database.blocked, 'write')
+    database.started.wait()
+    read = executor.read('files', database.call, 'read')
+    time.sleep(0.1)
+    assert database.calls == ['write']
+    database.release.set()
+    wait_until(lambda: read.future.done())
+    assert database.calls == ['write', 'read']
+    executor.shutdown()
+
+
+def test_cancel_interrupts_a_running_read(app, database):
+    executor = QueryExecutor(workers=2, interrupt=database.interrupt)
+    results = []
+    running = executor.read('search', database.blocked, 'slow', done=results.append)
+    database.started.wait()
+    executor.cancel('search')
+    wait_until(lambda: running.future.done())
+    assert database.interrupted == [database.threads['slow']]
+    assert results == []
+    executor.shutdown()
+
+
+def test_cancel_doesnt_interrupt_a_queued_read(app, database):
+    executor = QueryExecutor(workers=1, interrupt=database.interrupt)
+    executor.read(None, database.blocked, 'busy')
+    database.started.wait()
+    queued = executor.read('search', database.call, 'queued')
+    executor.cancel('search')
+    assert queued.future.cancelled()
+    database.release.set()
+    executor.shutdown()
+    assert database.interrupted == []
+    assert database.calls == ['busy']
+
+
+def test_shutdown_drops_queued_reads(app, database):
+    executor = QueryExecutor(workers=1)
+    executor.read(None, database.blocked, 'running')
+    database.started.wait()
+    queued = [executor.read(None, database.call, f'queued {i}') for i in range(3)]
+    write = executor.write(database.call, 'write')
+    # the write submitted before is still finished, it doesn't wait for the reads
+    executor.shutdown()
+    assert write.future.done()
+    database.release.set()
+    wait_until(lambda: all(query.future.done() for query in queued))
+    assert database.calls == ['running', 'write']
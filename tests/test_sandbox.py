@@ -0,0 +1,56 @@
+import os
+import time
+
+import pytest
+
+from sandbox import ExtractTimeout, SandboxPool, WorkerCrashed
+
+
+@pytest.fixture
+def pool(request):
+    pool = SandboxPool(max_workers=1, **getattr(request, 'param', {}))
+    yield pool
+    pool.shutdown(wait=False)
+
+
+@pytest.mark.parametrize('pool', [dict(timeout=0.5)], indirect=True)
+def test_timeout_kills_the_worker(pool):
+    first = pool.submit(os.getpid).result()
+    start = time.monotonic()
+    with pytest.raises(ExtractTimeout) as error:
+        pool.submit(time.sleep, 30).result()
+    assert error.value.timeout == 0.5
+    assert time.monotonic() - start < 10
+    # the next task runs in a fresh worker
+    assert pool.submit(os.getpid).result() != first
+
+
+@pytest.mark.parametrize('pool', [dict(memory_limit=1024)], indirect=True)
+def test_crash_records_the_memory_limit(pool):
+    with pytest.raises(WorkerCrashed) as error:
+        pool.submit(os._exit, 3).result()
+    assert 'exit code 3' in str(error.value)
+    assert error.value.memory_limit == 1024
+    assert pool.submit(sum, [1, 2]).result() == 3
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='the memory limit is set with resource')
+@pytest.mark.parametrize('pool', [dict(memory_limit=1024)], indirect=True)
+def test_memory_error_records_the_memory_limit(pool):
+    with pytest.raises(MemoryError) as error:
+        pool.submit(bytearray, 4 * 1024 ** 3).result()
+    assert error.value.memory_limit == 1024
+    assert pool.submit(sum, [1, 2]).result() == 3
+
+
+@pytest.mark.parametrize('pool', [dict(tasks_per_worker=2)], indirect=True)
+def test_worker_is_recycled(pool):
+    pids = [pool.submit(os.getpid).result() for i in range(4)]
+    assert pids[0] == pids[1] != pids[2] == pids[3]
+
+
+def test_exception_keeps_the_worker(pool):
+    first = pool.submit(os.getpid).result()
+    with pytest.raises(ValueError):
+        pool.submit(int, 'x').result()
+    assert pool.submit(os.getpid).result() == first
@@ -0,0 +1,96 @@
+import pytest
+
+from search_syntax import SearchQuery, can_match, first_term, narrows, parse_query
+from sqlite_database import fts_query, gram_phrase, gram_query
+
+
+def query(runs=(), phrases=(), words=(), excluded_runs=(), excluded_phrases=()):
+    return SearchQuery(list(runs), list(phrases), list(words), list(excluded_runs), list(excluded_phrases))
+
+
+@pytest.mark.parametrize('keyword, expected', [
+    ('', query()),
+    ('database index', query(words=['database', 'index'])),
+    ('数据库', query(runs=['数据库'])),
+    ('数据库 系统', query(runs=['数据库', '系统'])),
+    ('数据库index', query(runs=['数据库'], words=['index'])),
+    ('"binary tree" search', query(phrases=['binary tree'], words=['search'])),
+    ('+graph', query(phrases=['graph'])),
+    ('-tree', query(excluded_phrases=['tree'])),
+    ('-排序', query(excluded_runs=['排序'])),
+    ('-"hash table" 索引', query(runs=['索引'], excluded_phrases=['hash table'])),
+    # the chinese and the other words of a phrase are looked up in different indexes
+    ('"数据库 index"', query(runs=['数据库'], phrases=['index'])),
+    ('+"中文 phrase"', query(runs=['中文'], phrases=['phrase'])),
+    # the closing quote is still being typed
+    ('"unclosed phrase', query(phrases=['unclosed phrase'])),
+    ('"', query()),
+    # an operator inside a word is part of it
+    ('a+b c-d', query(words=['a+b', 'c-d'])),
+    # punctuation alone can't be found by any index
+    ('-', query()),
+    ('数据-库', query(runs=['数据', '库'])),
+    ('database -', query(words=['database'])),
+])
+def test_parse_query(keyword, expected):
+    assert parse_query(keyword) == expected
+
+
+@pytest.mark.parametrize('keyword, matches', [
+    ('database', True),
+    ('数据库', True),
+    ('"a phrase"', True),
+    ('', False),
+    ('"', False),
+    # only exclusions
+    ('-tree', False),
+    ('-排序 -"hash table"', False),
+    ('-tree graph', True),
+])
+def test_can_match(keyword, matches):
+    assert can_match(parse_query(keyword)) is matches
+
+
+@pytest.mark.parametrize('keyword, term', [
+    ('database index', 'database'),
+    ('index 数据库', '数据库'),
+    ('search "binary tree"', 'binary tree'),
+    ('-tree graph', 'graph'),
+    ('-tree', ''),
+])
+def test_first_term(keyword, term):
+    assert first_term(parse_query(keyword)) == term
+
+
+@pytest.mark.parametrize('keyword, extended, expected', [
+    # typing on in a chinese run
+    ('数据', '数据库', True),
+    ('数', '数据', True),
+    ('数据库', '数据', False),
+    ('数据 系统', '数据库 系统', True),
+    # another word widens the search
+    ('database', 'database index', False),
+    ('tree', 'trees', False),
+    # more required terms or exclusions narrow it
+    ('"binary tree"', '"binary tree" -heap', True),
+    ('+graph', '+graph 图', True),
+    ('数据 -库', '数据库 -库', True),
+    ('"binary tree"', '"binary"', False),
+    ('数据 -堆', '数据库', False),
+    # a keyword that can't find anything narrows nothing
+    ('-x', '-x y', False),
+])
+def test_narrows(keyword, extended, expected):
+    assert narrows(keyword, extended) is expected
+
+
+def test_fts_query_quotes_user_input():
+    assert fts_query(parse_query('"binary tree" a"b')) == '"binary tree" AND ("a""b")'
+    assert fts_query(parse_query('database index')) == '("database" OR "index")'
+
+
+def test_gram_phrase():
+    assert gram_phrase('数据库') == '"数据 据库"'
+    # a single character only starts bigrams, it is looked up as a prefix
+    assert gram_phrase('数') == '"数"*'
+    assert gram_query(['数据', '库']) == '"数据" AND "库"*'
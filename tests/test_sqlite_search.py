@@ -0,0 +1,102 @@
+import pytest
+
+from database import SearchFilters
+from sqlite_database import SQLiteDatabase
+
+TEXTS = {
+    'systems.txt': '数据库系统 database index binary tree',
+    'structures.txt': '数据结构 hash table 排序',
+    'graphs.txt': 'graph theory 图论 tree traversal',
+    'hyphen.txt': '数据-库 hyphen',
+    'paged.txt': 'kernel scheduler\f网络 network stack',
+}
+
+
+def fill(database):
+    # one class with a chapter of TEXTS
+    database.add_class('class', 'teacher')
+    class_id = database.get_classes()[0][0]
+    chapter_id = database.add_chapter(class_id, 'chapter')
+    for name, text in TEXTS.items():
+        file_id = database.add_file(name, f'/corpus/{name}', 'txt', str(len(text)), chapter_id, class_id)
+        database.add_textfile(file_id, text)
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = SQLiteDatabase(str(tmp_path / 'search.db'))
+    fill(database)
+    yield database
+    database.pool.close()
+
+
+def found(database, keyword, **kwargs):
+    return sorted(hit[1] for hit in database.search_files(keyword, **kwargs))
+
+
+# keyword, the files it finds, shared with the mysql tests
+SEARCHES = [
+    ('数据', ['hyphen.txt', 'structures.txt', 'systems.txt']),
+    # a single character is a prefix of the bigrams
+    ('数', ['hyphen.txt', 'structures.txt', 'systems.txt']),
+    ('图', ['graphs.txt']),
+    # the last character of a run starts no bigram of its own
+    ('库', ['hyphen.txt', 'systems.txt']),
+    ('数据 -库', ['structures.txt']),
+    # punctuation separates runs, each of them has to appear
+    ('数据-库', ['hyphen.txt', 'systems.txt']),
+    ('tree', ['graphs.txt', 'systems.txt']),
+    ('tree hash', ['graphs.txt', 'structures.txt', 'systems.txt']),
+    ('tree -graph', ['systems.txt']),
+    ('-tree 数据', ['hyphen.txt', 'structures.txt']),
+    ('"binary tree"', ['systems.txt']),
+    ('"tree binary"', []),
+    ('+graph tree', ['graphs.txt']),
+    ('-"hash table"', []),
+    # an excluded term on another page leaves out the whole file
+    ('kernel', ['paged.txt']),
+    ('kernel -network', []),
+    ('kernel -网络', []),
+    ('kernel -网', []),
+    ('kernel -"network stack"', []),
+    ('kernel -storage', ['paged.txt']),
+    # latin words are matched whole
+    ('databa', []),
+]
+
+
+@pytest.mark.parametrize('keyword, names', SEARCHES)
+def test_search_files(database, keyword, names):
+    assert found(database, keyword) == names
+
+
+def test_search_files_best_first(database):
+    scores = [hit[-1] for hit in database.search_files('tree hash')]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_search_files_within_and_filters(database):
+    hits = {hit[1]: hit[0] for hit in database.search_files('数据')}
+    assert found(database, '数据库', within={hits['systems.txt']}) == ['systems.txt']
+    assert found(database, '数据', filters=SearchFilters(file_type='pdf')) == []
+    assert found(database, '数据', filters=SearchFilters(file_type='txt')) == sorted(hits)
+
+
+def test_search_files_pages(database):
+    # the pages put together are the hits in the same order
+    every = [hit[1] for hit in database.search_files('tree hash kernel hyphen')]
+    pages = [[hit[1] for hit in database.search_files('tree hash kernel hyphen', limit=2, offset=offset)]
+             for offset in range(0, len(every) + 2, 2)]
+    assert len(every) == 5 and pages[-1] == []
+    assert [name for page in pages for name in page] == every
+
+
+def test_search_files_position(database):
+    # 1-based in the whole text, the first character of the chunk if the term doesn't appear literally
+    positions = {hit[1]: hit[7] for hit in database.search_files('index')}
+    assert positions == {'systems.txt': TEXTS['systems.txt'].index('index') + 1}
+    class_id = database.get_classes()[0][0]
+    chapter_id = next(iter(database.get_files(class_id)[1]))
+    file_id = database.add_file('spaced.txt', '/corpus/spaced.txt', 'txt', '1', chapter_id, class_id)
+    database.add_textfile(file_id, 'a spaced  phrase')
+    assert [hit[7] for hit in database.search_files('"spaced phrase"')] == [1]
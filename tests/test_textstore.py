@@ -0,0 +1,37 @@
+import pytest
+
+import textstore
+from sqlite_database import SQLiteDatabase
+from textstore import pack, unpack
+
+TEXT = '数据库 database\n' * 50
+
+
+@pytest.mark.parametrize('compressed', [True, False])
+def test_pack_unpack(monkeypatch, compressed):
+    monkeypatch.setattr(textstore, 'COMPRESS_TEXT', compressed)
+    content, content_z = pack(TEXT)
+    assert (content is None) is compressed and (content_z is None) is not compressed
+    assert unpack(content, content_z) == TEXT
+    assert unpack(*pack('')) == ''
+
+
+def test_compress_texts_stored_plain(tmp_path, monkeypatch):
+    database = SQLiteDatabase(str(tmp_path / 'store.db'))
+    database.add_class('class', 'teacher')
+    class_id = database.get_classes()[0][0]
+    chapter_id = database.add_chapter(class_id, 'chapter')
+    # written before compression was switched on
+    monkeypatch.setattr(textstore, 'COMPRESS_TEXT', False)
+    for i in range(3):
+        file_id = database.add_file(f'{i}.txt', f'/corpus/{i}.txt', 'txt', '1', chapter_id, class_id)
+        database.add_textfile(file_id, f'{i} {TEXT}')
+    monkeypatch.setattr(textstore, 'COMPRESS_TEXT', True)
+    assert database.compress_texts(batch_size=2) == 3
+    with database.pool.connection() as conn:
+        rows = conn.execute('select content, content_z from textfiles').fetchall()
+    assert all(content is None and content_z is not None for content, content_z in rows)
+    assert sorted(text for file_id, text in database.search('database')) == [f'{i} {TEXT}' for i in range(3)]
+    # nothing is left to compress
+    assert database.compress_texts() == 0
+    database.pool.close()
@@ -0,0 +1,61 @@
+import shutil
+
+import pytest
+
+from sqlite_database import SQLiteDatabase
+from watcher import FolderSync, WatchState
+
+
+@pytest.fixture
+def chapter(tmp_path, monkeypatch):
+    # the sandboxed workers extract through a cache of their own
+    monkeypatch.setenv('CORPORA_CACHE_DIR', str(tmp_path / 'cache'))
+    database = SQLiteDatabase(str(tmp_path / 'corpora.db'))
+    database.add_class('class', 'teacher')
+    class_id = database.get_classes()[0][0]
+    chapter_id = database.add_chapter(class_id, 'chapter')
+    sync = FolderSync(database, WatchState(str(tmp_path / 'watch.db')))
+    yield database, sync, chapter_id, class_id
+    sync.close()
+    sync.state.close()
+    database.pool.close()
+
+
+def names(database, class_id, chapter_id):
+    return sorted(file[1] for file in database.get_files(class_id)[0][chapter_id])
+
+
+def found(database, keyword):
+    return sorted(hit[1] for hit in database.search_files(keyword))
+
+
+def test_folder_sync(tmp_path, chapter):
+    database, sync, chapter_id, class_id = chapter
+    folder = tmp_path / 'folder'
+    (folder / 'sub').mkdir(parents=True)
+    (folder / 'a.txt').write_text('alpha 数据库', encoding='utf-8')
+    (folder / 'sub' / 'b.txt').write_text('bravo', encoding='utf-8')
+    (folder / '.hidden.txt').write_text('hidden', encoding='utf-8')
+    assert sync.scan(chapter_id, class_id, str(folder))
+    assert names(database, class_id, chapter_id) == ['a.txt', 'b.txt']
+    assert found(database, '数据库') == ['a.txt']
+    # nothing changed
+    assert not sync.scan(chapter_id, class_id, str(folder))
+
+    # modified in place, the file keeps its id
+    file_id = database.search_files('alpha')[0][0]
+    (folder / 'a.txt').write_text('gamma ray', encoding='utf-8')
+    assert sync.apply(chapter_id, class_id, [str(folder / 'a.txt')])
+    assert [hit[0] for hit in database.search_files('gamma')] == [file_id]
+    assert found(database, 'alpha') == []
+
+    # deleted
+    (folder / 'a.txt').unlink()
+    assert sync.apply(chapter_id, class_id, [str(folder / 'a.txt')])
+    assert names(database, class_id, chapter_id) == ['b.txt']
+
+    # a whole subdirectory removed, only the directory is reported
+    shutil.rmtree(folder / 'sub')
+    assert sync.scan(chapter_id, class_id, str(folder / 'sub'))
+    assert names(database, class_id, chapter_id) == []
+    assert sync.state.paths_under(chapter_id, str(folder)) == []